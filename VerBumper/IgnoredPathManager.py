@@ -2,12 +2,15 @@ import sys
 import PySimpleGUI as pySGUI
 
 from utils import *
+from storage import *
 
 class GUInterface:
-    def __init__(self, ignored_files_file, folder, name):
+    def __init__(self, ignored_files_file, folder, name, host=None):
         self.folder = folder
         self.name = name
-        self.ignored_paths = IgnoredPathsStorage(ignored_files_file)
+        self.host = host
+        # Hosted editors change the list the other tools already hold
+        self.ignored_paths = host.get_project(name, folder).ignored_paths if host is not None else IgnoredPathsStorage(ignored_files_file)
         self.selected_path = None
         self.layout = [
             [pySGUI.Text('Ignored Paths:', size=(70, 1)), pySGUI.Button('Exit')],
@@ -19,33 +22,37 @@ class GUInterface:
     def run(self):
         while True:
             event, values = self.wnd.Read()
-            if event in (None, 'Exit'):
-                sys.exit()
-            elif event == "LB":
-                if len(values["LB"]) > 0:
-                    self.selected_path = values["LB"][0]
-                else:
-                    self.selected_path = None
-            elif event == "_ADD_FOLDER":
-                _folder = pySGUI.popup_get_folder("Select a folder to add to the ignore list")
-                if _folder is not None:
-                    self.ignored_paths.paths.add(_folder.replace('\\', '/'))
-                    self.ignored_paths.save()
-            elif event == "_ADD_FILE":
-                _file = pySGUI.popup_get_file("Select a file to add to the ignore list")
-                if _file is not None:
-                    self.ignored_paths.paths.add(_file.replace('\\', '/'))
-                    self.ignored_paths.save()
-            elif event == "_REMOVE_SELECTED":
-                try:
-                    self.ignored_paths.paths.remove(self.selected_path)
-                    self.selected_path = None
-                except:
-                    pass
-                finally:
-                    self.ignored_paths.save()
-            self.wnd.Element("LB").Update(values=[str(x) for x in self.ignored_paths.paths])
-            self.wnd.Element("_REMOVE_SELECTED").Update(disabled=self.selected_path is None)
+            with batched_writes():
+                if event in (None, 'Exit'):
+                    if self.host is not None:
+                        self.wnd.close()
+                        return
+                    sys.exit()
+                elif event == "LB":
+                    if len(values["LB"]) > 0:
+                        self.selected_path = values["LB"][0]
+                    else:
+                        self.selected_path = None
+                elif event == "_ADD_FOLDER":
+                    _folder = pySGUI.popup_get_folder("Select a folder to add to the ignore list")
+                    if _folder is not None:
+                        self.ignored_paths.paths.add(_folder.replace('\\', '/'))
+                        self.ignored_paths.save()
+                elif event == "_ADD_FILE":
+                    _file = pySGUI.popup_get_file("Select a file to add to the ignore list")
+                    if _file is not None:
+                        self.ignored_paths.paths.add(_file.replace('\\', '/'))
+                        self.ignored_paths.save()
+                elif event == "_REMOVE_SELECTED":
+                    try:
+                        self.ignored_paths.paths.remove(self.selected_path)
+                        self.selected_path = None
+                    except:
+                        pass
+                    finally:
+                        self.ignored_paths.save()
+                self.wnd.Element("LB").Update(values=[str(x) for x in self.ignored_paths.paths])
+                self.wnd.Element("_REMOVE_SELECTED").Update(disabled=self.selected_path is None)
 
 
 if __name__ == '__main__':
@@ -1,64 +1,51 @@
-import json
 import pathlib
+import queue
 import sys
 import os
+import threading
 import time
 import PySimpleGUI as pySGUI
 import subprocess
 
 from utils import *
+from storage import *
+from toolhost import *
+from api import get_change_detection
+from gitchanges import *
+from batch import *
 
 DOUBLE_CLICK_MAX_INTERVAL = 0.25
 
-class Config:
-    def __init__(self, file):
-        self.file = file
-        self.db = None
-        self.ready = False
-        self.load()
-
-    def load(self):
-        try:
-            with open(self.file) as data:
-                self.db = json.load(data)
-        except FileNotFoundError:
-            debug_print('No previous projects data found.')
-        except json.decoder.JSONDecodeError:
-            debug_print('Failure to read malformed previous projects data file.')
-        except Exception as e:
-            debug_print('Failure to read projects data.\n{0}: {1}.'.format(type(e).__name__, e.args[0]))
-        else:
-            self.ready = True
-        finally:
-            if self.ready is not True:
-                self.db = {
-                    "projects": {}
-                }
-                self.save()
-
-    def save(self):
-        try:
-            with open(self.file, "w") as data:
-                json.dump(self.db, data, indent=4)
-        except Exception as e:
-            debug_print('Failure to write projects.\n{0}: {1}'.format(type(e).__name__, e.args[0]))
-
 class GUInterface:
-    def __init__(self):
-        self.config = Config('config.json')
+    def __init__(self, host=None):
+        self.host = host
+        self.config = host.config if host is not None else Config('config.json')
         self.selectedproject = None
         self.selectedprojecttimestamp = 0
         self.updater_window = None
+        # Changes Built status is computed off the UI thread, newest requests first
+        self.status_cache = dict()
+        self.status_generation = dict()
+        self.status_pending = set()
+        self.status_queue = queue.LifoQueue()
+        self.status_worker = threading.Thread(target=self.status_worker_loop, name='ProjectStatusWorker', daemon=True)
+        self.batch_thread = None
+        self.batch_cancel = threading.Event()
+        self.batch_done = 0
+        self.batch_total = 0
         self.layout = [
             [pySGUI.Text('Projects:', size=(25, 1)), pySGUI.Button('Exit'), pySGUI.Button('Reload Data', key='_RELOAD_DATA_', size=(10, 1))],
             [pySGUI.Listbox(values=list(map(lambda x: str(x), self.config.db['projects'].keys())), bind_return_key=True, select_mode=pySGUI.LISTBOX_SELECT_MODE_SINGLE, size=(47, 15), enable_events=True, key="ProjectList")],
             [pySGUI.Text(text=self.get_project_data_string(), size=(43, 5), text_color='black', background_color="lightblue", key="_PROJECT_INFO_")],
-            [pySGUI.Text(text=self.get_selected_project_last_edited(), size=(40, 1), key="_UP_TO_DATE_")],
+            [pySGUI.Text(text=self.get_selected_project_status(), size=(40, 1), key="_UP_TO_DATE_")],
             [pySGUI.Button("Add Project", key="_ADD_PROJECT_"), pySGUI.Button("Remove Project", key="_REMOVE_PROJECT_", disabled=True), pySGUI.Button("Run Project", key="_RUN_PROJECT_", disabled=True), pySGUI.Button("Explore", key="_EXPLORE_", disabled=True)],
             [pySGUI.Button("Edit Project Directory", key="_EDIT_PROJECT_FOLDER_", disabled=True), pySGUI.Button("Edit Project Name", key="_EDIT_PROJECT_NAME_", disabled=True)],
-            [pySGUI.Button("Edit Ignored Paths for Project", key="_EDIT_IGNORE_PATHS", disabled=True)]
+            [pySGUI.Button("Edit Ignored Paths for Project", key="_EDIT_IGNORE_PATHS", disabled=True)],
+            [pySGUI.Button("Refresh All Projects", key="_BATCH_STATUS_"), pySGUI.Button("Bump All Changed Projects", key="_BATCH_BUMP_")],
+            [pySGUI.Text(text="", size=(30, 1), key="_BATCH_PROGRESS_"), pySGUI.Button("Cancel", key="_BATCH_CANCEL_", disabled=True)]
             ]
-        self.wnd = pySGUI.Window('Projects', layout=self.layout, size=(390, 520))
+        self.wnd = pySGUI.Window('Projects', layout=self.layout, size=(390, 550))
+        self.status_worker.start()
 
     def get_project_data_string(self):
         return 'Selected Project:{0}\nPath:\n{1}'.format(self.selectedproject, split_path_string_on(self.get_selected_project_path(), 40, '/'))
@@ -72,35 +59,109 @@ class GUInterface:
             return _path if os.path.exists(_path) or return_incorrect else None
         return None
 
+    def get_project_ignore_paths(self, project, as_object: bool = False):
+        if self.get_project_db_data(project) is not None:
+            _obj = IgnoredPathsStorage(str(pathlib.Path(f'./ProjectData/{project}/ignored_paths.json').absolute()).replace('\\', '/'))
+            return _obj if as_object else _obj.matcher
+        return None if as_object else IgnoredPathsMatcher()
+
     def get_selected_project_ignore_paths(self, as_object: bool = False):
-        if self.get_project_db_data(self.selectedproject) is not None:
-            _obj = IgnoredPathsStorage(str(pathlib.Path(f'./ProjectData/{self.selectedproject}/ignored_paths.json').absolute()).replace('\\', '/'))
-            return _obj if as_object else _obj.paths
-        return None if as_object else set()
+        return self.get_project_ignore_paths(self.selectedproject, as_object)
+
+    def get_scan_workers(self):
+        return int(self.config.db.get('scan_workers', DEFAULT_SCAN_WORKERS))
 
     def get_project_last_build_timestamp(self, project):
         try:
-            with open(os.path.join(self.config.db['projects'][project]['path'], 'version.json'), 'r') as vd:
-                ver = json.load(vd)
-                return ver['buildstamp']
+            return read_json(os.path.join(self.config.db['projects'][project]['path'], 'version.json'))['buildstamp']
         except:
             return 0
 
+    def get_project_build_commit(self, project):
+        if get_change_detection(project, self.config) != 'git':
+            return None
+        _store = ChangeLogStore(project)
+        try:
+            return get_build_commit(_store)
+        finally:
+            _store.close()
+
     def get_project_last_edited(self, project):
         if self.get_project_db_data(project) is not None:
-            return f"Changes Built: {get_no_file_changes_after_build_text(self.get_project_last_build_timestamp(project), self.config.db['projects'][project]['path'], ignored=self.get_selected_project_ignore_paths())}"
+            _scan = scan_project_changes(self.get_project_last_build_timestamp(project), self.config.db['projects'][project]['path'], self.get_project_ignore_paths(project),
+                                         workers=self.get_scan_workers(), mode=get_change_detection(project, self.config), build_commit=self.get_project_build_commit(project))
+            return f"Changes Built: {get_no_file_changes_after_build_text(_scan)}"
         else:
             return "Changes Built: ?"
 
-    def get_selected_project_last_edited(self):
-        return self.get_project_last_edited(self.selectedproject)
+    def get_selected_project_status(self):
+        """Last known Changes Built status of the selected project, never touches the disk."""
+        if self.get_project_db_data(self.selectedproject) is None:
+            return "Changes Built: ?"
+        return self.status_cache.get(self.selectedproject, "Changes Built: ...")
+
+    def request_project_status(self, project, *, force: bool = False):
+        if self.get_project_db_data(project) is None or (project in self.status_pending and not force):
+            return
+        self.status_generation[project] = self.status_generation.get(project, 0) + 1
+        self.status_pending.add(project)
+        self.status_queue.put((project, self.status_generation[project]))
+
+    def invalidate_project_status(self, project=None):
+        if project is None:
+            self.status_cache.clear()
+        else:
+            self.status_cache.pop(project, None)
+        if self.selectedproject is not None and project in (None, self.selectedproject):
+            self.request_project_status(self.selectedproject, force=True)
+
+    def status_worker_loop(self):
+        while True:
+            project, generation = self.status_queue.get()
+            if generation != self.status_generation.get(project, None):
+                continue
+            try:
+                _status = self.get_project_last_edited(project)
+            except Exception as e:
+                debug_print('Failure to compute project status.\n{0}: {1}'.format(type(e).__name__, e))
+                _status = "Changes Built: ?"
+            self.wnd.write_event_value('_STATUS_READY_', (project, generation, _status))
+
+    def get_batch_workers(self):
+        return int(self.config.db.get('batch_workers', DEFAULT_BATCH_WORKERS))
+
+    def start_batch(self, bump_changed: bool):
+        if self.batch_thread is not None:
+            return
+        self.batch_cancel.clear()
+        self.batch_done = 0
+        self.batch_total = len(self.config.db['projects'])
+        self.batch_thread = threading.Thread(target=self.batch_worker, args=(bump_changed,), name='ProjectBatch', daemon=True)
+        self.batch_thread.start()
+
+    def batch_worker(self, bump_changed: bool):
+        try:
+            _reports = run_batch(self.config, bump_changed=bump_changed, workers=self.get_batch_workers(), scan_workers=self.get_scan_workers(),
+                                 on_report=lambda x: self.wnd.write_event_value('_BATCH_PROJECT_', (x.name, get_batch_status_text(x))),
+                                 cancel=self.batch_cancel)
+            _text = format_batch_report(_reports)
+        except Exception as e:
+            _text = 'Failure to run the batch.\n{0}: {1}'.format(type(e).__name__, e)
+        self.wnd.write_event_value('_BATCH_DONE_', _text)
 
     def reload_project_list(self):
         self.wnd.Refresh()
         self.wnd.Element("ProjectList").Update(values=list(map(lambda x: str(x), self.config.db['projects'].keys())))
 
     def run_project(self):
-        if self.get_selected_project_path() is not None:
+        if self.get_selected_project_path() is not None and self.host is not None:
+            self.wnd.Hide()
+            try:
+                self.host.run_version_manager(str(self.get_project_db_data(self.selectedproject)['path']), self.selectedproject)
+            finally:
+                self.wnd.UnHide()
+            self.invalidate_project_status(self.selectedproject)
+        elif self.get_selected_project_path() is not None:
             self.updater_window = subprocess.Popen(
                 ['pythonw' if not isDebug else 'python', 'VersionFileManager.py', str(self.get_project_db_data(self.selectedproject)['path']),
                  self.selectedproject], shell=False, stdin=None, stdout=None, stderr=None)
@@ -114,85 +175,139 @@ class GUInterface:
     def run(self):
         while True:
             event, values = self.wnd.Read()
-            if event in (None, 'Exit'):
-                sys.exit()
-            elif event == "_ADD_PROJECT_":
-                _GetFolder = pySGUI.PopupGetFolder("Select a Project Folder")
-                if _GetFolder is not None:
-                    if os.path.exists(_GetFolder):
-                        _GetNewName = pySGUI.PopupGetText('Enter New Project Name')
-                        if _GetNewName is not None:
-                            if _GetNewName not in self.config.db['projects']:
-                                self.config.db['projects'][_GetNewName] = {
-                                    "path": _GetFolder
-                                }
-                                self.selectedproject = _GetNewName
-                                self.config.save()
-                            else:
-                                pySGUI.Popup("This Project name already exists.")
-                    else:
-                        pySGUI.Popup("Incorrect Directory Selected.")
-                self.reload_project_list()
-            elif event == "_REMOVE_PROJECT_":
-                self.config.db['projects'].pop(self.selectedproject, None)
-                self.reload_project_list()
-                self.selectedproject = None
-                self.config.save()
-            elif event == "ProjectList":
-                if len(values["ProjectList"]) > 0:
+            with batched_writes():
+                if event in (None, 'Exit'):
+                    if self.batch_thread is not None:
+                        # Builds being written finish, everything else stops at its next folder or file
+                        self.batch_cancel.set()
+                        self.batch_thread.join()
+                    if self.host is not None:
+                        self.wnd.close()
+                        return
+                    sys.exit()
+                elif event == "_ADD_PROJECT_":
+                    _GetFolder = pySGUI.PopupGetFolder("Select a Project Folder")
+                    if _GetFolder is not None:
+                        if os.path.exists(_GetFolder):
+                            _GetNewName = pySGUI.PopupGetText('Enter New Project Name')
+                            if _GetNewName is not None:
+                                if _GetNewName not in self.config.db['projects']:
+                                    self.config.db['projects'][_GetNewName] = {
+                                        "path": _GetFolder
+                                    }
+                                    self.selectedproject = _GetNewName
+                                    self.config.save()
+                                    self.invalidate_project_status(_GetNewName)
+                                else:
+                                    pySGUI.Popup("This Project name already exists.")
+                        else:
+                            pySGUI.Popup("Incorrect Directory Selected.")
+                    self.reload_project_list()
+                elif event == "_REMOVE_PROJECT_":
+                    self.config.db['projects'].pop(self.selectedproject, None)
+                    self.status_cache.pop(self.selectedproject, None)
+                    self.reload_project_list()
+                    self.selectedproject = None
+                    self.config.save()
+                elif event == "ProjectList":
+                    if len(values["ProjectList"]) > 0:
+                        if self.selectedproject is not None:
+                            if self.selectedproject == values['ProjectList'][0] and abs(time.time() - self.selectedprojecttimestamp) <= DOUBLE_CLICK_MAX_INTERVAL:
+                                self.run_project()
+                        if self.selectedproject != values["ProjectList"][0]:
+                            self.request_project_status(values["ProjectList"][0])
+                        self.selectedproject = values["ProjectList"][0]
+                        self.selectedprojecttimestamp = time.time()
+                elif event == "_RUN_PROJECT_":
+                    self.run_project()
+                elif event == "_EXPLORE_":
                     if self.selectedproject is not None:
-                        if self.selectedproject == values['ProjectList'][0] and abs(time.time() - self.selectedprojecttimestamp) <= DOUBLE_CLICK_MAX_INTERVAL:
-                            self.run_project()
-                    self.selectedproject = values["ProjectList"][0]
-                    self.selectedprojecttimestamp = time.time()
-            elif event == "_RUN_PROJECT_":
-                self.run_project()
-            elif event == "_EXPLORE_":
-                if self.selectedproject is not None:
-                    if os.path.exists(self.get_selected_project_path()):
-                        os.system(f'start {self.get_selected_project_path()}')
-            elif event == "_EDIT_PROJECT_FOLDER_":
-                _GetFolder = pySGUI.PopupGetFolder("Select New Project Folder", default_path=self.get_selected_project_path(return_incorrect=True))
-                if _GetFolder is not None:
-                    if os.path.exists(_GetFolder):
-                        self.config.db['projects'][self.selectedproject]['path'] = _GetFolder
-                        self.reload_project_list()
-                        self.config.save()
-                    else:
-                        pySGUI.Popup("Incorrect Directory Selected.")
-            elif event == "_EDIT_PROJECT_NAME_":
-                _GetNewName = pySGUI.PopupGetText('Enter New Project Name')
-                if _GetNewName is not None:
-                    if _GetNewName not in self.config.db['projects']:
-                        self.config.db['projects'][_GetNewName] = self.get_project_db_data(self.selectedproject)
-                        self.config.db['projects'].pop(self.selectedproject, None)
-                        self.selectedproject = _GetNewName
-                        self.config.save()
-                        self.reload_project_list()
+                        if os.path.exists(self.get_selected_project_path()):
+                            os.system(f'start {self.get_selected_project_path()}')
+                elif event == "_EDIT_PROJECT_FOLDER_":
+                    _GetFolder = pySGUI.PopupGetFolder("Select New Project Folder", default_path=self.get_selected_project_path(return_incorrect=True))
+                    if _GetFolder is not None:
+                        if os.path.exists(_GetFolder):
+                            self.config.db['projects'][self.selectedproject]['path'] = _GetFolder
+                            self.reload_project_list()
+                            self.config.save()
+                            self.invalidate_project_status(self.selectedproject)
+                        else:
+                            pySGUI.Popup("Incorrect Directory Selected.")
+                elif event == "_EDIT_PROJECT_NAME_":
+                    _GetNewName = pySGUI.PopupGetText('Enter New Project Name')
+                    if _GetNewName is not None:
+                        if _GetNewName not in self.config.db['projects']:
+                            self.config.db['projects'][_GetNewName] = self.get_project_db_data(self.selectedproject)
+                            self.config.db['projects'].pop(self.selectedproject, None)
+                            self.status_cache.pop(self.selectedproject, None)
+                            self.selectedproject = _GetNewName
+                            self.config.save()
+                            self.reload_project_list()
+                            self.invalidate_project_status(_GetNewName)
+                        else:
+                            pySGUI.Popup("This Project name already exists.")
+                elif event == "_EDIT_IGNORE_PATHS":
+                    if self.get_selected_project_path() is not None and self.host is not None:
+                        self.host.run_ignored_paths_editor(self.selectedproject, str(self.get_project_db_data(self.selectedproject)['path']))
+                        self.invalidate_project_status(self.selectedproject)
+                    elif self.get_selected_project_path() is not None:
+                        _ignore_path_editor_window = subprocess.Popen(
+                            ['pythonw' if not isDebug else 'python', 'IgnoredPathManager.py', str(pathlib.Path(f'./ProjectData/{self.selectedproject}/ignored_paths.json').absolute()).replace('\\', '/'), str(self.get_project_db_data(self.selectedproject)['path']), self.selectedproject],
+                            shell=False, stdin=None, stdout=None, stderr=None)
+                        if _ignore_path_editor_window is not None:
+                            _ignore_path_editor_window.wait()
+                        self.invalidate_project_status(self.selectedproject)
                     else:
-                        pySGUI.Popup("This Project name already exists.")
-            elif event == "_EDIT_IGNORE_PATHS":
-                if self.get_selected_project_path() is not None:
-                    _ignore_path_editor_window = subprocess.Popen(
-                        ['pythonw' if not isDebug else 'python', 'IgnoredPathManager.py', str(pathlib.Path(f'./ProjectData/{self.selectedproject}/ignored_paths.json').absolute()).replace('\\', '/'), str(self.get_project_db_data(self.selectedproject)['path']), self.selectedproject],
-                        shell=False, stdin=None, stdout=None, stderr=None)
-                    if _ignore_path_editor_window is not None:
-                        _ignore_path_editor_window.wait()
-                else:
-                    pySGUI.Popup("Selected Project does not have a correct path setup and cannot be launched.",
-                                 title="Error", button_type=pySGUI.POPUP_BUTTONS_ERROR)
-            elif event == "_RELOAD_DATA_":
-                self.reload_project_list()
-            self.wnd.Element("_PROJECT_INFO_").Update(value=self.get_project_data_string())
-            self.wnd.Element("_UP_TO_DATE_").Update(value=self.get_selected_project_last_edited())
-            self.wnd.Element("_EDIT_PROJECT_FOLDER_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
-            self.wnd.Element("_EXPLORE_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
-            self.wnd.Element("_EDIT_PROJECT_NAME_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
-            self.wnd.Element("_EDIT_IGNORE_PATHS").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
-            self.wnd.Element("_REMOVE_PROJECT_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
-            self.wnd.Element("_RUN_PROJECT_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
+                        pySGUI.Popup("Selected Project does not have a correct path setup and cannot be launched.",
+                                     title="Error", button_type=pySGUI.POPUP_BUTTONS_ERROR)
+                elif event == "_RELOAD_DATA_":
+                    self.reload_project_list()
+                    self.invalidate_project_status()
+                elif event in ("_BATCH_STATUS_", "_BATCH_BUMP_"):
+                    if event == "_BATCH_STATUS_" or pySGUI.PopupYesNo("Record a build with the next code revision for every project with unbuilt changes?",
+                                                                      title="Bump All Changed Projects") == 'Yes':
+                        self.start_batch(event == "_BATCH_BUMP_")
+                elif event == "_BATCH_PROJECT_":
+                    _project, _status = values["_BATCH_PROJECT_"]
+                    # Newer than any single project status still being computed
+                    self.status_generation[_project] = self.status_generation.get(_project, 0) + 1
+                    self.status_pending.discard(_project)
+                    self.status_cache[_project] = _status
+                    self.batch_done += 1
+                elif event == "_BATCH_CANCEL_":
+                    self.batch_cancel.set()
+                elif event == "_BATCH_DONE_":
+                    self.batch_thread = None
+                    pySGUI.PopupScrolled(values["_BATCH_DONE_"], title="Projects", size=(100, 20))
+                elif event == "_STATUS_READY_":
+                    _project, _generation, _status = values["_STATUS_READY_"]
+                    if _generation == self.status_generation.get(_project, None):
+                        self.status_cache[_project] = _status
+                        self.status_pending.discard(_project)
+                self.wnd.Element("_PROJECT_INFO_").Update(value=self.get_project_data_string())
+                self.wnd.Element("_UP_TO_DATE_").Update(value=self.get_selected_project_status())
+                self.wnd.Element("_EDIT_PROJECT_FOLDER_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
+                self.wnd.Element("_EXPLORE_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
+                self.wnd.Element("_EDIT_PROJECT_NAME_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
+                self.wnd.Element("_EDIT_IGNORE_PATHS").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
+                self.wnd.Element("_REMOVE_PROJECT_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
+                self.wnd.Element("_RUN_PROJECT_").Update(disabled=(self.get_project_db_data(self.selectedproject) is None))
+                self.wnd.Element("_BATCH_STATUS_").Update(disabled=self.batch_thread is not None)
+                self.wnd.Element("_BATCH_BUMP_").Update(disabled=self.batch_thread is not None)
+                self.wnd.Element("_BATCH_CANCEL_").Update(disabled=self.batch_thread is None or self.batch_cancel.is_set())
+                self.wnd.Element("_BATCH_PROGRESS_").Update(value=get_batch_progress_text(self.batch_done, self.batch_total, self.batch_thread is not None,
+                                                                                          self.batch_cancel.is_set()))
 
 
 if __name__ == "__main__":
-    GUI = GUInterface()
-    GUI.run()
+    _config = Config('config.json')
+    if is_single_process_requested(_config):
+        _host = ToolHost(_config)
+        try:
+            GUInterface(host=_host).run()
+        finally:
+            _host.close()
+    else:
+        GUI = GUInterface()
+        GUI.run()
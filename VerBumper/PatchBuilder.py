@@ -2,29 +2,42 @@ import pathlib
 import sys
 import os
 import PySimpleGUI as pySGUI
-import shutil
 
 from typing import Optional, Union
 
 from utils import *
+from patchengine import *
+from api import write_patch
+from instrumentation import *
+from tasks import *
 
 class GUInterface:
-    def __init__(self, name, projectpath, current_coderev):
+    def __init__(self, name, projectpath, current_coderev, host=None):
         self.name = name
         self.project_path = projectpath
         self.cur_coderev = int(current_coderev)
-        self.changelogs_path = str(pathlib.Path(f"./ProjectData/{name}/ChangeLogs").absolute())
+        self.host = host
+        self.changelog_store = host.get_project(name, projectpath).changelog_store if host is not None else ChangeLogStore(name)
         self.patches_folder = str(pathlib.Path(f'./ProjectData/{name}/Patches').absolute())
         self.selected_coderev = None
         self.changelog = None
         self.changes_paths = set()
-        self.patches = sorted([x.name for x in os.scandir(self.changelogs_path)], reverse=True) # noqa
+        self.task = None
+        self.task_output = None
+        self.patches = [str(x) for x in self.changelog_store.get_coderevs()]
         self.layout = [
             [pySGUI.Text('CodeRev Changelogs:', size=(28, 1)), pySGUI.Text('List of Changed Files: ')],
             [pySGUI.Listbox(values=self.patches, size=(30, 20), enable_events=True, key="LB"), pySGUI.Listbox(values=[], size=(90, 20), key="_CHANGES")],
-            [pySGUI.Button("Build a patch", key="_BUILD_PATCH", disabled=True), pySGUI.Button('Exit')],
+            [pySGUI.Button("Build a patch", key="_BUILD_PATCH", disabled=True), pySGUI.Text('Copy Mode:'),
+             pySGUI.Combo(values=list(PATCH_COPY_MODES), default_value=PATCH_COPY_MODES[0], readonly=True, key="_COPY_MODE"),
+             pySGUI.Text('Output:'), pySGUI.Combo(values=list(PATCH_OUTPUT_FORMATS), default_value=PATCH_OUTPUT_FORMATS[0], readonly=True, key="_OUTPUT_FORMAT"),
+             pySGUI.Text('Level:'), pySGUI.Spin(values=list(range(0, 10)), initial_value=DEFAULT_COMPRESSION_LEVEL, size=(2, 1), key="_COMPRESSION_LEVEL"),
+             pySGUI.Button('Exit')],
+            [pySGUI.Checkbox('Delta against base:', default=False, key="_DELTA"), pySGUI.Input(key="_DELTA_BASE", size=(70, 1)),
+             pySGUI.FolderBrowse(initial_folder=self.patches_folder)],
+            [pySGUI.Text('', size=(60, 1), key="_TASK_TEXT"), pySGUI.Button('Cancel', key="_CANCEL_TASK", disabled=True)],
             ]
-        self.wnd = pySGUI.Window(f'{name}: Patch Builder', layout=self.layout, size=(800, 440))
+        self.wnd = pySGUI.Window(f'{name}: Patch Builder', layout=self.layout, size=(800, 500))
         self.first_draw = True
 
     def select_clog(self, clog: Optional[Union[str, int]], *, set_cursor: bool = False):
@@ -38,15 +51,19 @@ class GUInterface:
                 if set_cursor:
                     self.wnd.Element("LB").Update(set_to_index=_vals.index(clog))
                 self.selected_coderev = os.path.splitext(clog)[0]
-            self.changelog = ChangeLog(self.name, coderev=self.selected_coderev)
+            self.changelog = ChangeLog(self.name, coderev=self.selected_coderev, store=self.changelog_store)
         else:
             self.changelog = None
             self.selected_coderev = None
         if self.changelog is not None:
-            self.changes_paths = get_changed_files_paths_from_changelogs(self.changelog, self.cur_coderev, self.name)
+            self.changes_paths = get_changed_files_paths_from_changelogs(self.changelog, self.cur_coderev, self.name, self.changelog_store)
         else:
             self.changes_paths = set()
 
+    def write_patch(self, progress: TaskProgress, paths, out: str, fmt: str, mode: str, level: int, delta_base: Optional[str]) -> PatchCopyResult:
+        with metrics.timer('patch.build'):
+            return write_patch(self.project_path, paths, out, fmt, mode, level, delta_base, progress)
+
     def run(self):
         while True:
             event, values = self.wnd.Read(timeout=100 if self.first_draw else None)
@@ -57,7 +74,38 @@ class GUInterface:
                     self.first_draw = False
             else:
                 if event in (None, 'Exit'):
+                    if self.task is not None:
+                        self.task.cancel()
+                        self.task.wait()
+                    metrics.write_session(self.name, 'PatchBuilder')
+                    if self.host is not None:
+                        self.wnd.close()
+                        return
                     sys.exit()
+                elif event == "_CANCEL_TASK":
+                    if self.task is not None:
+                        self.task.cancel()
+                elif event == "_PATCH_TASK_PROGRESS":
+                    self.wnd.Element("_TASK_TEXT").Update(value=format_task_progress(*values[event]))
+                elif event == "_PATCH_TASK_DONE":
+                    _copy_result, _error = values[event]
+                    _patch_dir, _patch_out = self.task_output
+                    self.task = None
+                    self.wnd.Element("_CANCEL_TASK").Update(disabled=True)
+                    if _error is None:
+                        self.wnd.Element("_TASK_TEXT").Update(value=format_task_progress('Done', _copy_result.files, _copy_result.bytes))
+                        debug_print(f'Packed {_copy_result.files} files, {_copy_result.bytes} bytes into {_patch_out}')
+                        if len(_copy_result.failed) > 0:
+                            pySGUI.Popup("Failed to copy:\n{0}".format("\n".join(_copy_result.failed)), title="Patch Incomplete")
+                        os.system(f'start {_patch_dir if _patch_out == _patch_dir else self.patches_folder}/')
+                    elif isinstance(_error, TaskCancelled):
+                        self.wnd.Element("_TASK_TEXT").Update(value='Cancelled, the partial patch was removed')
+                    else:
+                        self.wnd.Element("_TASK_TEXT").Update(value='')
+                        pySGUI.Popup(f'{type(_error).__name__}: {_error}', title="Patch Failed")
+                elif self.task is not None:
+                    # The selection and the patch settings stay as they are until the running build is done
+                    pass
                 elif event == "LB":
                     try:
                         _clog = values["LB"][0]
@@ -66,31 +114,31 @@ class GUInterface:
                     else:
                         self.select_clog(values["LB"][0])
                 elif event == "_BUILD_PATCH":
-                    _patch_dir = f'{self.patches_folder}/{self.changelog.coderev}#{self.cur_coderev}'
-                    if not os.path.exists(_patch_dir):
-                        os.makedirs(_patch_dir, exist_ok=True)
-                    for _pf in self.changes_paths:
-                        debug_print(f'    Copying {_pf}')
-                        _end_dir = _patch_dir
-                        if _pf.startswith(self.project_path):
-                            _patch_subdir = os.path.dirname(_pf)[len(self.project_path):].replace('\\', '/')
-                            if _patch_subdir.startswith('/'):
-                                _patch_subdir = _patch_subdir[1:]
-                            debug_print(f"      Patch subdir: {_patch_subdir}")
-                            _end_dir = os.path.join(_patch_dir, _patch_subdir).replace('\\', '/')
-                            if not os.path.exists(_end_dir):
-                                debug_print(f"      Creating {_end_dir}")
-                                os.makedirs(_end_dir, exist_ok=True)
-                        debug_print(f'      to {_end_dir}')
-                        shutil.copy2(_pf, _end_dir)
-                    # Get the version file as well if it exists
+                    _delta_base = values["_DELTA_BASE"] if values["_DELTA"] else None
+                    if _delta_base is not None and not os.path.isdir(_delta_base):
+                        pySGUI.Popup(f"The delta base folder {_delta_base or '(empty)'} does not exist.\nPick a previous patch or base folder, or uncheck Delta against base.",
+                                     title="Error", button_type=pySGUI.POPUP_BUTTONS_ERROR)
+                        continue
                     try:
-                        shutil.copy2(os.path.join(self.project_path, 'version.json'), _patch_dir)
-                    except:
-                        pass
-                    os.system(f'start {_patch_dir}/')
+                        _level = int(values["_COMPRESSION_LEVEL"])
+                        if not 0 <= _level <= 9:
+                            raise ValueError
+                    except (TypeError, ValueError):
+                        pySGUI.Popup(f"The compression level {values['_COMPRESSION_LEVEL']} is not a number from 0 to 9.",
+                                     title="Error", button_type=pySGUI.POPUP_BUTTONS_ERROR)
+                        continue
+                    _patch_dir = f'{self.patches_folder}/{self.changelog.coderev}#{self.cur_coderev}'
+                    _output_format = values["_OUTPUT_FORMAT"]
+                    if _output_format in PATCH_ARCHIVE_FORMATS:
+                        _patch_out = get_patch_archive_path(_patch_dir, _output_format)
+                    else:
+                        _patch_out = _patch_dir
+                    self.task_output = (_patch_dir, _patch_out)
+                    self.task = BackgroundTask(self.wnd, '_PATCH_TASK', self.write_patch, list(self.changes_paths), _patch_out, _output_format, values["_COPY_MODE"],
+                                               _level, _delta_base).start()
+                    self.wnd.Element("_CANCEL_TASK").Update(disabled=False)
             self.wnd.Element("_CHANGES").Update(values=[x[len(self.project_path) if x.startswith(self.project_path) else 0:] for x in self.changes_paths])
-            self.wnd.Element("_BUILD_PATCH").Update(disabled=self.selected_coderev is None)
+            self.wnd.Element("_BUILD_PATCH").Update(disabled=self.selected_coderev is None or self.task is not None)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,8 @@
-import json
-import os
 import sys
 import PySimpleGUI as pySGUI
 
 from utils import *
+from prodlog import *
 
 def fill_text_with_data(data):
     prod = data.get('productivity', 'Unknown')
@@ -11,55 +10,82 @@ def fill_text_with_data(data):
         prod = round(prod, 2)
     return f"Start Time: {data.get('sessionstart', 'Unknown')}\nEnd Time: {data.get('sessionend', 'Unknown')}\nFull Length: {format_seconds_to_str(data.get('full_length', 0))}\nPause Duration: {format_seconds_to_str(data.get('pause_duration', 0))}\nActual Duration: {format_seconds_to_str(data.get('duration', 0))}\nCode Revisions: {str(data.get('code_revisions', 'Unknown'))} | Average Revision Time: {format_seconds_to_str(data.get('t_per_revision', 0))}\nSession Productivity: {str(prod)}%"
 
+def fill_text_with_summary(data, title):
+    return f"{title}: {data.get('sessions', 0)} sessions | {format_seconds_to_str(data.get('duration', 0))} | {data.get('code_revisions', 0)} revisions"
+
 class GUInterface:
-    def __init__(self, folder):
+    def __init__(self, folder, host=None):
         self.folder = folder
+        self.host = host
+        # Days are parsed when selected, the dates and totals come from the summary index
         self.pld = {}
+        self.index = ProdLogSummaryIndex(folder)
         self.load()
         self.layout = [
             [pySGUI.Text('Log Dates:', size=(14, 1)), pySGUI.Text('Start Times:', size=(9, 1)), pySGUI.Button('Exit'),
-             pySGUI.Button('Reload Data', key='_RELOAD_DATA_', size=(10, 1))],
-            [pySGUI.Listbox(values=list(map(lambda x: str(x), self.pld.keys())), size=(14, 15), enable_events=True,
+             pySGUI.Button('Reload Data', key='_RELOAD_DATA_', size=(10, 1)), pySGUI.Button('Analytics', key='_ANALYTICS_')],
+            [pySGUI.Listbox(values=self.index.get_dates(), size=(14, 15), enable_events=True,
                             key="LB"),
              pySGUI.Listbox(values=[], key="SesList", enable_events=True, size=(27, 15))],
+            [pySGUI.Text(fill_text_with_summary(self.index.get_totals(), 'All'), size=(48, 1), key="TotalText")],
+            [pySGUI.Text(fill_text_with_summary({}, 'Day'), size=(48, 1), key="DayText")],
             [pySGUI.Text('_' * 48, justification='center')],
             [pySGUI.Text(fill_text_with_data({}), key="SesText")]
             ]
-        self.wnd = pySGUI.Window('Productivity Log Data', layout=self.layout, size=(390, 460))
+        self.wnd = pySGUI.Window('Productivity Log Data', layout=self.layout, size=(390, 500))
 
     def load(self):
-        if os.path.exists(self.folder):
-            for pl in os.listdir(path=self.folder):
-                fn = pl.split('.')[0]
-                self.pld[fn] = []
-                with open(os.path.join(self.folder, pl)) as data:
-                    jd = json.load(data)
-                    for d in jd:
-                        self.pld[fn].append(d)
+        # Legacy per day JSON arrays are moved to the append-only format the first time the reader sees them
+        convert_legacy_prod_logs(self.folder)
+        self.index.refresh()
+
+    def get_day(self, date):
+        if date not in self.pld:
+            self.pld[date] = read_day(self.folder, date)
+        return self.pld[date]
+
+    def show_analytics(self):
+        # Imported on first use, it is the only part of the reader that reads the whole history
+        import analytics
+        _text = analytics.format_summary(analytics.summarize(self.folder))
+        _wnd = pySGUI.Window('Productivity Analytics', [[pySGUI.Multiline(_text, size=(100, 40), font=('Courier', 9), disabled=True)], [pySGUI.Button('Close')]],
+                             modal=True)
+        _wnd.Read()
+        _wnd.close()
 
     def run(self):
         while True:
             event, values = self.wnd.Read()
             if event in (None, 'Exit'):
+                if self.host is not None:
+                    self.wnd.close()
+                    return
                 sys.exit()
             elif event == "LB":
                 if len(values["LB"]) > 0:
                     LBSel = list(
                         map(lambda x: (str(x['sessionstart'].split(" ")[1]) + " - " + str(x['sessionend'].split(" ")[1])),
-                            self.pld[values["LB"][0]]))
+                            self.get_day(values["LB"][0])))
                     self.wnd.Element("SesList").Update(values=LBSel)
+                    self.wnd.Element("DayText").Update(value=fill_text_with_summary(self.index.get_day(values["LB"][0]), values["LB"][0]))
+                    # Checking the day against its log may have moved the totals
+                    self.wnd.Element("TotalText").Update(value=fill_text_with_summary(self.index.get_totals(), 'All'))
             elif event == "SesList":
                 if len(values["SesList"]) > 0:
                     ses = self.wnd.Element("SesList").GetListValues()
-                    dt = self.pld[values["LB"][0]][ses.index(values["SesList"][0])]
+                    dt = self.get_day(values["LB"][0])[ses.index(values["SesList"][0])]
                     txt = fill_text_with_data(dt)
                     self.wnd.Element("SesText").Update(value=txt)
+            elif event == "_ANALYTICS_":
+                self.show_analytics()
             elif event == "_RELOAD_DATA_":
                 self.pld = {}
                 self.load()
                 self.wnd.Refresh()
-                self.wnd.Element("LB").Update(values=list(map(lambda x: str(x), self.pld.keys())))
+                self.wnd.Element("LB").Update(values=self.index.get_dates())
                 self.wnd.Element("SesList").Update(values=[])
+                self.wnd.Element("TotalText").Update(value=fill_text_with_summary(self.index.get_totals(), 'All'))
+                self.wnd.Element("DayText").Update(value=fill_text_with_summary({}, 'Day'))
 
 
 if __name__ == '__main__':
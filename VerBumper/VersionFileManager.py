@@ -1,4 +1,3 @@
-import json
 import pathlib
 import shutil
 import sys
@@ -8,71 +7,15 @@ import datetime
 import PySimpleGUI as pySGUI
 import subprocess
 
-from typing import Union, List
+from typing import Union, List, Optional
 
 from utils import *
-
-class VerFile(object):
-    def __init__(self, file):
-        self.file = file
-        self.data = {}
-        self.coderev = 0
-        self.verdata = dict()
-        self.ready = False
-        self.load()
-
-    def load(self, force=False):
-        if not self.ready or force:
-            try:
-                with open(self.file, "r") as data:
-                    self.data = json.load(data)
-            except FileNotFoundError:
-                debug_print('No previous versioning data found.')
-            except json.decoder.JSONDecodeError:
-                debug_print('Failure to read malformed previous versioning data file.')
-            except Exception as e:
-                debug_print('Failure to read previous versioning data.\n{0}: {1}.'.format(type(e).__name__, e.args[0]))
-            else:
-                self.coderev = int(self.data['coderev'])
-                verstring = self.data.get('version', None)
-                if verstring is not None:
-                    _vdata = verstring.split('-')
-                    if len(_vdata) > 1:
-                        self.verdata['AV'] = _vdata[1]
-                    else:
-                        self.verdata['AV'] = ""
-                    _vdata = _vdata[0].split('.')
-                    self.verdata['PV'] = int(_vdata[0])
-                    self.verdata['MJV'] = int(_vdata[1])
-                    self.verdata['MNV'] = int(_vdata[2])
-                    self.ready = True
-            finally:
-                if self.ready is False:
-                    self.verdata['AV'] = 'not_set'
-                    self.verdata['PV'] = 0
-                    self.verdata['MJV'] = 0
-                    self.verdata['MNV'] = 0
-                    self.coderev = -1
-                    self.ready = True
-                    self.save()
-
-    def save(self):
-        if self.ready:
-            curtime = datetime.datetime.now()
-            self.data = {
-                "version": "{0}.{1}.{2}{3}".format(self.verdata['PV'], self.verdata['MJV'], self.verdata['MNV'],
-                                                   '-{}'.format(self.verdata['AV']) if len(
-                                                       self.verdata['AV']) > 0 else ""),
-                "coderev": "{0}".format(self.coderev),
-                "buildstamp": round(curtime.timestamp()),
-                "buildtime": notzformat.format(curtime.astimezone(mtz))
-            }
-            try:
-                with open(self.file, "w") as data:
-                    json.dump(self.data, data, indent=4)
-            except Exception as e:
-                debug_print('Failure to write versioning data.\n{0}: {1}'.format(type(e).__name__, e.args[0]))
-
+from prodlog import *
+from changewatcher import *
+from instrumentation import *
+from api import record_build, is_version_module_requested, get_change_detection
+from gitchanges import *
+from tasks import *
 
 class CSession(object):
     def __init__(self, verf, prod_log_folder):
@@ -100,18 +43,8 @@ class CSession(object):
         for p in self.pauses:
             pauses += p
         slength = round((self.endtime - self.starttime).seconds)
-        sessions = None
         endcoderev = self.verd.coderev
         if self.startrev != endcoderev:
-            try:
-                with open('{0}/{1}.json'.format(self.plfolder, self.starttime.date()), "r") as plog:
-                    sessions = json.load(plog)
-            except FileNotFoundError:
-                pass
-            except json.decoder.JSONDecodeError:
-                pass
-            except Exception:
-                pass
             sessionaudit = {
                 "sessionstart": notzformat.format(self.starttime),
                 "sessionend": notzformat.format(datetime.datetime.now().astimezone(mtz)),
@@ -122,15 +55,14 @@ class CSession(object):
                 "code_revisions": endcoderev - self.startrev,
                 "t_per_revision": round((slength - pauses) / (endcoderev - self.startrev), 1)
             }
-            if sessions is not None:
-                sessions.append(sessionaudit)
-            else:
-                sessions = [
-                    sessionaudit
-                ]
-            with open('{0}/{1}.json'.format(self.plfolder, self.starttime.date()), "w") as plog:
-                json.dump(sessions, plog, indent=4)
+            append_session(self.plfolder, self.starttime.date(), sessionaudit)
+
 
+# Start a scan or a build, only one task runs at a time
+TASK_EVENTS = ('_SAVE_VER_DATA_', '_UPDATE_FILE_CHANGES_', '_UNBUILT_C_', '_WATCHER_UPDATE_')
+# Change the version data a running build is saving
+VERSION_EVENTS = ('_UPD_PROJ_', '_UPD_MAJ_', '_UPD_MIN_', '_UPD_ADD_VER_', '_PL_INCR_CR_', '_CANCEL_CHANGES_', '_MAN_VER_ENT_BUTTON_',
+                  '_PRODLOGGER_START_BUTTON_', '_BUILD_PATCH')
 
 def parse_version_info_to_string(data, with_av=True, text=True):
     av = ('-' + data.get('AV', '')) if len(data.get('AV', '')) > 0 else ''
@@ -147,25 +79,40 @@ def get_prodlogger_button_text(state):
     return f"{'Launch Productivity Logger' if state else 'End Productivity Logger Session'}"
 
 class GUInterface:
-    def __init__(self, path, name):
+    def __init__(self, path, name, host=None):
+        self.host = host
         self.cses = None
         self.changes_made = False
         self.add_ver_changed = False
         self.manual_version_entry_active = False
         self.prod_log_reader_inst = None
         self.project_name = name
-        self.ignored_folders = IgnoredPathsStorage(str(pathlib.Path(f'./ProjectData/{name}/ignored_paths.json').absolute()).replace('\\', '/'))
+        # Hosted tools share the stores the host already loaded for the project
+        _project = host.get_project(name, path, reload_version=True) if host is not None else None
+        if _project is not None:
+            self.ignored_folders = _project.ignored_paths
+        else:
+            self.ignored_folders = IgnoredPathsStorage(str(pathlib.Path(f'./ProjectData/{name}/ignored_paths.json').absolute()).replace('\\', '/'))
         self.prod_log_folder = str(pathlib.Path(f'./ProjectData/{name}/ProdLogs').absolute())
         if not os.path.exists(self.prod_log_folder):
             os.makedirs(self.prod_log_folder, exist_ok=True)
-        self.changelogs_folder = str(pathlib.Path(f'./ProjectData/{name}/ChangeLogs').absolute())
-        if not os.path.exists(self.changelogs_folder):
-            os.makedirs(self.changelogs_folder, exist_ok=True)
+        self.changelog_store = _project.changelog_store if _project is not None else ChangeLogStore(name)
         self.patches_folder = str(pathlib.Path(f'./ProjectData/{name}/Patches').absolute())
         self.forceupdatecoderev = False
-        self.vf = VerFile(os.path.join(path, 'version.json'))
+        self.vf = _project.vf if _project is not None else VerFile(os.path.join(path, 'version.json'), is_version_module_requested(name))
         self.project_path = path
-        self.build_uptodate = get_no_file_changes_after_build(self.vf.data['buildstamp'], self.project_path)
+        self.change_detection = _project.change_detection if _project is not None else get_change_detection(name)
+        # Started by the first scan task, its initial scan is as long as any other
+        self.watcher = None
+        if is_watcher_requested():
+            self.watcher = ProjectChangeWatcher(self.project_path, self.vf.data['buildstamp'], self.ignored_folders.matcher)
+        # Scans and builds run as background tasks, the first scan starts once the window is up
+        self.task = None
+        self.rescan_pending = False
+        self.show_unbuilt_after_scan = False
+        self.coderev_before_build = None
+        self.scan = None
+        self.build_uptodate = True
         self.main_gui_layout = [[pySGUI.Text(parse_version_info_to_string(self.vf.verdata), key="_VERSION_TEXT_", size=(25, 1)),
                                 pySGUI.Button("Exit", key="_EXIT_BUTTON_"), pySGUI.Button("Cancel", key="_CANCEL_CHANGES_", disabled=True)],
                                 [pySGUI.Text(parse_code_rev_string(self.vf.coderev), key="_CODEREV_TEXT_", size=(22, 1)),
@@ -173,8 +120,9 @@ class GUInterface:
                                 [pySGUI.Text(parse_build_time(self.vf.data['buildtime']), key="_BUILDTIME_TEXT_", size=(24, 1)),
                                 pySGUI.Button("ProdLog Reader", key="_PROD_LOG_READER_")],
                                 [pySGUI.Button("Last File Change:", key="_UPDATE_FILE_CHANGES_"), pySGUI.Button("Up to Date" if self.build_uptodate else "Unbuilt Changes", size=(15, 1), key="_UNBUILT_C_", disabled=self.build_uptodate), pySGUI.Button('Explore', key="_EXPLORE_")],
-                                [pySGUI.Text(get_no_file_changes_after_build_text(self.vf.data['buildstamp'], self.project_path, ignored=self.ignored_folders.paths), size=(28, 1), key="_FILE_CHANGE_"),
+                                [pySGUI.Text("Scanning...", size=(28, 1), key="_FILE_CHANGE_"),
                                  pySGUI.Button("Build Patch", key="_BUILD_PATCH")],
+                                [pySGUI.Text("", size=(28, 1), key="_TASK_TEXT_"), pySGUI.Button("Cancel Task", key="_CANCEL_TASK_", disabled=True)],
                                 [pySGUI.Text("Prod Tracker Start Time: "),
                                 pySGUI.Text("N/A", size=(15, 1), key="_PRODLOGGER_START_TIME_TEXT_")],
                                 [pySGUI.Button("Major Update", key="_UPD_PROJ_"),
@@ -187,9 +135,62 @@ class GUInterface:
                                 pySGUI.InputText(default_text=parse_version_info_to_string(self.vf.verdata, False, False), size=(20, 1),
                                                  key="_MANUAL_VER_INPUT_", disabled=True)]
                                 ]
-        self.updater_gui_wnd = pySGUI.Window("Version Updater", self.main_gui_layout, disable_close=True)
+        self.updater_gui_wnd = pySGUI.Window("Version Updater", self.main_gui_layout, disable_close=True, finalize=True)
+        if self.watcher is not None:
+            self.watcher.on_change = lambda: self.updater_gui_wnd.write_event_value('_WATCHER_UPDATE_', None)
+            self.watcher.on_failure = lambda e: self.updater_gui_wnd.write_event_value('_WATCHER_FAILED_', None)
+        self.start_scan()
         self.run_gui()
 
+    def scan_project(self, progress: Optional[TaskProgress] = None) -> ScanResult:
+        if progress is not None:
+            progress.set_stage('Scanning')
+        _watcher = self.watcher
+        if _watcher is not None and _watcher.failed is None:
+            if not _watcher.is_running():
+                try:
+                    _watcher.start(progress)
+                except WatcherUnavailable as e:
+                    debug_print(f'Live change watcher unavailable, falling back to scans. {e}')
+                    _watcher.failed = e
+            if _watcher.failed is None:
+                return _watcher.get_scan_result()
+        return scan_project_changes(self.vf.data['buildstamp'], self.project_path, self.ignored_folders.matcher,
+                                    mode=self.change_detection, build_commit=get_build_commit(self.changelog_store), progress=progress)
+
+    def build_project(self, progress: TaskProgress) -> ScanResult:
+        return record_build(self.project_name, self.project_path, self.vf, self.changelog_store, self.scan_project(progress), progress)
+
+    def start_task(self, key: str, fn, *args):
+        """Runs fn on a worker, its progress and result come back as key + '_PROGRESS' and key + '_DONE' events."""
+        self.task = BackgroundTask(self.updater_gui_wnd, key, fn, *args).start()
+        self.updater_gui_wnd.Element("_CANCEL_TASK_").Update(disabled=False)
+
+    def finish_task(self, error: Optional[BaseException]):
+        self.task = None
+        self.updater_gui_wnd.Element("_CANCEL_TASK_").Update(disabled=True)
+        self.updater_gui_wnd.Element("_TASK_TEXT_").Update(value="Cancelled" if isinstance(error, TaskCancelled) else "")
+        if error is not None and not isinstance(error, TaskCancelled):
+            debug_print(f'Task failed: {type(error).__name__}: {error}')
+            pySGUI.Popup(f'{type(error).__name__}: {error}', title='Task Failed')
+
+    def drop_failed_watcher(self):
+        if self.watcher is not None and self.watcher.failed is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def is_building(self) -> bool:
+        return self.task is not None and self.task.key == '_BUILD_TASK'
+
+    def start_scan(self):
+        self.rescan_pending = False
+        self.start_task('_SCAN_TASK', self.scan_project)
+
+    def update_file_change_status(self, scan: ScanResult):
+        self.scan = scan
+        self.build_uptodate = scan.up_to_date
+        self.updater_gui_wnd.Element("_FILE_CHANGE_").Update(value=get_no_file_changes_after_build_text(scan))
+
     def run_gui(self):
         while True:
             if self.vf.coderev == -1:
@@ -215,142 +216,206 @@ class GUInterface:
                     else:
                         pySGUI.Popup("Incorrect Input Type.")
                 else:
+                    metrics.write_session(self.project_name, 'VersionFileManager')
+                    if self.host is not None:
+                        self.updater_gui_wnd.close()
+                        return
                     sys.exit()
             else:
                 event, values = self.updater_gui_wnd.Read(timeout=10 if self.forceupdatecoderev else None)
-                if self.forceupdatecoderev is True:
-                    self.updater_gui_wnd.Element("_CODEREV_TEXT_").Update(value=parse_code_rev_string(self.vf.coderev))
-                    self.forceupdatecoderev = False
-                else:
-                    if event == '_UPD_PROJ_':
-                        self.vf.verdata["PV"] += 1
-                        self.vf.verdata["MJV"] = 0
-                        self.vf.verdata["MNV"] = 0
-                        self.changes_made = True
-                    elif event == '_UPD_MAJ_':
-                        self.vf.verdata["MJV"] += 1
-                        self.vf.verdata["MNV"] = 0
-                        self.changes_made = True
-                    elif event == '_UPD_MIN_':
-                        self.vf.verdata["MNV"] += 1
-                        self.changes_made = True
-                    elif event == '_UPD_ADD_VER_':
-                        if self.updater_gui_wnd.Element('_UPD_ADD_VER_').Get() != self.vf.verdata['AV']:
-                            self.add_ver_changed = True
-                        else:
-                            self.add_ver_changed = False
-                    elif event == '_PL_INCR_CR_':
-                        self.vf.coderev += 1
-                        self.changes_made = True
-                    elif event == '_SAVE_VER_DATA_':
-                        if self.cses is not None and self.cses.startrev == self.vf.coderev:
+                with batched_writes():
+                    if self.forceupdatecoderev is True:
+                        self.updater_gui_wnd.Element("_CODEREV_TEXT_").Update(value=parse_code_rev_string(self.vf.coderev))
+                        self.forceupdatecoderev = False
+                    else:
+                        if event == '_CANCEL_TASK_':
+                            if self.task is not None:
+                                self.task.cancel()
+                        elif event in ('_SCAN_TASK_PROGRESS', '_BUILD_TASK_PROGRESS'):
+                            self.updater_gui_wnd.Element("_TASK_TEXT_").Update(value=format_task_progress(*values[event]))
+                        elif event == '_WATCHER_FAILED_':
+                            # The watched change set went stale, every check scans the tree from now on
+                            self.drop_failed_watcher()
+                            if self.task is not None:
+                                self.rescan_pending = True
+                            else:
+                                self.start_scan()
+                        elif event == '_SCAN_TASK_DONE':
+                            _scan, _error = values[event]
+                            self.finish_task(_error)
+                            self.drop_failed_watcher()
+                            if _error is None:
+                                self.update_file_change_status(_scan)
+                                if self.show_unbuilt_after_scan:
+                                    pySGUI.Popup(get_unbuilt_changed_files_text(self.scan), title='Unbuilt Changes')
+                            self.show_unbuilt_after_scan = False
+                            if self.rescan_pending:
+                                self.start_scan()
+                        elif event == '_BUILD_TASK_DONE':
+                            _scan, _error = values[event]
+                            self.finish_task(_error)
+                            if _error is None:
+                                if self.watcher is not None:
+                                    self.watcher.reset(self.vf.data['buildstamp'])
+                                self.update_file_change_status(_scan)
+                                self.changes_made = False
+                                self.add_ver_changed = False
+                            else:
+                                # Nothing was written, the version data stays unsaved
+                                self.vf.coderev = self.coderev_before_build
+                            self.coderev_before_build = None
+                            if self.rescan_pending:
+                                self.start_scan()
+                        elif self.task is not None and event in TASK_EVENTS:
+                            # One task at a time, changes seen by the watcher meanwhile are scanned once it is done
+                            if event == '_WATCHER_UPDATE_':
+                                self.rescan_pending = True
+                        elif self.is_building() and event in VERSION_EVENTS:
+                            # Their buttons are disabled while the build runs, an event may still have been queued before
+                            pass
+                        elif event == '_UPD_PROJ_':
+                            self.vf.verdata["PV"] += 1
+                            self.vf.verdata["MJV"] = 0
+                            self.vf.verdata["MNV"] = 0
+                            self.changes_made = True
+                        elif event == '_UPD_MAJ_':
+                            self.vf.verdata["MJV"] += 1
+                            self.vf.verdata["MNV"] = 0
+                            self.changes_made = True
+                        elif event == '_UPD_MIN_':
+                            self.vf.verdata["MNV"] += 1
+                            self.changes_made = True
+                        elif event == '_UPD_ADD_VER_':
+                            if self.updater_gui_wnd.Element('_UPD_ADD_VER_').Get() != self.vf.verdata['AV']:
+                                self.add_ver_changed = True
+                            else:
+                                self.add_ver_changed = False
+                        elif event == '_PL_INCR_CR_':
                             self.vf.coderev += 1
-                        adver = self.updater_gui_wnd.Element('_UPD_ADD_VER_').Get()
-                        self.vf.verdata['AV'] = adver
-                        # Changelogs
-                        _changed_files = get_unbuilt_changed_files(self.vf.data['buildstamp'], self.project_path, self.ignored_folders.paths)
-                        _cl = ChangeLog(self.project_name, self.vf.coderev)
-                        _cl.paths.update([x[0].path.replace('\\', '/') for x in _changed_files])
-                        _cl.save()
-                        self.vf.save()
-                        self.updater_gui_wnd.Element("_FILE_CHANGE_").Update(
-                            value=get_no_file_changes_after_build_text(self.vf.data['buildstamp'], self.project_path, ignored=self.ignored_folders.paths))
-                        self.build_uptodate = get_no_file_changes_after_build(self.vf.data['buildstamp'], self.project_path, ignored=self.ignored_folders.paths)
-                        self.changes_made = False
-                        self.add_ver_changed = False
-                    elif event == '_BUILD_PATCH':
-                        _patch_builder_window = subprocess.Popen(
-                            ['pythonw' if not isDebug else 'python', 'PatchBuilder.py', self.project_name, self.project_path, str(self.vf.coderev)], shell=False, stdin=None, stdout=None, stderr=None)
-                        if _patch_builder_window is not None:
-                            _patch_builder_window.wait()
-                    elif event == '_UPDATE_FILE_CHANGES_':
-                        self.build_uptodate = get_no_file_changes_after_build(self.vf.data['buildstamp'], self.project_path, ignored=self.ignored_folders.paths)
-                        self.updater_gui_wnd.Element("_FILE_CHANGE_").Update(
-                            value=get_no_file_changes_after_build_text(self.vf.data['buildstamp'], self.project_path, self.build_uptodate, ignored=self.ignored_folders.paths))
-                    elif event == '_EXPLORE_':
-                        if os.path.exists(self.project_path):
-                            os.system(f'start {self.project_path}')
-                    elif event == '_UNBUILT_C_':
-                        pySGUI.Popup(get_unbuilt_changed_files_text(get_unbuilt_changed_files(self.vf.data['buildstamp'], self.project_path, ignored_paths=self.ignored_folders.paths)), title='Unbuilt Changes')
-                    elif event == '_CANCEL_CHANGES_':
-                        self.vf.load(True)
-                        self.updater_gui_wnd.Element('_UPD_ADD_VER_').Update(value=self.vf.verdata['AV'])
-                        self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(
-                            value=parse_version_info_to_string(self.vf.verdata, False, False))
-                        self.changes_made = False
-                        self.add_ver_changed = False
-                    elif event == '_PRODLOGGER_START_BUTTON_':
-                        if self.cses is None:
-                            self.cses = CSession(self.vf, str(self.prod_log_folder))
-                        else:
-                            self.cses.end()
-                            self.cses = None
-                        self.updater_gui_wnd.Element("_PL_PAUSE_").Update(disabled=(self.cses is None))
-                        self.updater_gui_wnd.Element("_PRODLOGGER_START_TIME_TEXT_").Update(
-                            value=notzformat.format(self.cses.starttime) if self.cses else 'N/A')
-                    elif event == '_MAN_VER_ENT_BUTTON_':
-                        if not self.manual_version_entry_active:
-                            self.manual_version_entry_active = True
-                            self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(disabled=(not self.manual_version_entry_active))
-                            self.updater_gui_wnd.Element("_MAN_VER_ENT_BUTTON_").Update(text='Manual Version Entry')
-                        else:
-                            vdata = self.updater_gui_wnd.Element('_MANUAL_VER_INPUT_').Get()
-                            if len(vdata) > 0:
-                                if len(vdata.split('.')) == 3:
-                                    vdata = vdata.split('.')
-                                    self.vf.verdata['PV'] = int(vdata[0])
-                                    self.vf.verdata['MJV'] = int(vdata[1])
-                                    self.vf.verdata['MNV'] = int(vdata[2])
-                                    self.manual_version_entry_active = False
-                                    self.updater_gui_wnd.Element("_MAN_VER_ENT_BUTTON_").Update(text='Unlock Version Entry')
-                                    self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(
-                                        disabled=(not self.manual_version_entry_active))
-                                    self.changes_made = True
+                            self.changes_made = True
+                        elif event == '_SAVE_VER_DATA_':
+                            self.coderev_before_build = self.vf.coderev
+                            if self.cses is not None and self.cses.startrev == self.vf.coderev:
+                                self.vf.coderev += 1
+                            adver = self.updater_gui_wnd.Element('_UPD_ADD_VER_').Get()
+                            self.vf.verdata['AV'] = adver
+                            # Changelogs
+                            self.start_task('_BUILD_TASK', self.build_project)
+                        elif event == '_BUILD_PATCH':
+                            if self.host is not None:
+                                self.host.run_patch_builder(self.project_name, self.project_path, self.vf.coderev)
+                            else:
+                                _patch_builder_window = subprocess.Popen(
+                                    ['pythonw' if not isDebug else 'python', 'PatchBuilder.py', self.project_name, self.project_path, str(self.vf.coderev)], shell=False, stdin=None, stdout=None, stderr=None)
+                                if _patch_builder_window is not None:
+                                    _patch_builder_window.wait()
+                        elif event in ('_UPDATE_FILE_CHANGES_', '_WATCHER_UPDATE_'):
+                            self.start_scan()
+                        elif event == '_EXPLORE_':
+                            if os.path.exists(self.project_path):
+                                os.system(f'start {self.project_path}')
+                        elif event == '_UNBUILT_C_':
+                            self.show_unbuilt_after_scan = True
+                            self.start_scan()
+                        elif event == '_CANCEL_CHANGES_':
+                            self.vf.load(True)
+                            self.updater_gui_wnd.Element('_UPD_ADD_VER_').Update(value=self.vf.verdata['AV'])
+                            self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(
+                                value=parse_version_info_to_string(self.vf.verdata, False, False))
+                            self.changes_made = False
+                            self.add_ver_changed = False
+                        elif event == '_PRODLOGGER_START_BUTTON_':
+                            if self.cses is None:
+                                self.cses = CSession(self.vf, str(self.prod_log_folder))
+                            else:
+                                self.cses.end()
+                                self.cses = None
+                            self.updater_gui_wnd.Element("_PL_PAUSE_").Update(disabled=(self.cses is None))
+                            self.updater_gui_wnd.Element("_PRODLOGGER_START_TIME_TEXT_").Update(
+                                value=notzformat.format(self.cses.starttime) if self.cses else 'N/A')
+                        elif event == '_MAN_VER_ENT_BUTTON_':
+                            if not self.manual_version_entry_active:
+                                self.manual_version_entry_active = True
+                                self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(disabled=(not self.manual_version_entry_active))
+                                self.updater_gui_wnd.Element("_MAN_VER_ENT_BUTTON_").Update(text='Manual Version Entry')
+                            else:
+                                vdata = self.updater_gui_wnd.Element('_MANUAL_VER_INPUT_').Get()
+                                if len(vdata) > 0:
+                                    if len(vdata.split('.')) == 3:
+                                        vdata = vdata.split('.')
+                                        self.vf.verdata['PV'] = int(vdata[0])
+                                        self.vf.verdata['MJV'] = int(vdata[1])
+                                        self.vf.verdata['MNV'] = int(vdata[2])
+                                        self.manual_version_entry_active = False
+                                        self.updater_gui_wnd.Element("_MAN_VER_ENT_BUTTON_").Update(text='Unlock Version Entry')
+                                        self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(
+                                            disabled=(not self.manual_version_entry_active))
+                                        self.changes_made = True
+                                    else:
+                                        self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(
+                                            value=parse_version_info_to_string(self.vf.verdata, False, False))
                                 else:
                                     self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(
                                         value=parse_version_info_to_string(self.vf.verdata, False, False))
+                        elif event == '_PL_PAUSE_':
+                            if self.cses.curpausestarttime is None:
+                                self.cses.pause()
                             else:
-                                self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(
-                                    value=parse_version_info_to_string(self.vf.verdata, False, False))
-                    elif event == '_PL_PAUSE_':
-                        if self.cses.curpausestarttime is None:
-                            self.cses.pause()
-                        else:
-                            self.cses.unpause()
-                        self.updater_gui_wnd.Element("_PL_PAUSE_").Update(
-                            text='Pause' if self.cses.curpausestarttime is None else 'Paused since {}'.format(
-                                notzformat.format(datetime.datetime.fromtimestamp(round(self.cses.curpausestarttime)))))
-                    elif event == "_PROD_LOG_READER_":
-                        if self.prod_log_reader_inst is not None:
-                            self.prod_log_reader_inst.poll()
-                            if self.prod_log_reader_inst.returncode is not None:
-                                self.prod_log_reader_inst = None
-                        if self.prod_log_reader_inst is None:
-                            self.prod_log_reader_inst = subprocess.Popen(['pythonw' if not isDebug else 'python', 'ProdLogReader.py', str(self.prod_log_folder)], shell=False, stdin=None,
-                                                                         stdout=None, stderr=None)
-                    elif event == '_EXIT_BUTTON_' or event == pySGUI.WINDOW_CLOSED:
-                        if self.prod_log_reader_inst is not None:
-                            if self.prod_log_reader_inst.poll() is None:
-                                self.prod_log_reader_inst.kill()
-                        de: os.DirEntry
-                        for patchdir in [de for de in os.scandir(self.patches_folder) if de.is_dir()]:
-                            shutil.rmtree(patchdir.path, True)
-                        # Reopen the Launcher
-                        subprocess.Popen(['pythonw' if not isDebug else 'python', 'Launcher.py'], shell=False, stdin=None, stdout=None, stderr=None)
-                        # Then exit
-                        sys.exit()
-                    self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(value=parse_version_info_to_string(self.vf.verdata, False, False))
-                    self.updater_gui_wnd.Element("_PRODLOGGER_START_BUTTON_").Update(text=get_prodlogger_button_text(self.cses is None))
-                    self.updater_gui_wnd.Element("_PRODLOGGER_START_BUTTON_").Update(
-                        disabled=(self.changes_made or self.add_ver_changed))
-                    self.updater_gui_wnd.Element("_VERSION_TEXT_").Update(value=parse_version_info_to_string(self.vf.verdata))
-                    self.updater_gui_wnd.Element("_CODEREV_TEXT_").Update(value=parse_code_rev_string(self.vf.coderev))
-                    self.updater_gui_wnd.Element("_BUILDTIME_TEXT_").Update(value=parse_build_time(self.vf.data['buildtime']))
-                    self.updater_gui_wnd.Element("_UNBUILT_C_").Update(disabled=self.build_uptodate, text="Up to Date" if self.build_uptodate else "Unbuilt Changes")
-                    self.updater_gui_wnd.Element("_CANCEL_CHANGES_").Update(disabled=(not self.changes_made and not self.add_ver_changed))
-                    self.updater_gui_wnd.Element("_EXIT_BUTTON_").Update(
-                        disabled=(self.cses is not None or self.changes_made or self.add_ver_changed))
-                    self.updater_gui_wnd.Element("_SAVE_VER_DATA_").Update(disabled=(not self.changes_made and not self.add_ver_changed))
+                                self.cses.unpause()
+                            self.updater_gui_wnd.Element("_PL_PAUSE_").Update(
+                                text='Pause' if self.cses.curpausestarttime is None else 'Paused since {}'.format(
+                                    notzformat.format(datetime.datetime.fromtimestamp(round(self.cses.curpausestarttime)))))
+                        elif event == "_PROD_LOG_READER_":
+                            if self.host is not None:
+                                self.host.run_prod_log_reader(str(self.prod_log_folder))
+                            else:
+                                if self.prod_log_reader_inst is not None:
+                                    self.prod_log_reader_inst.poll()
+                                    if self.prod_log_reader_inst.returncode is not None:
+                                        self.prod_log_reader_inst = None
+                                if self.prod_log_reader_inst is None:
+                                    self.prod_log_reader_inst = subprocess.Popen(['pythonw' if not isDebug else 'python', 'ProdLogReader.py', str(self.prod_log_folder)], shell=False, stdin=None,
+                                                                                 stdout=None, stderr=None)
+                        elif event == '_EXIT_BUTTON_' or event == pySGUI.WINDOW_CLOSED:
+                            if self.task is not None:
+                                self.task.cancel()
+                                self.task.wait()
+                            if self.prod_log_reader_inst is not None:
+                                if self.prod_log_reader_inst.poll() is None:
+                                    self.prod_log_reader_inst.kill()
+                            if self.watcher is not None:
+                                self.watcher.stop()
+                            de: os.DirEntry
+                            for patchdir in [de for de in os.scandir(self.patches_folder) if de.is_dir()]:
+                                shutil.rmtree(patchdir.path, True)
+                            metrics.write_session(self.project_name, 'VersionFileManager')
+                            if self.host is not None:
+                                # The host shows the Launcher again
+                                self.updater_gui_wnd.close()
+                                return
+                            # Reopen the Launcher
+                            subprocess.Popen(['pythonw' if not isDebug else 'python', 'Launcher.py'], shell=False, stdin=None, stdout=None, stderr=None)
+                            # Then exit
+                            sys.exit()
+                        self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(value=parse_version_info_to_string(self.vf.verdata, False, False))
+                        self.updater_gui_wnd.Element("_PRODLOGGER_START_BUTTON_").Update(text=get_prodlogger_button_text(self.cses is None))
+                        _busy = self.task is not None
+                        _building = self.is_building()
+                        self.updater_gui_wnd.Element("_PRODLOGGER_START_BUTTON_").Update(
+                            disabled=(self.changes_made or self.add_ver_changed or _building))
+                        self.updater_gui_wnd.Element("_VERSION_TEXT_").Update(value=parse_version_info_to_string(self.vf.verdata))
+                        self.updater_gui_wnd.Element("_CODEREV_TEXT_").Update(value=parse_code_rev_string(self.vf.coderev))
+                        self.updater_gui_wnd.Element("_BUILDTIME_TEXT_").Update(value=parse_build_time(self.vf.data['buildtime']))
+                        self.updater_gui_wnd.Element("_UNBUILT_C_").Update(disabled=(self.build_uptodate or _busy), text="Up to Date" if self.build_uptodate else "Unbuilt Changes")
+                        self.updater_gui_wnd.Element("_UPDATE_FILE_CHANGES_").Update(disabled=_busy)
+                        # Scans leave the version data alone, only a build locks it
+                        for _key in ('_UPD_PROJ_', '_UPD_MAJ_', '_UPD_MIN_', '_UPD_ADD_VER_', '_PL_INCR_CR_', '_MAN_VER_ENT_BUTTON_', '_BUILD_PATCH'):
+                            self.updater_gui_wnd.Element(_key).Update(disabled=_building)
+                        self.updater_gui_wnd.Element("_MANUAL_VER_INPUT_").Update(disabled=(_building or not self.manual_version_entry_active))
+                        self.updater_gui_wnd.Element("_CANCEL_CHANGES_").Update(disabled=(_building or (not self.changes_made and not self.add_ver_changed)))
+                        self.updater_gui_wnd.Element("_EXIT_BUTTON_").Update(
+                            disabled=(self.cses is not None or self.changes_made or self.add_ver_changed))
+                        self.updater_gui_wnd.Element("_SAVE_VER_DATA_").Update(disabled=(_busy or (not self.changes_made and not self.add_ver_changed)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,9 @@
+import os
+import sys
+
+# The tools import each other as top level modules
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from cli import main
+
+sys.exit(main())
@@ -0,0 +1,218 @@
+import array
+import datetime
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from utils import *
+from prodlog import *
+
+__all__ = ['SessionColumns', 'period_totals', 'rolling_average', 'percentiles', 'hour_heatmap', 'summarize', 'format_summary',
+
+           'DEFAULT_ROLLING_WINDOW', 'DEFAULT_PERCENTILES', 'PERIODS']
+
+DEFAULT_ROLLING_WINDOW = 7
+DEFAULT_PERCENTILES = (10, 25, 50, 75, 90)
+PERIODS = ('week', 'month')
+SESSION_TIME_FORMAT = '%d-%m-%Y %H:%M:%S'
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+_numpy = None
+_numpy_checked = False
+
+def _get_numpy():
+    global _numpy, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy as _np
+            _numpy = _np
+        except ImportError:
+            _numpy = None
+    return _numpy
+
+def _number(value, default=0):
+    return value if isinstance(value, (int, float)) and not isinstance(value, bool) else default
+
+class SessionColumns(object):
+    """
+    Every prod session of a folder as columns, one array per field, sorted by session start.
+    The arrays are array.array, the aggregates use numpy views of them when numpy is installed.
+    """
+    def __init__(self):
+        self.start = array.array('d')
+        self.duration = array.array('d')
+        self.full_length = array.array('d')
+        self.pause_duration = array.array('d')
+        self.code_revisions = array.array('q')
+        self.t_per_revision = array.array('d')
+        self.productivity = array.array('d')
+        self.weekday = array.array('b')
+        self.hour = array.array('b')
+        self.week = array.array('l')
+        self.month = array.array('l')
+
+    def __len__(self):
+        return len(self.start)
+
+    def append(self, session: dict) -> bool:
+        try:
+            _start = datetime.datetime.strptime(str(session.get('sessionstart', '')), SESSION_TIME_FORMAT)
+        except ValueError:
+            return False
+        _iso = _start.isocalendar()
+        self.start.append(_start.replace(tzinfo=mtz).timestamp())
+        self.duration.append(_number(session.get('duration')))
+        self.full_length.append(_number(session.get('full_length')))
+        self.pause_duration.append(_number(session.get('pause_duration')))
+        self.code_revisions.append(int(_number(session.get('code_revisions'))))
+        self.t_per_revision.append(_number(session.get('t_per_revision'), float('nan')))
+        self.productivity.append(_number(session.get('productivity'), float('nan')))
+        self.weekday.append(_start.weekday())
+        self.hour.append(_start.hour)
+        self.week.append(_iso[0] * 100 + _iso[1])
+        self.month.append(_start.year * 100 + _start.month)
+        return True
+
+    @classmethod
+    def from_sessions(cls, sessions: Iterable[dict]) -> 'SessionColumns':
+        _columns = cls()
+        for _session in sessions:
+            _columns.append(_session)
+        _columns.sort()
+        return _columns
+
+    @classmethod
+    def from_folder(cls, folder: str) -> 'SessionColumns':
+        return cls.from_sessions(x[1] for x in iter_all_sessions(folder))
+
+    def sort(self):
+        _order = sorted(range(len(self.start)), key=self.start.__getitem__)
+        if all(_order[i] == i for i in range(len(_order))):
+            return
+        for _name, _column in vars(self).items():
+            setattr(self, _name, array.array(_column.typecode, (_column[i] for i in _order)))
+
+def period_totals(columns: SessionColumns, period: str = 'week') -> List[Tuple[str, int, float, int]]:
+    """(period, sessions, duration, code revisions) of every week (YYYY-Www) or month (YYYY-MM) with sessions."""
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period {period}.")
+    _keys = columns.week if period == 'week' else columns.month
+    _np = _get_numpy()
+    if _np is not None and len(_keys) > 0:
+        _unique, _index = _np.unique(_np.frombuffer(_keys, dtype=_np.dtype(_keys.typecode)), return_inverse=True)
+        _sessions = _np.bincount(_index, minlength=len(_unique))
+        _duration = _np.bincount(_index, weights=_np.frombuffer(columns.duration), minlength=len(_unique))
+        _revisions = _np.bincount(_index, weights=_np.frombuffer(columns.code_revisions, dtype=_np.int64).astype(_np.float64), minlength=len(_unique))
+        _rows = zip(_unique.tolist(), _sessions.tolist(), _duration.tolist(), _revisions.tolist())
+    else:
+        _totals: Dict[int, list] = dict()
+        for _key, _duration, _revisions in zip(_keys, columns.duration, columns.code_revisions):
+            _total = _totals.setdefault(_key, [0, 0.0, 0])
+            _total[0] += 1
+            _total[1] += _duration
+            _total[2] += _revisions
+        _rows = ((k, v[0], v[1], v[2]) for k, v in sorted(_totals.items()))
+    _format = '{0}-W{1:02d}' if period == 'week' else '{0}-{1:02d}'
+    return [(_format.format(k // 100, k % 100), int(s), float(d), int(r)) for k, s, d, r in _rows]
+
+def rolling_average(values: Sequence[float], window: int = DEFAULT_ROLLING_WINDOW) -> List[float]:
+    """Mean of the last window values at every position, NaN values are left out of the mean."""
+    if window < 1:
+        raise ValueError("The rolling window needs to be >= 1.")
+    _np = _get_numpy()
+    if _np is not None:
+        _values = _np.asarray(values, dtype=_np.float64)
+        _valid = ~_np.isnan(_values)
+        _sums = _np.concatenate(([0.0], _np.cumsum(_np.where(_valid, _values, 0.0))))
+        _counts = _np.concatenate(([0], _np.cumsum(_valid)))
+        _starts = _np.maximum(_np.arange(1, len(_values) + 1) - window, 0)
+        _ends = _np.arange(1, len(_values) + 1)
+        _n = _counts[_ends] - _counts[_starts]
+        with _np.errstate(invalid='ignore', divide='ignore'):
+            return (_np.where(_n > 0, (_sums[_ends] - _sums[_starts]) / _np.maximum(_n, 1), _np.nan)).tolist()
+    _result = list()
+    _sum = 0.0
+    _count = 0
+    for i, _value in enumerate(values):
+        if _value == _value:
+            _sum += _value
+            _count += 1
+        if i >= window:
+            _old = values[i - window]
+            if _old == _old:
+                _sum -= _old
+                _count -= 1
+        _result.append(_sum / _count if _count > 0 else float('nan'))
+    return _result
+
+def percentiles(values: Sequence[float], qs: Sequence[float] = DEFAULT_PERCENTILES) -> Dict[str, Optional[float]]:
+    """Linearly interpolated percentiles of the non NaN values, None when there are none."""
+    _np = _get_numpy()
+    if _np is not None:
+        _values = _np.asarray(values, dtype=_np.float64)
+        _values = _values[~_np.isnan(_values)]
+        if len(_values) == 0:
+            return {f'p{q:g}': None for q in qs}
+        return {f'p{q:g}': float(v) for q, v in zip(qs, _np.percentile(_values, qs))}
+    _values = sorted(x for x in values if x == x)
+    _result = dict()
+    for q in qs:
+        if len(_values) == 0:
+            _result[f'p{q:g}'] = None
+            continue
+        _rank = (len(_values) - 1) * q / 100
+        _low = int(_rank)
+        _high = min(_low + 1, len(_values) - 1)
+        _result[f'p{q:g}'] = _values[_low] + (_values[_high] - _values[_low]) * (_rank - _low)
+    return _result
+
+def hour_heatmap(columns: SessionColumns) -> List[List[float]]:
+    """Worked seconds per weekday (rows, Monday first) and starting hour (columns)."""
+    _np = _get_numpy()
+    if _np is not None and len(columns) > 0:
+        _cells = _np.frombuffer(columns.weekday, dtype=_np.int8).astype(_np.int64) * 24 + _np.frombuffer(columns.hour, dtype=_np.int8)
+        return _np.bincount(_cells, weights=_np.frombuffer(columns.duration), minlength=7 * 24).reshape(7, 24).tolist()
+    _heatmap = [[0.0] * 24 for _ in range(7)]
+    for _weekday, _hour, _duration in zip(columns.weekday, columns.hour, columns.duration):
+        _heatmap[_weekday][_hour] += _duration
+    return _heatmap
+
+def summarize(folder: str, window: int = DEFAULT_ROLLING_WINDOW) -> dict:
+    """Every aggregate of a prod log folder in one JSON serialisable dict."""
+    _columns = SessionColumns.from_folder(folder)
+    _rolling = rolling_average(_columns.t_per_revision, window)
+    return {
+        'sessions': len(_columns),
+        'duration': float(sum(_columns.duration)),
+        'code_revisions': int(sum(_columns.code_revisions)),
+        'weekly': [dict(zip(('week', 'sessions', 'duration', 'code_revisions'), x)) for x in period_totals(_columns, 'week')],
+        'monthly': [dict(zip(('month', 'sessions', 'duration', 'code_revisions'), x)) for x in period_totals(_columns, 'month')],
+        'rolling_t_per_revision': {
+            'window': window,
+            'values': [{'start': notzformat.format(datetime.datetime.fromtimestamp(s, mtz)), 't_per_revision': None if v != v else v}
+                       for s, v in zip(_columns.start, _rolling)],
+        },
+        'productivity_percentiles': percentiles(_columns.productivity),
+        't_per_revision_percentiles': percentiles(_columns.t_per_revision),
+        'hour_heatmap': hour_heatmap(_columns),
+    }
+
+def format_summary(summary: dict, last_periods: int = 8) -> str:
+    """Plain text rendering of summarize() for the ProdLog Reader."""
+    _lines = [f"Sessions: {summary['sessions']} | Worked: {format_seconds_to_str(summary['duration'])} | Revisions: {summary['code_revisions']}", '']
+    for _title, _key, _label in (('Weekly', 'weekly', 'week'), ('Monthly', 'monthly', 'month')):
+        _lines.append(f'{_title} totals:')
+        for _row in summary[_key][-last_periods:]:
+            _lines.append(f"  {_row[_label]:<9} {_row['sessions']:>4} sessions  {format_seconds_to_str(_row['duration']):>16}  {_row['code_revisions']:>5} revisions")
+        _lines.append('')
+    _rolling = [x for x in summary['rolling_t_per_revision']['values'] if x['t_per_revision'] is not None]
+    if len(_rolling) > 0:
+        _lines.append(f"Average revision time over the last {summary['rolling_t_per_revision']['window']} sessions: "
+                      f"{format_seconds_to_str(round(_rolling[-1]['t_per_revision']))}")
+    _lines.append('Productivity percentiles: ' + ', '.join(f"{k} {'-' if v is None else f'{v:.1f}%'}" for k, v in summary['productivity_percentiles'].items()))
+    _lines.append('')
+    _lines.append('Worked hours by weekday and starting hour:')
+    _lines.append('     ' + ''.join(f'{h:>3}' for h in range(24)))
+    for _weekday, _row in zip(WEEKDAYS, summary['hour_heatmap']):
+        _lines.append(f'{_weekday}  ' + ''.join(f'{round(x / 3600):>3}' if x > 0 else '  .' for x in _row))
+    return '\n'.join(_lines)
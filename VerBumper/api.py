@@ -0,0 +1,190 @@
+import os
+import pathlib
+import shutil
+import tempfile
+
+from typing import Iterable, Optional, Tuple
+
+from utils import *
+from patchengine import *
+from patchdelta import *
+from instrumentation import *
+from gitchanges import *
+from tasks import *
+
+__all__ = ['Project', 'open_project', 'get_project_names', 'is_version_module_requested', 'get_change_detection', 'bump_version', 'record_build', 'bump', 'scan',
+           'write_patch', 'build_patch', 'get_patch_format_from_path',
+
+           'VERSION_PARTS']
+
+# Same order as the Major/Minor/Patch Update buttons of the Version Updater
+VERSION_PARTS = ('major', 'minor', 'patch')
+VERSION_PART_KEYS = {'major': 'PV', 'minor': 'MJV', 'patch': 'MNV'}
+
+class Project(object):
+    """A project with its version file and everything stored for it under ProjectData/<name>, usable without any GUI."""
+    def __init__(self, name: str, path: str, emit_version_module: bool = False, change_detection: str = DEFAULT_CHANGE_DETECTION):
+        if change_detection not in CHANGE_DETECTION_MODES:
+            raise ValueError(f"Unknown change detection mode {change_detection}.")
+        self.name = name
+        self.path = path
+        self.change_detection = change_detection
+        self.ignored_paths = IgnoredPathsStorage(str(pathlib.Path(f'./ProjectData/{name}/ignored_paths.json').absolute()).replace('\\', '/'))
+        self.changelog_store = ChangeLogStore(name)
+        self.patches_folder = str(pathlib.Path(f'./ProjectData/{name}/Patches').absolute())
+        self.prod_log_folder = str(pathlib.Path(f'./ProjectData/{name}/ProdLogs').absolute())
+        self.vf = VerFile(os.path.join(path, 'version.json'), emit_version_module)
+
+    def close(self):
+        self.changelog_store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+def get_project_names(config: Optional[Config] = None):
+    config = config if config is not None else Config('config.json')
+    return list(config.db['projects'].keys())
+
+def is_version_module_requested(name: str, config: Optional[Config] = None) -> bool:
+    """Whether the emit_version_module key of the project in config.json is on."""
+    config = config if config is not None else Config('config.json')
+    return bool(config.db['projects'].get(name, dict()).get('emit_version_module', False))
+
+def get_change_detection(name: str, config: Optional[Config] = None) -> str:
+    """The change_detection key of the project in config.json, or the top level one, mtime when neither is set or the value is unknown."""
+    config = config if config is not None else Config('config.json')
+    _mode = config.db['projects'].get(name, dict()).get('change_detection', config.db.get('change_detection', DEFAULT_CHANGE_DETECTION))
+    if _mode not in CHANGE_DETECTION_MODES:
+        debug_print(f"Unknown change detection mode {_mode} for {name}, using {DEFAULT_CHANGE_DETECTION}.")
+        return DEFAULT_CHANGE_DETECTION
+    return _mode
+
+def open_project(name: str, config: Optional[Config] = None, path: Optional[str] = None) -> Project:
+    """Opens a project registered in config.json, path overrides the registered folder or opens an unregistered project."""
+    config = config if config is not None else Config('config.json')
+    if path is None:
+        _data = config.db['projects'].get(name, None)
+        if _data is None:
+            raise KeyError(f"Unknown project {name}.")
+        path = _data.get('path', None)
+    if path is None or not os.path.isdir(path):
+        raise FileNotFoundError(f"Project folder {path} does not exist.")
+    return Project(name, path, is_version_module_requested(name, config), get_change_detection(name, config))
+
+def bump_version(verdata: dict, part: Optional[str] = None, subversion: Optional[str] = None) -> dict:
+    """Applies a version update the way the Version Updater buttons do, lower parts are reset."""
+    if part is not None:
+        if part not in VERSION_PARTS:
+            raise ValueError(f"Unknown version part {part}.")
+        _index = VERSION_PARTS.index(part)
+        verdata[VERSION_PART_KEYS[part]] += 1
+        for _lower in VERSION_PARTS[_index + 1:]:
+            verdata[VERSION_PART_KEYS[_lower]] = 0
+    if subversion is not None:
+        verdata['AV'] = subversion
+    return verdata
+
+def record_build(project_name: str, project_path: str, vf: VerFile, store: ChangeLogStore, scan_result: ScanResult,
+                 progress: Optional[TaskProgress] = None) -> ScanResult:
+    """Writes the changelog of vf.coderev from a scan made before the build, saves the version file and returns the scan as of the new build."""
+    if progress is not None:
+        progress.set_stage('Hashing')
+    _content_changes = filter_content_changes(project_path, scan_result.changed_files, store, vf.coderev, progress)
+    _cl = ChangeLog(project_name, vf.coderev, store=store)
+    _cl.paths.update([join_project_path(project_path, x[0].relpath) for x in _content_changes])
+    _cl.save()
+    vf.save()
+    # Recorded for every checkout, switching a project to git change detection then works from its next scan
+    record_build_commit(store, project_path)
+    return scan_result.with_buildtime(vf.data['buildstamp'])
+
+def scan(project: Project, workers: int = DEFAULT_SCAN_WORKERS, progress: Optional[TaskProgress] = None) -> ScanResult:
+    return scan_project_changes(project.vf.data.get('buildstamp', 0), project.path, project.ignored_paths.matcher, workers,
+                                project.change_detection, get_build_commit(project.changelog_store), progress)
+
+def bump(project: Project, part: Optional[str] = None, subversion: Optional[str] = None, coderev: Optional[int] = None,
+         workers: int = DEFAULT_SCAN_WORKERS, scan_result: Optional[ScanResult] = None, progress: Optional[TaskProgress] = None) -> ScanResult:
+    """Headless Save Version Data: moves to the next coderev (or the given one), applies the version update and records the build."""
+    if coderev is None:
+        if project.vf.coderev < 0:
+            raise ValueError(f"{project.name} has no code revision yet, pass one explicitly.")
+        coderev = project.vf.coderev + 1
+    elif coderev < 0:
+        raise ValueError("Code revision needs to be >= 0.")
+    # A scan the caller just made saves scanning the project twice
+    _scan = scan_result if scan_result is not None else scan(project, workers, progress)
+    bump_version(project.vf.verdata, part, subversion)
+    project.vf.coderev = coderev
+    return record_build(project.name, project.path, project.vf, project.changelog_store, _scan, progress)
+
+def get_patch_format_from_path(path: str) -> str:
+    for fmt in PATCH_ARCHIVE_FORMATS:
+        if path.lower().endswith(f'.{fmt}'):
+            return fmt
+    return 'folder'
+
+def write_patch(project_path: str, paths: Iterable[str], out: str, fmt: str = 'folder', mode: str = 'copy',
+                level: int = DEFAULT_COMPRESSION_LEVEL, delta_base: Optional[str] = None, progress: Optional[TaskProgress] = None) -> PatchCopyResult:
+    """Packs the changed files and the version files into a patch folder or archive at out."""
+    if fmt not in PATCH_OUTPUT_FORMATS:
+        raise ValueError(f"Unknown patch output format {fmt}.")
+    _version_files = [(os.path.join(project_path, x), x) for x in ('version.json', VERSION_MODULE_NAME)]
+    _names = get_patch_file_names(project_path, paths)
+    _delta_dir = None
+    if delta_base is not None:
+        if not os.path.isdir(delta_base):
+            raise FileNotFoundError(f"Delta base folder {delta_base} does not exist.")
+        os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+        _delta_dir = tempfile.mkdtemp(prefix='delta-', dir=os.path.dirname(out) or '.')
+    try:
+        if _delta_dir is not None:
+            # Large files that also exist in delta_base are shipped as binary deltas against them
+            if progress is not None:
+                progress.set_stage('Building deltas')
+            with metrics.timer('patch.delta'):
+                _names = make_patch_deltas(_names, delta_base, _delta_dir, progress=progress)
+        if progress is not None:
+            progress.set_stage('Packing' if fmt in PATCH_ARCHIVE_FORMATS else 'Copying')
+        if fmt in PATCH_ARCHIVE_FORMATS:
+            # Get the version files as well if they exist
+            _names.extend(x for x in _version_files if os.path.exists(x[0]))
+            return write_patch_archive(_names, out, fmt, level, progress=progress)
+        try:
+            _result = copy_patch_files([(src, f'{out}/{rel}') for src, rel in _names], mode, progress=progress)
+        except TaskCancelled:
+            # A cancelled archive is never moved into place, a patch folder is removed
+            shutil.rmtree(out, ignore_errors=True)
+            raise
+        # Get the version files as well if they exist
+        for _version_file, _ in _version_files:
+            try:
+                os.makedirs(out, exist_ok=True)
+                shutil.copy2(_version_file, out)
+            except:
+                pass
+        return _result
+    finally:
+        if _delta_dir is not None:
+            shutil.rmtree(_delta_dir, ignore_errors=True)
+
+def build_patch(project: Project, from_coderev: int, to_coderev: Optional[int] = None, out: Optional[str] = None, fmt: Optional[str] = None,
+                mode: str = 'copy', level: int = DEFAULT_COMPRESSION_LEVEL, delta_base: Optional[str] = None,
+                progress: Optional[TaskProgress] = None) -> Tuple[str, PatchCopyResult]:
+    """Builds the patch taking an install at from_coderev to to_coderev, the current coderev by default."""
+    if to_coderev is None:
+        to_coderev = project.vf.coderev
+    if not project.changelog_store.has(int(from_coderev)):
+        raise KeyError(f"No changelog for code revision {from_coderev}.")
+    if out is None:
+        out = f'{project.patches_folder}/{from_coderev}#{to_coderev}'
+        if fmt is not None and fmt != 'folder':
+            out = get_patch_archive_path(out, fmt)
+    if fmt is None:
+        fmt = get_patch_format_from_path(out)
+    _paths = project.changelog_store.get_paths_changed_since(int(from_coderev), int(to_coderev))
+    debug_print(f"Collected {len(_paths)} changed paths from changelogs {from_coderev}..{to_coderev}")
+    with metrics.timer('patch.build'):
+        return out, write_patch(project.path, _paths, out, fmt, mode, level, delta_base, progress)
@@ -0,0 +1,129 @@
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, NamedTuple, Optional
+
+from utils import *
+from api import *
+from tasks import *
+
+__all__ = ['run_batch', 'summarize_batch', 'format_batch_report', 'get_batch_status_text', 'get_batch_progress_text',
+
+           'ProjectReport',
+
+           'DEFAULT_BATCH_WORKERS']
+
+# Projects handled at once, every one of them is mostly waiting on its own tree walk
+DEFAULT_BATCH_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+class ProjectReport(NamedTuple):
+    """What a batch found, and did, for one project. scan is the state before any bump, None when the project failed."""
+    name: str
+    path: Optional[str]
+    scan: Optional[ScanResult] = None
+    error: Optional[str] = None
+    bumped_coderev: Optional[int] = None
+    recorded_files: int = 0
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'path': self.path,
+            'error': self.error,
+            'up_to_date': self.scan.up_to_date if self.scan is not None else None,
+            'latest_change': notzformat.format(self.scan.latest_change_dt) if self.scan is not None else None,
+            'changed_files': len(self.scan.changed_files) if self.scan is not None else None,
+            'file_count': self.scan.file_count if self.scan is not None else None,
+            'bumped_coderev': self.bumped_coderev,
+            'recorded_files': self.recorded_files,
+        }
+
+def _run_project(name: str, config: Config, bump_changed: bool, part: Optional[str], subversion: Optional[str], scan_workers: int,
+                 cancel: Optional[threading.Event]) -> ProjectReport:
+    _path = config.db['projects'].get(name, dict()).get('path', None)
+    _progress = TaskProgress(cancelled=cancel) if cancel is not None else None
+    try:
+        with open_project(name, config) as project:
+            _scan = scan(project, scan_workers, _progress)
+            if not bump_changed or _scan.up_to_date:
+                return ProjectReport(name, _path, _scan)
+            bump(project, part, subversion, None, scan_workers, _scan, _progress)
+            return ProjectReport(name, _path, _scan, bumped_coderev=project.vf.coderev,
+                                 recorded_files=len(project.changelog_store.get_paths(project.vf.coderev)))
+    except TaskCancelled:
+        return ProjectReport(name, _path, error='Cancelled')
+    except Exception as e:
+        debug_print(f'Batch failed for {name}: {type(e).__name__}: {e}')
+        return ProjectReport(name, _path, error=f'{type(e).__name__}: {e.args[0] if e.args else e}')
+
+def run_batch(config: Optional[Config] = None, names: Optional[Iterable[str]] = None, bump_changed: bool = False, part: Optional[str] = None,
+              subversion: Optional[str] = None, workers: int = DEFAULT_BATCH_WORKERS, scan_workers: int = 1,
+              on_report: Optional[Callable[[ProjectReport], None]] = None, cancel: Optional[threading.Event] = None) -> List[ProjectReport]:
+    """
+    Scans every project of config.json, or the given ones, on a pool of workers threads.
+    With bump_changed, every project with unbuilt changes moves to its next coderev with the given version update
+    and gets its changelog written, exactly like Save Version Data. A failing project is reported and never stops the others.
+    on_report is called from the worker threads as projects finish. Setting cancel skips the projects not started yet
+    and stops the running ones at their next scanned folder or hashed file, a project whose build is being written still completes.
+    Returns the reports in the order of the names.
+    """
+    config = config if config is not None else Config('config.json')
+    names = list(names) if names is not None else list(config.db['projects'].keys())
+    if part is not None and part not in VERSION_PARTS:
+        raise ValueError(f"Unknown version part {part}.")
+
+    def _task(name: str) -> ProjectReport:
+        if cancel is not None and cancel.is_set():
+            _report = ProjectReport(name, config.db['projects'].get(name, dict()).get('path', None), error='Cancelled')
+        else:
+            _report = _run_project(name, config, bump_changed, part, subversion, scan_workers, cancel)
+        if on_report is not None:
+            on_report(_report)
+        return _report
+
+    with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='ProjectBatch') as _pool:
+        return list(_pool.map(_task, names))
+
+def summarize_batch(reports: List[ProjectReport]) -> dict:
+    return {
+        'projects': len(reports),
+        'up_to_date': sum(1 for x in reports if x.ok and x.scan.up_to_date),
+        'changed': sum(1 for x in reports if x.ok and not x.scan.up_to_date),
+        'changed_files': sum(len(x.scan.changed_files) for x in reports if x.ok),
+        'bumped': sum(1 for x in reports if x.bumped_coderev is not None),
+        'failed': sum(1 for x in reports if not x.ok),
+        'reports': [x.to_dict() for x in reports],
+    }
+
+def get_batch_status_text(report: ProjectReport) -> str:
+    """The Launcher's Changes Built line for a project after the batch, bumped projects are up to date again."""
+    if not report.ok:
+        return "Changes Built: ?"
+    return f"Changes Built: {get_no_file_changes_after_build_text(report.scan, True if report.bumped_coderev is not None else None)}"
+
+def get_batch_progress_text(done: int, total: int, running: bool, cancelled: bool = False) -> str:
+    """The Launcher's line under the batch buttons, empty when no batch runs."""
+    if not running:
+        return ""
+    return f"{'Cancelling' if cancelled else 'Batch'}: {done} of {total} projects done"
+
+def format_batch_report(reports: List[ProjectReport]) -> str:
+    _summary = summarize_batch(reports)
+    _lines = [f"{_summary['projects']} projects: {_summary['up_to_date']} up to date, {_summary['changed']} with {_summary['changed_files']} unbuilt changes, "
+              f"{_summary['bumped']} bumped, {_summary['failed']} failed", '']
+    _width = max([len(x.name) for x in reports] + [7])
+    for _report in reports:
+        if not _report.ok:
+            _lines.append(f'{_report.name:<{_width}}  {_report.error}')
+            continue
+        _line = (f'{_report.name:<{_width}}  {"✓" if _report.scan.up_to_date else "╳"}  {notzformat.format(_report.scan.latest_change_dt)}  '
+                 f'{len(_report.scan.changed_files):>6} of {_report.scan.file_count} files changed')
+        if _report.bumped_coderev is not None:
+            _line += f', bumped to coderev {_report.bumped_coderev} with {_report.recorded_files} recorded'
+        _lines.append(_line)
+    return '\n'.join(_lines)
@@ -0,0 +1,316 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils import *
+from storage import *
+from patchengine import *
+
+__all__ = ['generate_tree', 'generate_changelogs', 'measure', 'run_benchmarks', 'compare_reports', 'main',
+
+           'BenchTree',
+
+           'TREE_SIZES', 'DEFAULT_CODEREVS', 'DEFAULT_REPEAT', 'DEFAULT_SEED', 'DEFAULT_THRESHOLD', 'REPORT_VERSION']
+
+# Files per synthetic project, picked on the command line by name
+TREE_SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+DEFAULT_CODEREVS = 5000
+DEFAULT_REPEAT = 5
+DEFAULT_SEED = 1
+# Relative slowdown of a case median over the baseline reported as a regression
+DEFAULT_THRESHOLD = 0.10
+REPORT_VERSION = 1
+# Bumped whenever the generator changes, trees made by an older generator are rebuilt
+GENERATOR_VERSION = 1
+
+FILES_PER_DIR = (8, 40)
+SUBDIRS_PER_DIR = (2, 9)
+MAX_DEPTH = 6
+FILE_SIZE = (16, 4096)
+EXTENSIONS = ('.py', '.json', '.png', '.txt', '.cfg', '.dds', '.ogg', '.lua', '.bin', '.xml')
+# Top level folders the ignore list removes, with the share of the files they hold, like the build output of a real project
+IGNORED_FOLDERS = (('Build', 0.10), ('Temp', 0.05), ('Logs', 0.02))
+IGNORED_FILES_PER_PROJECT = 50
+# Share of the files modified after the last build
+CHANGED_SHARE = 0.01
+# Every coderev changes 1 to 60 files, drawn from a hot set most of the time
+CHANGES_PER_CODEREV = (1, 60)
+HOT_SHARE = 0.05
+HOT_PROBABILITY = 0.8
+BUILD_TIME = 1_600_000_000
+PATCH_CODEREVS = 100
+
+class BenchTree(object):
+    """A generated project: its folder, the ignore list and the files the changelogs are drawn from."""
+    def __init__(self, root: str, files: List[str], ignored: List[str], buildtime: int):
+        self.root = root
+        self.files = files
+        self.ignored = ignored
+        self.buildtime = buildtime
+
+    @property
+    def matcher(self) -> IgnoredPathsMatcher:
+        return compile_ignored_paths(join_project_path(self.root, x) for x in self.ignored)
+
+def _plan_dirs(rng: random.Random, count: int, prefix: str) -> List[str]:
+    """count folder paths under prefix, created breadth first with a random fan-out so shallow folders fill up first."""
+    _dirs = [prefix]
+    _queue = [(prefix, 0)]
+    while len(_dirs) < count and len(_queue) > 0:
+        _parent, _depth = _queue.pop(0)
+        if _depth >= MAX_DEPTH:
+            continue
+        for i in range(rng.randint(*SUBDIRS_PER_DIR)):
+            _dir = f'{_parent}d{_depth}_{i}/'
+            _dirs.append(_dir)
+            _queue.append((_dir, _depth + 1))
+            if len(_dirs) >= count:
+                break
+    return _dirs
+
+def _plan_files(rng: random.Random, count: int, prefix: str) -> List[str]:
+    _per_dir = sum(FILES_PER_DIR) // 2
+    _files = list()
+    for _dir in _plan_dirs(rng, max(1, count // _per_dir), prefix):
+        for i in range(rng.randint(*FILES_PER_DIR)):
+            _files.append(f'{_dir}f{i}{rng.choice(EXTENSIONS)}')
+            if len(_files) >= count:
+                return _files
+    # The folder plan ran short of files, top up the root
+    while len(_files) < count:
+        _files.append(f'{prefix}extra{len(_files)}.bin')
+    return _files
+
+def generate_tree(root: str, files: int, seed: int = DEFAULT_SEED) -> BenchTree:
+    """
+    Creates a synthetic project of files files under root, or reuses the one a previous run made with the same parameters.
+    The same size and seed always give the same tree, the mtimes put CHANGED_SHARE of the kept files after the build time.
+    """
+    _params = {'generator': GENERATOR_VERSION, 'files': files, 'seed': seed}
+    _manifest_path = f'{root}.json'
+    try:
+        _manifest = read_json(_manifest_path)
+        if _manifest.get('params', None) == _params and os.path.isdir(root):
+            return BenchTree(root, _manifest['files'], _manifest['ignored'], _manifest['buildtime'])
+    except (FileNotFoundError, ValueError):
+        pass
+    shutil.rmtree(root, ignore_errors=True)
+    rng = random.Random(seed)
+    _kept_count = files
+    _all = list()
+    _ignored = list()
+    for _folder, _share in IGNORED_FOLDERS:
+        _count = int(files * _share)
+        _kept_count -= _count
+        _all.extend(_plan_files(rng, _count, f'{_folder}/'))
+        _ignored.append(_folder)
+    _kept = _plan_files(rng, _kept_count, '')
+    _ignored_files = rng.sample(_kept, min(IGNORED_FILES_PER_PROJECT, len(_kept) // 10))
+    _ignored.extend(_ignored_files)
+    _ignored_set = set(_ignored_files)
+    _kept = [x for x in _kept if x not in _ignored_set]
+    _all.extend(_kept)
+    _all.extend(_ignored_files)
+    _changed = set(rng.sample(_kept, max(1, int(len(_kept) * CHANGED_SHARE))))
+    _payload = rng.randbytes(FILE_SIZE[1]) if hasattr(rng, 'randbytes') else bytes(rng.getrandbits(8) for _ in range(FILE_SIZE[1]))
+    _made_dirs = set()
+    for _rel in _all:
+        _path = os.path.join(root, _rel)
+        _dir = os.path.dirname(_path)
+        if _dir not in _made_dirs:
+            os.makedirs(_dir, exist_ok=True)
+            _made_dirs.add(_dir)
+        with open(_path, 'wb') as _f:
+            _f.write(_payload[:rng.randint(*FILE_SIZE)])
+        _mtime = BUILD_TIME + rng.randint(1, 86400) if _rel in _changed else BUILD_TIME - rng.randint(1, 86400 * 365)
+        os.utime(_path, (_mtime, _mtime))
+    write_json(_manifest_path, {'params': _params, 'files': _kept, 'ignored': _ignored, 'buildtime': BUILD_TIME})
+    return BenchTree(root, _kept, _ignored, BUILD_TIME)
+
+def generate_changelogs(store: ChangeLogStore, tree: BenchTree, coderevs: int, seed: int = DEFAULT_SEED):
+    """Fills an empty store with coderevs changelogs over the files of tree, skipped when the store already holds them."""
+    _params = json.dumps({'generator': GENERATOR_VERSION, 'files': len(tree.files), 'coderevs': coderevs, 'seed': seed})
+    if store.get_meta('bench_params') == _params:
+        return
+    rng = random.Random(seed)
+    _paths = [join_project_path(tree.root, x) for x in tree.files]
+    _hot = _paths[:max(1, int(len(_paths) * HOT_SHARE))]
+    with store.db:
+        store.db.execute("DELETE FROM changes")
+        store.db.execute("DELETE FROM changelogs")
+        store.db.execute("DELETE FROM latest_changes")
+        for coderev in range(coderevs):
+            _count = rng.randint(*CHANGES_PER_CODEREV)
+            store._write(coderev, (rng.choice(_hot) if rng.random() < HOT_PROBABILITY else rng.choice(_paths) for _ in range(_count)))
+        store.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bench_params', ?)", (_params,))
+
+def _read_proc_io() -> Optional[Dict[str, int]]:
+    try:
+        with open('/proc/self/io', 'r') as _f:
+            return {k: int(v) for k, v in (x.split(':') for x in _f if ':' in x)}
+    except OSError:
+        return None
+
+def measure(fn: Callable[[], object], repeat: int = DEFAULT_REPEAT, setup: Optional[Callable[[], None]] = None) -> dict:
+    """
+    Wall and CPU time of repeat runs of fn, with the read/write syscalls and bytes of the process (/proc/self/io, Linux only)
+    and the peak memory allocated by Python (tracemalloc) taken from one more run, so tracing never slows the timed runs.
+    /proc/self/io does not count stat or directory listing calls, the system CPU time covers those.
+    """
+    _times = list()
+    _user = 0.0
+    _system = 0.0
+    for _ in range(max(1, repeat)):
+        if setup is not None:
+            setup()
+        _cpu = os.times()
+        _start = time.perf_counter()
+        fn()
+        _times.append(time.perf_counter() - _start)
+        _cpu_end = os.times()
+        _user += _cpu_end.user - _cpu.user
+        _system += _cpu_end.system - _cpu.system
+    if setup is not None:
+        setup()
+    # Reading /proc/self/io costs syscalls of its own, measured once and taken off
+    _io_overhead = _read_proc_io()
+    _io_before = _read_proc_io()
+    tracemalloc.start()
+    try:
+        _items = fn()
+        _peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    _io_after = _read_proc_io()
+    _result = {
+        'wall_s': {'min': min(_times), 'median': statistics.median(_times), 'max': max(_times), 'runs': len(_times)},
+        'cpu_s': {'user': _user / len(_times), 'system': _system / len(_times)},
+        'peak_memory_bytes': _peak,
+        'items': len(_items) if hasattr(_items, '__len__') else getattr(_items, 'files', None),
+        'io': None,
+    }
+    if _io_before is not None and _io_after is not None:
+        _result['io'] = {k: max(0, _io_after[k] - 2 * _io_before[k] + _io_overhead[k]) for k in ('syscr', 'syscw', 'rchar', 'wchar')
+                         if k in _io_before and k in _io_after}
+    return _result
+
+def run_benchmarks(workdir: str, size: str, coderevs: int = DEFAULT_CODEREVS, repeat: int = DEFAULT_REPEAT, seed: int = DEFAULT_SEED,
+                   workers: int = DEFAULT_SCAN_WORKERS, cases: Optional[List[str]] = None) -> dict:
+    """
+    Runs the hot paths of the tools headlessly against the synthetic project of the given size and returns the JSON report.
+    The changelog store is kept under workdir/ProjectData, never next to the real projects.
+    """
+    if size not in TREE_SIZES:
+        raise ValueError(f"Unknown benchmark size {size}.")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    _start = time.perf_counter()
+    tree = generate_tree(os.path.join(workdir, f'tree-{size}').replace('\\', '/'), TREE_SIZES[size], seed)
+    _name = f'bench-{size}'
+    store = ChangeLogStore(_name)
+    generate_changelogs(store, tree, coderevs, seed)
+    _setup_s = time.perf_counter() - _start
+    _matcher = tree.matcher
+    _patch_out = os.path.join(workdir, f'patch-{size}')
+
+    def _clear_patch():
+        shutil.rmtree(_patch_out, ignore_errors=True)
+
+    _patch_paths = store.get_paths_changed_since(max(0, coderevs - PATCH_CODEREVS))
+    _oldest = ChangeLog(_name, 0, create=False, store=store) if coderevs > 0 else None
+    _middle = ChangeLog(_name, coderevs // 2, create=False, store=store) if coderevs > 0 else None
+    _cases: List[Tuple[str, Callable[[], object], Optional[Callable[[], None]]]] = [
+        ('recursive_fileiter', lambda: recursive_fileiter(tree.root, _matcher, workers), None),
+        ('get_unbuilt_changed_files', lambda: get_unbuilt_changed_files(tree.buildtime, tree.root, _matcher, workers), None),
+        ('patch_copy', lambda: copy_patch_files(get_patch_file_targets(tree.root, _patch_paths, _patch_out), 'copy'), _clear_patch),
+    ]
+    if _oldest is not None:
+        _cases.extend([
+            ('get_changed_files_paths_from_changelogs.oldest',
+             lambda: get_changed_files_paths_from_changelogs(_oldest, coderevs - 1, _name, store), None),
+            ('get_changed_files_paths_from_changelogs.middle',
+             lambda: get_changed_files_paths_from_changelogs(_middle, coderevs - 1, _name, store), None),
+            ('get_changed_files_paths_from_changelogs.range',
+             lambda: get_changed_files_paths_from_changelogs(_oldest, coderevs // 2, _name, store), None),
+        ])
+    _report_cases = dict()
+    for _case, fn, setup in _cases:
+        if cases is not None and not any(_case.startswith(x) for x in cases):
+            continue
+        debug_print(f'Running {_case}')
+        _report_cases[_case] = measure(fn, repeat, setup)
+    _clear_patch()
+    store.close()
+    return {
+        'version': REPORT_VERSION,
+        'created': notzformat.format(datetime.datetime.now()),
+        'environment': {'python': platform.python_version(), 'implementation': platform.python_implementation(), 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count()},
+        'params': {'size': size, 'files': TREE_SIZES[size], 'kept_files': len(tree.files), 'ignored': len(tree.ignored), 'coderevs': coderevs,
+                   'repeat': repeat, 'seed': seed, 'workers': workers, 'generator': GENERATOR_VERSION},
+        'setup_s': _setup_s,
+        'cases': _report_cases,
+    }
+
+def compare_reports(report: dict, baseline: dict, threshold: float = DEFAULT_THRESHOLD) -> List[str]:
+    """The cases whose median wall time grew by more than threshold over the baseline, as readable lines."""
+    _lines = list()
+    if report['params'] != baseline.get('params', None):
+        _lines.append('Warning: the baseline was made with different parameters, the timings are not comparable.')
+    for _case, _result in report['cases'].items():
+        _base = baseline.get('cases', dict()).get(_case, None)
+        if _base is None:
+            continue
+        _now = _result['wall_s']['median']
+        _then = _base['wall_s']['median']
+        if _then > 0 and _now > _then * (1 + threshold):
+            _lines.append(f'{_case}: {_then:.4f}s -> {_now:.4f}s (+{(_now / _then - 1) * 100:.1f}%)')
+    return _lines
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='benchmark', description='Times the scanning, changelog and patch copy hot paths on synthetic projects.')
+    parser.add_argument('--size', choices=list(TREE_SIZES.keys()), default='10k')
+    parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'verbumper-bench'),
+                        help='Folder for the generated projects and their ProjectData, reused between runs.')
+    parser.add_argument('--coderevs', type=int, default=DEFAULT_CODEREVS, help='Changelogs in the generated history.')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='Timed runs of every case.')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--workers', type=int, default=DEFAULT_SCAN_WORKERS, help='Threads used to list project folders.')
+    parser.add_argument('--case', dest='cases', action='append', default=None, help='Only run the cases starting with this name, can be repeated.')
+    parser.add_argument('--out', default=None, help='Write the JSON report to this file instead of stdout.')
+    parser.add_argument('--baseline', default=None, help='Report of an earlier run, slower cases are listed on stderr and exit with 1.')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Slowdown over the baseline median reported as a regression.')
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    for _attr in ('workdir', 'out', 'baseline'):
+        if getattr(args, _attr) is not None:
+            setattr(args, _attr, os.path.abspath(getattr(args, _attr)))
+    _report = run_benchmarks(args.workdir, args.size, args.coderevs, args.repeat, args.seed, args.workers, args.cases)
+    _output = json.dumps(_report, indent=4)
+    if args.out is not None:
+        atomic_write(args.out, _output)
+    else:
+        print(_output)
+    if args.baseline is not None:
+        _regressions = compare_reports(_report, read_json(args.baseline), args.threshold)
+        for _line in _regressions:
+            print(_line, file=sys.stderr)
+        return 1 if any(not x.startswith('Warning') for x in _regressions) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,270 @@
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+
+from typing import Optional, Callable, Dict, List, Set, Tuple
+
+from utils import *
+from tasks import TaskProgress
+
+__all__ = ['ProjectChangeWatcher', 'WatcherUnavailable', 'is_watcher_supported', 'is_watcher_requested']
+
+# Linux inotify constants from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct('iIII')
+READ_BUFFER_SIZE = 64 * 1024
+
+WATCHER_ENV_VAR = 'VERBUMPER_WATCH'
+
+class WatcherUnavailable(OSError):
+    pass
+
+def is_watcher_supported():
+    return sys.platform.startswith('linux')
+
+def is_watcher_requested():
+    return os.environ.get(WATCHER_ENV_VAR, '0') not in ('', '0') and is_watcher_supported()
+
+def _load_libc():
+    try:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        _libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    except (OSError, AttributeError) as e:
+        raise WatcherUnavailable(f'inotify is not available: {e}')
+    return _libc
+
+class ProjectChangeWatcher(object):
+    """
+    Keeps the set of files changed since the last build up to date through Linux inotify.
+    The tree is scanned once on start, after that only the reported files are stat-ed.
+    on_change is called from the watcher thread whenever the set or the latest change moved.
+    If the watcher breaks down, for example when the inotify watch limit runs out on a new folder, failed holds the error
+    and on_failure is called from the watcher thread, its results can no longer be trusted.
+    """
+    def __init__(self, path: str, buildtime, ignored_paths: IgnoredPathsMatcher, on_change: Optional[Callable[[], None]] = None,
+                 on_failure: Optional[Callable[[BaseException], None]] = None):
+        self.path = path
+        self.buildtime = buildtime
+        self.buildtime_ns = buildtime * 1_000_000_000
+        self.ignored = compile_ignored_paths(ignored_paths)
+        self.on_change = on_change
+        self.on_failure = on_failure
+        self.failed: Optional[BaseException] = None
+        self.changed: Dict[str, Tuple[int, int]] = dict()
+        self.files: Set[str] = set()
+        self.latest_mtime_ns = 0
+        self._lock = threading.Lock()
+        self._libc = None
+        self._fd = -1
+        self._wakeup_r = -1
+        self._wakeup_w = -1
+        self._watches: Dict[int, str] = dict()
+        self._thread = None
+
+    @property
+    def file_count(self) -> int:
+        return len(self.files)
+
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, progress: Optional[TaskProgress] = None):
+        """Watches the tree and scans it once, progress can cancel the scan, the watcher is stopped then."""
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise WatcherUnavailable(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        try:
+            self._watch_tree(self.path, '')
+            self.resync(progress)
+        except BaseException:
+            self.stop()
+            raise
+        self._thread = threading.Thread(target=self._run, name='ProjectChangeWatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._wakeup_w >= 0:
+            os.write(self._wakeup_w, b'\0')
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        for fd in (self._fd, self._wakeup_r, self._wakeup_w):
+            if fd >= 0:
+                os.close(fd)
+        self._fd = self._wakeup_r = self._wakeup_w = -1
+        self._watches.clear()
+
+    def reset(self, buildtime):
+        """Forgets the changes made before a new build."""
+        with self._lock:
+            self.buildtime = buildtime
+            self.buildtime_ns = buildtime * 1_000_000_000
+            self.changed = {k: v for k, v in self.changed.items() if v[0] > self.buildtime_ns}
+
+    def resync(self, progress: Optional[TaskProgress] = None):
+        """Rebuilds the change set from a full scan, used on start and when the kernel event queue overflows."""
+        _changed = dict()
+        _files = set()
+        _latest = 0
+        for f in iter_project_files(self.path, self.ignored, progress=progress):
+            _files.add(f.relpath)
+            if f.mtime_ns > _latest:
+                _latest = f.mtime_ns
+            if f.mtime_ns > self.buildtime_ns:
+                _changed[f.relpath] = (f.mtime_ns, f.size)
+        with self._lock:
+            self.changed = _changed
+            self.files = _files
+            self.latest_mtime_ns = _latest
+
+    def get_changed_files(self) -> List[Tuple[ScanEntry, datetime.datetime]]:
+        with self._lock:
+            _items = sorted(self.changed.items())
+        return [(ScanEntry(k, v[0], v[1]), datetime.datetime.fromtimestamp(v[0] / 1e9)) for k, v in _items]
+
+    def get_latest_file_change(self) -> float:
+        return self.latest_mtime_ns / 1e9
+
+    def get_scan_result(self) -> ScanResult:
+        """The watched state as a ScanResult."""
+        _changed = self.get_changed_files()
+        return ScanResult(self.buildtime, self.get_latest_file_change(), _changed, len(_changed) == 0, self.file_count)
+
+    def _watch_tree(self, path: str, rel: str):
+        _dirs = [(path, rel)]
+        while _dirs:
+            _dir, _rel = _dirs.pop()
+            if self.ignored.is_ignored(_dir):
+                continue
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(_dir), WATCH_MASK)
+            if wd < 0:
+                _errno = ctypes.get_errno()
+                if _errno == errno.ENOSPC:
+                    raise WatcherUnavailable(_errno, 'inotify watch limit reached, raise fs.inotify.max_user_watches')
+                continue
+            self._watches[wd] = _rel
+            try:
+                with os.scandir(_dir) as _listing:
+                    for item in _listing:
+                        if item.is_dir(follow_symlinks=False) and not item.name.startswith('.'):
+                            _dirs.append((item.path, f'{_rel}{item.name}/'))
+            except OSError:
+                continue
+
+    def _file_changed(self, rel: str):
+        try:
+            _st = os.stat(os.path.join(self.path, rel))
+        except OSError:
+            return self._file_removed(rel)
+        with self._lock:
+            self.files.add(rel)
+            if _st.st_mtime_ns > self.latest_mtime_ns:
+                self.latest_mtime_ns = _st.st_mtime_ns
+            if _st.st_mtime_ns > self.buildtime_ns:
+                self.changed[rel] = (_st.st_mtime_ns, _st.st_size)
+            else:
+                self.changed.pop(rel, None)
+        return True
+
+    def _file_removed(self, rel: str):
+        with self._lock:
+            self.files.discard(rel)
+            return self.changed.pop(rel, None) is not None
+
+    def _dir_added(self, rel: str):
+        _path = os.path.join(self.path, rel)
+        self._watch_tree(_path, f'{rel}/')
+        # Files may have landed before the watch was placed
+        _changed = False
+        for f in iter_project_files(_path, self.ignored):
+            _changed = self._file_changed(f'{rel}/{f.relpath}') or _changed
+        return _changed
+
+    def _dir_removed(self, rel: str):
+        _prefix = f'{rel}/'
+        for wd in [wd for wd, _rel in self._watches.items() if _rel.startswith(_prefix)]:
+            self._libc.inotify_rm_watch(self._fd, wd)
+            del self._watches[wd]
+        with self._lock:
+            self.files = {x for x in self.files if not x.startswith(_prefix)}
+            _removed = [k for k in self.changed if k.startswith(_prefix)]
+            for k in _removed:
+                del self.changed[k]
+        return len(_removed) > 0
+
+    def _handle_event(self, wd: int, mask: int, name: str):
+        if mask & IN_Q_OVERFLOW:
+            self.resync()
+            return True
+        if mask & IN_IGNORED:
+            self._watches.pop(wd, None)
+            return False
+        _dir_rel = self._watches.get(wd, None)
+        if _dir_rel is None or not name:
+            return False
+        rel = f'{_dir_rel}{name}'
+        if self.ignored.is_ignored(join_project_path(self.path, rel)):
+            return False
+        if mask & IN_ISDIR:
+            if name.startswith('.'):
+                return False
+            if mask & (IN_CREATE | IN_MOVED_TO):
+                return self._dir_added(rel)
+            if mask & (IN_DELETE | IN_MOVED_FROM):
+                return self._dir_removed(rel)
+            return False
+        if name == 'version.json' or rel == VERSION_MODULE_NAME:
+            return False
+        if mask & (IN_DELETE | IN_MOVED_FROM):
+            return self._file_removed(rel)
+        return self._file_changed(rel)
+
+    def _run(self):
+        try:
+            self._read_events()
+        except Exception as e:
+            debug_print(f'Change watcher failed, falling back to scans. {type(e).__name__}: {e}')
+            self.failed = e
+            if self.on_failure is not None:
+                self.on_failure(e)
+
+    def _read_events(self):
+        while True:
+            _ready, _, _ = select.select([self._fd, self._wakeup_r], [], [])
+            if self._wakeup_r in _ready:
+                return
+            _buf = os.read(self._fd, READ_BUFFER_SIZE)
+            _changed = False
+            _offset = 0
+            while _offset + EVENT_HEADER.size <= len(_buf):
+                wd, mask, _cookie, _len = EVENT_HEADER.unpack_from(_buf, _offset)
+                _offset += EVENT_HEADER.size
+                name = os.fsdecode(_buf[_offset:_offset + _len].rstrip(b'\0'))
+                _offset += _len
+                _changed = self._handle_event(wd, mask, name) or _changed
+            if _changed and self.on_change is not None:
+                self.on_change()
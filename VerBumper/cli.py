@@ -0,0 +1,191 @@
+import argparse
+import json
+import os
+import sys
+
+from typing import List, Optional
+
+from utils import *
+from patchengine import *
+from patchdelta import apply_patch_deltas
+from api import *
+from prodlog import *
+from storage import atomic_write
+from instrumentation import *
+
+__all__ = ['main', 'build_parser']
+
+# config.json and ProjectData live next to the tools, the same place the GUI is started from
+DEFAULT_HOME = os.path.dirname(os.path.abspath(__file__))
+
+def _open(args) -> Project:
+    return open_project(args.project, path=args.path)
+
+def _cmd_bump(args) -> int:
+    with _open(args) as project:
+        bump(project, args.part, args.subversion, args.coderev, args.workers)
+        print(f"{project.name} {project.vf.data['version']} coderev {project.vf.coderev}, {len(project.changelog_store.get_paths(project.vf.coderev))} changed files recorded")
+    return 0
+
+def _cmd_scan(args) -> int:
+    with _open(args) as project:
+        _scan = scan(project, args.workers)
+        print(f"{project.name}: {get_no_file_changes_after_build_text(_scan)}, {len(_scan.changed_files)} of {_scan.file_count} files changed since the last build")
+        if args.list and len(_scan.changed_files) > 0:
+            print(get_unbuilt_changed_files_text(_scan))
+    return 1 if args.check and not _scan.up_to_date else 0
+
+def _cmd_changelog(args) -> int:
+    with _open(args) as project:
+        if args.coderev is None:
+            for coderev in project.changelog_store.get_coderevs():
+                print(coderev)
+        else:
+            if not project.changelog_store.has(args.coderev):
+                raise KeyError(f"No changelog for code revision {args.coderev}.")
+            for path in sorted(project.changelog_store.get_paths(args.coderev)):
+                print(path)
+    return 0
+
+def _cmd_patch(args) -> int:
+    with _open(args) as project:
+        _to = None if args.to_coderev.upper() == 'HEAD' else int(args.to_coderev)
+        _out, _result = build_patch(project, args.from_coderev, _to, args.out, args.format, args.mode, args.level, args.delta_base)
+        print(f"Packed {_result.files} files, {_result.bytes} bytes into {_out}")
+        for src in _result.failed:
+            print(f"Failed to copy {src}", file=sys.stderr)
+    return 1 if len(_result.failed) > 0 else 0
+
+def _cmd_apply(args) -> int:
+    print(f"Rebuilt {apply_patch_deltas(args.install_dir, args.patch_dir)} files of {args.install_dir} from the deltas of {args.patch_dir}")
+    return 0
+
+def _cmd_prodlogs(args) -> int:
+    with _open(args) as project:
+        if args.convert:
+            print(f"Converted {convert_legacy_prod_logs(project.prod_log_folder)} day logs of {project.name}")
+            return 0
+        for date, session in iter_all_sessions(project.prod_log_folder):
+            print(json.dumps(dict(session, date=date)))
+    return 0
+
+def _cmd_analytics(args) -> int:
+    import analytics
+    with _open(args) as project:
+        _summary = analytics.summarize(project.prod_log_folder, args.window)
+    if args.text:
+        _output = analytics.format_summary(_summary)
+    else:
+        _output = json.dumps(_summary, indent=4)
+    if args.out is not None:
+        atomic_write(args.out, _output)
+    else:
+        print(_output)
+    return 0
+
+def _cmd_batch(args) -> int:
+    import batch
+    _reports = batch.run_batch(None, args.projects, args.bump, args.part, args.subversion,
+                               args.jobs if args.jobs is not None else batch.DEFAULT_BATCH_WORKERS, args.workers)
+    if args.json:
+        print(json.dumps(batch.summarize_batch(_reports), indent=4))
+    else:
+        print(batch.format_batch_report(_reports))
+    if any(not x.ok for x in _reports):
+        return 2
+    return 1 if args.check and any(not x.scan.up_to_date for x in _reports) else 0
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='VerBumper', description='Headless version bumping, change scanning and patch building.')
+    parser.add_argument('--home', default=DEFAULT_HOME, help='Folder holding config.json and ProjectData, defaults to the VerBumper folder.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_SCAN_WORKERS, help='Threads used to list project folders.')
+    parser.add_argument('--metrics', action='store_true',
+                        help=f'Record timers and counters to ProjectData/<name>/{METRICS_FOLDER_NAME}, also turned on by {METRICS_ENV_VAR}=1.')
+    _sub = parser.add_subparsers(dest='command', required=True)
+
+    def _add_project(p):
+        p.add_argument('project', help='Project name as registered in the Launcher.')
+        p.add_argument('--path', default=None, help='Project folder, overrides the registered one.')
+
+    p = _sub.add_parser('bump', help='Record a build: next coderev, optional version update, changelog.')
+    _add_project(p)
+    _part = p.add_mutually_exclusive_group()
+    for part in VERSION_PARTS:
+        _part.add_argument(f'--{part}', dest='part', action='store_const', const=part)
+    p.add_argument('--subversion', default=None, help='Text after the version number, an empty string removes it.')
+    p.add_argument('--coderev', type=int, default=None, help='Code revision to record, defaults to the current one + 1.')
+    p.set_defaults(func=_cmd_bump)
+
+    p = _sub.add_parser('scan', help='Show the files changed since the last build.')
+    _add_project(p)
+    p.add_argument('--list', action='store_true', help='List the changed files.')
+    p.add_argument('--check', action='store_true', help='Exit with 1 when there are unbuilt changes.')
+    p.set_defaults(func=_cmd_scan)
+
+    p = _sub.add_parser('changelog', help='List the recorded coderevs, or the files changed by one.')
+    _add_project(p)
+    p.add_argument('coderev', type=int, nargs='?', default=None)
+    p.set_defaults(func=_cmd_changelog)
+
+    p = _sub.add_parser('patch', help='Build a patch from a coderev to the current one.')
+    _add_project(p)
+    p.add_argument('--from', dest='from_coderev', type=int, required=True)
+    p.add_argument('--to', dest='to_coderev', default='HEAD')
+    p.add_argument('--out', default=None, help='Patch folder or .zip/.tar.xz archive, defaults to ProjectData/<name>/Patches/<from>#<to>.')
+    p.add_argument('--format', choices=PATCH_OUTPUT_FORMATS, default=None, help='Defaults to the extension of --out.')
+    p.add_argument('--mode', choices=PATCH_COPY_MODES, default=PATCH_COPY_MODES[0])
+    p.add_argument('--level', type=int, default=DEFAULT_COMPRESSION_LEVEL)
+    p.add_argument('--delta-base', default=None, help='Folder with the base version of the files, large files are shipped as deltas against it.')
+    p.set_defaults(func=_cmd_patch)
+
+    p = _sub.add_parser('apply', help='Rebuild the files of an install from the deltas of an unpacked patch.')
+    p.add_argument('install_dir', help='Install holding the base version of the files, rebuilt in place.')
+    p.add_argument('patch_dir', help='Unpacked patch folder with the .vbdelta files.')
+    p.set_defaults(func=_cmd_apply)
+
+    p = _sub.add_parser('prodlogs', help='Stream every recorded prod session as JSON lines.')
+    _add_project(p)
+    p.add_argument('--convert', action='store_true', help='Move legacy <date>.json logs to the append-only format instead.')
+    p.set_defaults(func=_cmd_prodlogs)
+
+    p = _sub.add_parser('analytics', help='Weekly/monthly totals, rolling revision times, percentiles and hour heatmap of the prod logs.')
+    _add_project(p)
+    p.add_argument('--window', type=int, default=7, help='Sessions in the rolling average of the revision time.')
+    p.add_argument('--text', action='store_true', help='Print the report shown by the ProdLog Reader instead of JSON.')
+    p.add_argument('--out', default=None, help='Write the export to this file instead of stdout.')
+    p.set_defaults(func=_cmd_analytics)
+
+    p = _sub.add_parser('batch', help='Scan every registered project at once, optionally recording a build for the ones with unbuilt changes.')
+    p.add_argument('--project', dest='projects', action='append', default=None, help='Only this project, can be repeated. All projects by default.')
+    p.add_argument('--jobs', type=int, default=None, help='Projects handled at once.')
+    p.add_argument('--bump', action='store_true', help='Move every project with unbuilt changes to its next coderev and write its changelog.')
+    _part = p.add_mutually_exclusive_group()
+    for part in VERSION_PARTS:
+        _part.add_argument(f'--{part}', dest='part', action='store_const', const=part, help=f'With --bump, also apply a {part} version update.')
+    p.add_argument('--subversion', default=None, help='With --bump, text after the version number.')
+    p.add_argument('--json', action='store_true', help='Print the consolidated report as JSON.')
+    p.add_argument('--check', action='store_true', help='Exit with 1 when a project has unbuilt changes.')
+    p.set_defaults(func=_cmd_batch)
+    return parser
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    # Paths given on the command line are relative to where the command was run
+    for _attr in ('path', 'out', 'delta_base', 'install_dir', 'patch_dir'):
+        if getattr(args, _attr, None) is not None:
+            setattr(args, _attr, os.path.abspath(getattr(args, _attr)))
+    os.chdir(args.home)
+    if args.metrics:
+        enable_metrics()
+    try:
+        return args.func(args)
+    except (KeyError, ValueError, OSError) as e:
+        print(f"{type(e).__name__}: {e.args[0] if e.args else e}", file=sys.stderr)
+        return 2
+    finally:
+        if getattr(args, 'project', None) is not None:
+            metrics.write_session(args.project, f'cli-{args.command}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
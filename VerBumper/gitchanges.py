@@ -0,0 +1,136 @@
+import datetime
+import os
+import subprocess
+
+from typing import List, Optional, Set, Tuple, Union
+
+from utils import *
+from instrumentation import *
+from tasks import TaskProgress
+
+__all__ = ['find_git_dir', 'get_head_commit', 'get_build_commit', 'record_build_commit', 'list_git_changes', 'scan_project_git', 'scan_project_changes',
+
+           'CHANGE_DETECTION_MODES', 'DEFAULT_CHANGE_DETECTION', 'BUILD_COMMIT_KEY']
+
+# mtime stats the whole tree, git asks the checkout's index which files differ from the commit of the last build
+CHANGE_DETECTION_MODES = ('mtime', 'git')
+DEFAULT_CHANGE_DETECTION = CHANGE_DETECTION_MODES[0]
+# ChangeLogStore meta key holding the HEAD commit at the last build
+BUILD_COMMIT_KEY = 'build_commit'
+GIT_TIMEOUT = 60
+
+def find_git_dir(path: str) -> Optional[str]:
+    """The .git folder (or worktree .git file) of the checkout path is in, None outside of a checkout."""
+    _dir = os.path.abspath(path)
+    while True:
+        _git_dir = os.path.join(_dir, '.git')
+        if os.path.exists(_git_dir):
+            return _git_dir
+        _parent = os.path.dirname(_dir)
+        if _parent == _dir:
+            return None
+        _dir = _parent
+
+def _git(path: str, *args: str) -> Optional[bytes]:
+    try:
+        return subprocess.run(['git', '-C', path, *args], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True,
+                              timeout=GIT_TIMEOUT, creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)).stdout
+    except (OSError, subprocess.SubprocessError) as e:
+        _stderr = getattr(e, 'stderr', None)
+        debug_print(f"git {' '.join(args[:2])} failed in {path}: {_stderr.decode(errors='replace').strip() if _stderr else e}")
+        return None
+
+def get_head_commit(path: str) -> Optional[str]:
+    if find_git_dir(path) is None:
+        return None
+    _out = _git(path, 'rev-parse', '--verify', '-q', 'HEAD')
+    return _out.decode().strip() if _out else None
+
+def get_build_commit(store: ChangeLogStore) -> Optional[str]:
+    return store.get_meta(BUILD_COMMIT_KEY)
+
+def record_build_commit(store: ChangeLogStore, path: str) -> Optional[str]:
+    """Remembers the HEAD commit of a checkout at build time, so git change detection can be turned on at any later build."""
+    _commit = get_head_commit(path)
+    if _commit is not None:
+        store.set_meta(BUILD_COMMIT_KEY, _commit)
+    return _commit
+
+def _split_z(data: bytes) -> List[str]:
+    return [os.fsdecode(x) for x in data.split(b'\0') if x]
+
+def list_git_changes(path: str, build_commit: str) -> Optional[Tuple[Set[str], List[str]]]:
+    """
+    (paths differing from build_commit, every tracked and untracked path) under path, relative to it.
+    Differences cover commits made since the build as well as the working tree, untracked files count as changed.
+    Files matched by .gitignore are never listed. None when git is missing or does not know the commit.
+    """
+    _diff = _git(path, 'diff', '--name-only', '--relative', '--no-renames', '-z', build_commit, '--')
+    if _diff is None:
+        return None
+    # -t tags every entry, H for tracked and ? for untracked files
+    _listing = _git(path, 'ls-files', '-z', '-t', '--cached', '--others', '--exclude-standard')
+    if _listing is None:
+        return None
+    _changed = set(_split_z(_diff))
+    _files = list()
+    for _entry in _split_z(_listing):
+        _tag, _rel = _entry[:1], _entry[2:]
+        _files.append(_rel)
+        if _tag == '?':
+            _changed.add(_rel)
+    return _changed, _files
+
+def _is_scanned(relpath: str, matcher: IgnoredPathsMatcher, path: str) -> bool:
+    """Same rules as the tree scan: no hidden folders, version files or ignored paths."""
+    _parts = relpath.split('/')
+    if _parts[-1] == 'version.json' or relpath == VERSION_MODULE_NAME:
+        return False
+    if any(x.startswith('.') for x in _parts[:-1]):
+        return False
+    return not matcher.is_ignored(join_project_path(path, relpath))
+
+def scan_project_git(buildtime, path, ignored_paths: Union[IgnoredPathsMatcher, Set[Optional[str]]], build_commit: str,
+                     progress: Optional[TaskProgress] = None) -> Optional[ScanResult]:
+    """
+    ScanResult built from git instead of a stat of every file: only the files git reports as differing from
+    the build commit are stat-ed, and of those the ones modified after buildtime are changed, like a scan would find them.
+    The latest change is taken from those files only. None when git cannot answer, the caller falls back to a scan.
+    """
+    with metrics.timer('scan.git'):
+        _listed = list_git_changes(path, build_commit)
+        if _listed is None:
+            return None
+        _candidates, _files = _listed
+        if progress is not None:
+            progress.advance(len(_files))
+        _matcher = compile_ignored_paths(ignored_paths)
+        _buildtime_ns = buildtime * 1_000_000_000
+        _latest_ns = 0
+        _changed = list()
+        for _rel in sorted(_candidates):
+            if not _is_scanned(_rel, _matcher, path):
+                continue
+            try:
+                _st = os.stat(join_project_path(path, _rel))
+            except OSError:
+                # Deleted since the build, a scan never reports those either
+                continue
+            if _st.st_mtime_ns > _latest_ns:
+                _latest_ns = _st.st_mtime_ns
+            if _st.st_mtime_ns > _buildtime_ns:
+                _changed.append((ScanEntry(_rel, _st.st_mtime_ns, _st.st_size), datetime.datetime.fromtimestamp(_st.st_mtime_ns / 1e9)))
+        _count = sum(1 for x in set(_files) if _is_scanned(x, _matcher, path))
+    metrics.count('scan.git_candidates', len(_candidates))
+    return ScanResult(buildtime, (_latest_ns / 1e9) or buildtime, _changed, len(_changed) == 0, _count)
+
+def scan_project_changes(buildtime, path, ignored_paths: Union[IgnoredPathsMatcher, Set[Optional[str]]] = (),
+                         workers: int = DEFAULT_SCAN_WORKERS, mode: str = DEFAULT_CHANGE_DETECTION, build_commit: Optional[str] = None,
+                         progress: Optional[TaskProgress] = None) -> ScanResult:
+    """scan_project() through the given change detection mode, git falls back to a scan until a build recorded its commit."""
+    if mode == 'git' and build_commit is not None:
+        _result = scan_project_git(buildtime, path, ignored_paths, build_commit, progress)
+        if _result is not None:
+            return _result
+        debug_print(f"Git change detection unavailable for {path}, scanning the tree.")
+    return scan_project(buildtime, path, ignored_paths, workers, progress)
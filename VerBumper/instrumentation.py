@@ -0,0 +1,133 @@
+import datetime
+import json
+import os
+import threading
+import time
+
+from typing import Dict, Optional
+
+__all__ = ['enable_metrics', 'metrics_enabled',
+
+           'Metrics',
+
+           'metrics', 'METRICS_ENV_VAR', 'METRICS_FOLDER_NAME']
+
+# Set VERBUMPER_METRICS=1 to record timers and counters and write them under ProjectData/<name>/Metrics when a tool ends
+METRICS_ENV_VAR = 'VERBUMPER_METRICS'
+METRICS_FOLDER_NAME = 'Metrics'
+METRICS_VERSION = 1
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer(object):
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics: 'Metrics', name: str):
+        self.metrics = metrics
+        self.name = name
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+class Metrics(object):
+    """
+    Counters and timers of the current tool session, shared by every thread of the process.
+    While disabled, count() and add_time() return right away and timer() hands out a shared no-op context,
+    hot loops check enabled themselves and add their totals once the loop is done.
+    """
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = dict()
+        # name: [calls, total seconds, longest call]
+        self.timers: Dict[str, list] = dict()
+        self.started = datetime.datetime.now().astimezone()
+
+    def count(self, name: str, n: int = 1):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name: str, seconds: float):
+        if not self.enabled:
+            return
+        with self.lock:
+            _timer = self.timers.get(name, None)
+            if _timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                _timer[0] += 1
+                _timer[1] += seconds
+                if seconds > _timer[2]:
+                    _timer[2] = seconds
+
+    def timer(self, name: str):
+        """with metrics.timer(name): ... adds the time spent in the block to the named timer."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict()
+            self.timers = dict()
+            self.started = datetime.datetime.now().astimezone()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'version': METRICS_VERSION,
+                'started': self.started.isoformat(timespec='seconds'),
+                'ended': datetime.datetime.now().astimezone().isoformat(timespec='seconds'),
+                'pid': os.getpid(),
+                'counters': dict(sorted(self.counters.items())),
+                'timers': {k: {'calls': v[0], 'total_s': v[1], 'max_s': v[2]} for k, v in sorted(self.timers.items())},
+            }
+
+    def write_session(self, projectname: str, tool: str) -> Optional[str]:
+        """
+        Writes what was recorded since the last reset to ProjectData/<name>/Metrics/<start>_<tool>_<pid>.json and resets.
+        Returns the file written, None when disabled or nothing was recorded.
+        """
+        if not self.enabled:
+            return None
+        _data = self.snapshot()
+        if len(_data['counters']) == 0 and len(_data['timers']) == 0:
+            return None
+        _data['project'] = projectname
+        _data['tool'] = tool
+        _path = os.path.abspath(os.path.join('ProjectData', projectname, METRICS_FOLDER_NAME,
+                                             f'{self.started:%Y-%m-%d_%H-%M-%S}_{tool}_{os.getpid()}.json'))
+        os.makedirs(os.path.dirname(_path), exist_ok=True)
+        # Written directly, the storage layer reports to these metrics
+        with open(_path, 'w') as _f:
+            json.dump(_data, _f, indent=4)
+        self.reset()
+        return _path
+
+metrics = Metrics(os.environ.get(METRICS_ENV_VAR, '0') not in ('', '0'))
+
+def enable_metrics(enabled: bool = True):
+    """Turns recording on or off at runtime, a session started while enabled keeps what it already recorded."""
+    if enabled and not metrics.enabled:
+        metrics.reset()
+    metrics.enabled = enabled
+
+def metrics_enabled() -> bool:
+    return metrics.enabled
@@ -0,0 +1,300 @@
+import hashlib
+import itertools
+import mmap
+import os
+import struct
+
+from typing import Dict, List, Optional, Tuple
+
+from utils import *
+from instrumentation import *
+from tasks import TaskProgress
+
+# numpy is imported on the first delta, the GUI tools import this module without ever building one
+numpy = None
+_numpy_checked = False
+
+def _load_numpy():
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        _numpy_checked = True
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+    return numpy
+
+__all__ = ['make_delta', 'apply_delta', 'make_patch_deltas', 'apply_patch_deltas', 'DeltaStats',
+
+           'DELTA_EXTENSION', 'DELTA_MIN_SIZE']
+
+DELTA_EXTENSION = '.vbdelta'
+DELTA_MAGIC = b'VBDL\x01'
+DELTA_HEADER = struct.Struct('<IQQ16s')
+DELTA_COPY = struct.Struct('<QI')
+DELTA_DATA = struct.Struct('<I')
+OP_COPY = b'C'
+OP_DATA = b'D'
+OP_END = b'E'
+# Files smaller than this are cheaper to ship whole
+DELTA_MIN_SIZE = 1024 * 1024
+DELTA_MIN_BLOCK = 2048
+DELTA_MAX_BLOCK = 64 * 1024
+STRONG_HASH_SIZE = 8
+NUMPY_CHUNK = 1024 * 1024
+LITERAL_CHUNK = 16 * 1024 * 1024
+
+class DeltaStats(object):
+    def __init__(self, target_size: int = 0):
+        self.target_size = target_size
+        self.copied = 0
+        self.literal = 0
+        self.delta_size = 0
+
+def _choose_block_size(base_size: int) -> int:
+    _block = DELTA_MIN_BLOCK
+    while _block * _block < base_size and _block < DELTA_MAX_BLOCK:
+        _block *= 2
+    return _block
+
+def _weak_checksum(block) -> int:
+    # rsync style checksum, b is the sum of the prefix sums of the block
+    return (sum(block) & 0xffff) | ((sum(itertools.accumulate(block)) & 0xffff) << 16)
+
+def _strong_checksum(block) -> bytes:
+    return hashlib.blake2b(block, digest_size=STRONG_HASH_SIZE).digest()
+
+def _file_digest(data) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def _build_signatures(base, block: int) -> Dict[int, List[Tuple[bytes, int]]]:
+    """Weak checksum -> [(strong checksum, block index)] of every full block of the base."""
+    _count = len(base) // block
+    if numpy is not None and _count > 0:
+        _weak = _weak_checksums_numpy(base, block, _count)
+    else:
+        _weak = (_weak_checksum(base[x * block:(x + 1) * block]) for x in range(_count))
+    _sigs = dict()
+    for _index, _checksum in enumerate(_weak):
+        _sigs.setdefault(_checksum, list()).append((_strong_checksum(base[_index * block:(_index + 1) * block]), _index))
+    return _sigs
+
+def _weak_checksums_numpy(base, block: int, count: int) -> List[int]:
+    # Byte k of a block adds (block - k) times to the sum of the prefix sums, one matrix product per chunk of blocks
+    _weights = numpy.arange(block, 0, -1, dtype=numpy.int64)
+    _rows = max(1, NUMPY_CHUNK // block)
+    _weak = list()
+    for _first in range(0, count, _rows):
+        _n = min(_rows, count - _first)
+        _x = numpy.frombuffer(base, dtype=numpy.uint8, count=_n * block, offset=_first * block).reshape(_n, block).astype(numpy.int64)
+        _a = _x.sum(axis=1)
+        _b = _x @ _weights
+        _weak.extend(((_a & 0xffff) | ((_b & 0xffff) << 16)).tolist())
+    return _weak
+
+def _match_block(target, pos: int, block: int, candidates: List[Tuple[bytes, int]], expected: int) -> Optional[int]:
+    _strong = _strong_checksum(target[pos:pos + block])
+    _match = None
+    for strong, index in candidates:
+        if strong == _strong:
+            if index == expected:
+                return index
+            if _match is None:
+                _match = index
+    return _match
+
+def _find_matches_python(target, block: int, sigs) -> List[Tuple[int, int]]:
+    _matches = list()
+    _size = len(target)
+    _pos = 0
+    _expected = -1
+    _a = _b = None
+    while _pos + block <= _size:
+        if _a is None:
+            _window = target[_pos:_pos + block]
+            _a = sum(_window) & 0xffff
+            _b = sum(itertools.accumulate(_window)) & 0xffff
+        _candidates = sigs.get(_a | (_b << 16), None)
+        if _candidates is not None:
+            _index = _match_block(target, _pos, block, _candidates, _expected)
+            if _index is not None:
+                _matches.append((_pos, _index))
+                _expected = _index + 1
+                _pos += block
+                _a = None
+                continue
+        if _pos + block < _size:
+            _out = target[_pos]
+            _a = (_a - _out + target[_pos + block]) & 0xffff
+            _b = (_b - block * _out + _a) & 0xffff
+        _pos += 1
+    return _matches
+
+def _find_matches_numpy(target, block: int, sigs) -> List[Tuple[int, int]]:
+    _matches = list()
+    _size = len(target)
+    _known = numpy.fromiter(sigs.keys(), dtype=numpy.int64, count=len(sigs))
+    _known.sort()
+    _pos = 0
+    _expected = -1
+    _chunk_start = 0
+    while _chunk_start + block <= _size:
+        _chunk_end = min(_size, _chunk_start + NUMPY_CHUNK + block - 1)
+        _x = numpy.frombuffer(target, dtype=numpy.uint8, count=_chunk_end - _chunk_start, offset=_chunk_start).astype(numpy.int64)
+        _k = numpy.arange(len(_x), dtype=numpy.int64)
+        _sx = numpy.concatenate(([0], numpy.cumsum(_x)))
+        _skx = numpy.concatenate(([0], numpy.cumsum(_k * _x)))
+        _starts = numpy.arange(len(_x) - block + 1, dtype=numpy.int64)
+        _a = _sx[_starts + block] - _sx[_starts]
+        _b = (_starts + block) * _a - (_skx[_starts + block] - _skx[_starts])
+        _weak = (_a & 0xffff) | ((_b & 0xffff) << 16)
+        _hits = numpy.nonzero(numpy.isin(_weak, _known, assume_unique=False))[0]
+        for _offset in _hits.tolist():
+            _candidate_pos = _chunk_start + _offset
+            if _candidate_pos < _pos:
+                continue
+            _index = _match_block(target, _candidate_pos, block, sigs[int(_weak[_offset])], _expected)
+            if _index is not None:
+                _matches.append((_candidate_pos, _index))
+                _expected = _index + 1
+                _pos = _candidate_pos + block
+        _chunk_start += len(_starts)
+    return _matches
+
+def _map_file(f):
+    if os.fstat(f.fileno()).st_size == 0:
+        return b''
+    return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def make_delta(base_path: str, target_path: str, out_path: str, block: Optional[int] = None) -> DeltaStats:
+    """
+    Writes a binary delta turning base_path into target_path.
+    Blocks of the base are found anywhere in the target through a rolling weak checksum confirmed by a strong hash,
+    the checksums are vectorised with numpy when it is installed. The rest is stored as literal data.
+    """
+    with open(base_path, 'rb') as _bf, open(target_path, 'rb') as _tf:
+        _base = _map_file(_bf)
+        _target = _map_file(_tf)
+        try:
+            if block is None:
+                block = _choose_block_size(len(_base))
+            _stats = DeltaStats(len(_target))
+            _load_numpy()
+            _sigs = _build_signatures(_base, block)
+            if len(_sigs) == 0:
+                _matches = list()
+            elif numpy is not None:
+                _matches = _find_matches_numpy(_target, block, _sigs)
+            else:
+                _matches = _find_matches_python(_target, block, _sigs)
+            with open(out_path, 'wb') as _out:
+                _out.write(DELTA_MAGIC)
+                _out.write(DELTA_HEADER.pack(block, len(_base), len(_target), _file_digest(_target)))
+                _literal_start = 0
+                _run = None
+                for pos, index in _matches + [(len(_target), None)]:
+                    if _run is not None and (index is None or pos != _run[2] or index != _run[0] + _run[1]):
+                        _out.write(OP_COPY + DELTA_COPY.pack(_run[0], _run[1]))
+                        _run = None
+                    for _chunk_start in range(_literal_start, pos, LITERAL_CHUNK):
+                        _chunk_end = min(pos, _chunk_start + LITERAL_CHUNK)
+                        _out.write(OP_DATA + DELTA_DATA.pack(_chunk_end - _chunk_start))
+                        _out.write(_target[_chunk_start:_chunk_end])
+                        _stats.literal += _chunk_end - _chunk_start
+                    if index is not None:
+                        _run = (_run[0], _run[1] + 1, pos + block) if _run is not None else (index, 1, pos + block)
+                        _stats.copied += block
+                        _literal_start = pos + block
+                _out.write(OP_END)
+                _stats.delta_size = _out.tell()
+        finally:
+            for _m in (_base, _target):
+                if isinstance(_m, mmap.mmap):
+                    _m.close()
+    return _stats
+
+def apply_delta(base_path: str, delta_path: str, out_path: str):
+    """Rebuilds the target of a delta from its base, the result is verified before it replaces out_path."""
+    _tmp_path = f'{out_path}.part'
+    _hash = hashlib.blake2b(digest_size=16)
+    try:
+        with open(delta_path, 'rb') as _delta, open(base_path, 'rb') as _base, open(_tmp_path, 'wb') as _out:
+            if _delta.read(len(DELTA_MAGIC)) != DELTA_MAGIC:
+                raise ValueError(f"{delta_path} is not a delta file.")
+            try:
+                block, base_size, target_size, digest = DELTA_HEADER.unpack(_delta.read(DELTA_HEADER.size))
+            except struct.error:
+                raise ValueError(f"{delta_path} is truncated or corrupt.")
+            if os.fstat(_base.fileno()).st_size != base_size:
+                raise ValueError(f"{base_path} does not match the base of {delta_path}.")
+            while True:
+                _op = _delta.read(1)
+                try:
+                    if _op == OP_COPY:
+                        index, count = DELTA_COPY.unpack(_delta.read(DELTA_COPY.size))
+                        _base.seek(index * block)
+                        _data = _base.read(count * block)
+                    elif _op == OP_DATA:
+                        _data = _delta.read(DELTA_DATA.unpack(_delta.read(DELTA_DATA.size))[0])
+                    elif _op == OP_END:
+                        break
+                    else:
+                        raise ValueError(f"{delta_path} is truncated or corrupt.")
+                except struct.error:
+                    raise ValueError(f"{delta_path} is truncated or corrupt.")
+                _hash.update(_data)
+                _out.write(_data)
+        if _hash.digest() != digest or os.path.getsize(_tmp_path) != target_size:
+            raise ValueError(f"Applying {delta_path} did not reproduce the expected file.")
+        os.replace(_tmp_path, out_path)
+    finally:
+        if os.path.exists(_tmp_path):
+            os.remove(_tmp_path)
+
+def make_patch_deltas(names: List[Tuple[str, str]], base_dir: str, delta_dir: str, min_size: int = DELTA_MIN_SIZE,
+                      progress: Optional[TaskProgress] = None) -> List[Tuple[str, str]]:
+    """
+    Swaps large files of a patch for deltas against the same file in base_dir, a previous full patch or a stored copy of the base rev.
+    Returns the updated (source, relative name) list, a delta only replaces the file when it is smaller.
+    """
+    _names = list()
+    for src, rel in names:
+        if progress is not None:
+            progress.advance(1)
+        _base = os.path.join(base_dir, rel)
+        try:
+            _use_delta = os.path.getsize(src) >= min_size and os.path.isfile(_base)
+        except OSError:
+            _use_delta = False
+        if _use_delta:
+            _delta = os.path.join(delta_dir, rel + DELTA_EXTENSION)
+            os.makedirs(os.path.dirname(_delta), exist_ok=True)
+            try:
+                _stats = make_delta(_base, src, _delta)
+            except (OSError, ValueError) as e:
+                debug_print(f'    Failed to build a delta for {src}: {e}')
+            else:
+                if metrics.enabled:
+                    metrics.count('patch.delta_bytes_read', _stats.target_size)
+                    metrics.count('patch.delta_bytes_written', _stats.delta_size)
+                if _stats.delta_size < _stats.target_size:
+                    if debuglvl >= 1:
+                        debug_print(f'    Delta for {rel}: {_stats.delta_size}/{_stats.target_size} bytes')
+                    _names.append((_delta, rel + DELTA_EXTENSION))
+                    continue
+                os.remove(_delta)
+        _names.append((src, rel))
+    return _names
+
+def apply_patch_deltas(install_dir: str, patch_dir: str) -> int:
+    """Applies every delta of an unpacked patch to the files of an install, returns the number of rebuilt files."""
+    _applied = 0
+    for _root, _, _files in os.walk(patch_dir):
+        for _name in _files:
+            if not _name.endswith(DELTA_EXTENSION):
+                continue
+            _rel = os.path.relpath(os.path.join(_root, _name[:-len(DELTA_EXTENSION)]), patch_dir)
+            _target = os.path.join(install_dir, _rel)
+            apply_delta(_target, os.path.join(_root, _name), _target)
+            _applied += 1
+    return _applied
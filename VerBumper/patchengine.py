@@ -0,0 +1,180 @@
+import os
+import shutil
+import sys
+import tarfile
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from utils import *
+from instrumentation import *
+from tasks import TaskProgress
+
+__all__ = ['get_patch_file_names', 'get_patch_file_targets', 'copy_patch_files', 'write_patch_archive', 'get_patch_archive_path', 'PatchCopyResult',
+
+           'PATCH_COPY_MODES', 'PATCH_ARCHIVE_FORMATS', 'PATCH_OUTPUT_FORMATS', 'DEFAULT_COPY_WORKERS', 'DEFAULT_COMPRESSION_LEVEL', 'STORED_EXTENSIONS']
+
+PATCH_COPY_MODES = ('copy', 'hardlink', 'reflink')
+DEFAULT_COPY_WORKERS = min(8, (os.cpu_count() or 1) * 2)
+
+PATCH_ARCHIVE_FORMATS = ('zip', 'tar.xz')
+PATCH_OUTPUT_FORMATS = ('folder',) + PATCH_ARCHIVE_FORMATS
+DEFAULT_COMPRESSION_LEVEL = 6
+# Files that are already compressed gain nothing from deflate, zip archives store them as is
+STORED_EXTENSIONS = frozenset(('.zip', '.7z', '.rar', '.gz', '.xz', '.bz2', '.zst', '.lz4', '.pak', '.png', '.jpg', '.jpeg', '.webp', '.dds', '.ktx2',
+                               '.ogg', '.mp3', '.opus', '.m4a', '.mp4', '.webm', '.mkv', '.avi', '.woff', '.woff2'))
+
+# Linux FICLONE ioctl, clones the extents of a file on btrfs/xfs/bcachefs
+FICLONE = 0x40049409
+
+def get_patch_file_names(project_path: str, paths: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    Maps every changed file to its relative name inside the patch, files outside of the project land in the patch root.
+    """
+    _names = list()
+    _project_path = replace_slashes(project_path).rstrip('/')
+    for _pf in paths:
+        _rel = None
+        if _pf.startswith(_project_path):
+            _rel = replace_slashes(_pf)[len(_project_path):].lstrip('/')
+        if not _rel:
+            _rel = os.path.basename(_pf)
+        _names.append((_pf, _rel))
+    return _names
+
+def get_patch_file_targets(project_path: str, paths: Iterable[str], patch_dir: str) -> List[Tuple[str, str]]:
+    return [(src, f'{patch_dir}/{rel}') for src, rel in get_patch_file_names(project_path, paths)]
+
+def get_patch_archive_path(patch_dir: str, fmt: str) -> str:
+    return f'{patch_dir}.{fmt}'
+
+class PatchCopyResult(object):
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.failed = list()
+
+def _reflink_file(src: str, dst: str):
+    with open(src, 'rb') as _src, open(dst, 'wb') as _dst:
+        try:
+            import fcntl
+            fcntl.ioctl(_dst.fileno(), FICLONE, _src.fileno())
+        except (ImportError, OSError):
+            if not hasattr(os, 'copy_file_range'):
+                raise
+            # copy_file_range still lets the filesystem share extents or copy server-side on NFS
+            _remaining = os.fstat(_src.fileno()).st_size
+            while _remaining > 0:
+                _copied = os.copy_file_range(_src.fileno(), _dst.fileno(), _remaining)
+                if _copied == 0:
+                    break
+                _remaining -= _copied
+    shutil.copystat(src, dst)
+
+def _copy_file(src: str, dst: str, mode: str):
+    # A previous hardlinked patch may still share its inode with the project file, never write through it
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == 'hardlink':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif mode == 'reflink' and sys.platform.startswith('linux'):
+        try:
+            _reflink_file(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+def _count_patch(result: PatchCopyResult):
+    if metrics.enabled:
+        metrics.count('patch.files', result.files)
+        metrics.count('patch.bytes', result.bytes)
+        metrics.count('patch.failed', len(result.failed))
+
+def copy_patch_files(targets: List[Tuple[str, str]], mode: str = 'copy', workers: int = DEFAULT_COPY_WORKERS,
+                     progress: Optional[TaskProgress] = None) -> PatchCopyResult:
+    """
+    Copies the patch files on a thread pool after creating the whole folder tree once.
+    hardlink and reflink modes fall back to a plain copy where the filesystem does not support them.
+    When progress is cancelled the queued copies are skipped and TaskCancelled is raised once the running ones finish.
+    """
+    if mode not in PATCH_COPY_MODES:
+        raise ValueError(f"Unknown patch copy mode {mode}.")
+    for _dir in {os.path.dirname(dst) for _, dst in targets}:
+        os.makedirs(_dir, exist_ok=True)
+    _result = PatchCopyResult()
+
+    def _copy(target: Tuple[str, str]):
+        src, dst = target
+        if progress is not None and progress.cancelled.is_set():
+            return src, None
+        try:
+            _copy_file(src, dst, mode)
+            return src, os.stat(dst).st_size
+        except OSError as e:
+            debug_print(f'    Failed to copy {src}: {e}')
+            return src, None
+
+    with metrics.timer('patch.copy'), ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='PatchCopy') as _pool:
+        for src, size in _pool.map(_copy, targets):
+            if progress is not None:
+                progress.check()
+            if size is None:
+                _result.failed.append(src)
+            else:
+                _result.files += 1
+                _result.bytes += size
+                if progress is not None:
+                    progress.advance(1, size)
+    _count_patch(_result)
+    return _result
+
+def write_patch_archive(names: List[Tuple[str, str]], out_path: str, fmt: str = 'zip', level: int = DEFAULT_COMPRESSION_LEVEL,
+                        stored_extensions: Iterable[str] = STORED_EXTENSIONS, progress: Optional[TaskProgress] = None) -> PatchCopyResult:
+    """
+    Streams the patch files straight into a zip or tar.xz archive in a single pass.
+    Zip entries with an already compressed extension are stored, tar.xz compresses the whole stream at the given preset.
+    The archive is written next to out_path and moved into place once complete.
+    """
+    if fmt not in PATCH_ARCHIVE_FORMATS:
+        raise ValueError(f"Unknown patch archive format {fmt}.")
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    _stored = frozenset(x.lower() for x in stored_extensions)
+    _result = PatchCopyResult()
+    _tmp_path = f'{out_path}.part'
+    if fmt == 'zip':
+        _archive = zipfile.ZipFile(_tmp_path, 'w', compression=zipfile.ZIP_DEFLATED, compresslevel=level)
+    else:
+        _archive = tarfile.open(_tmp_path, 'w:xz', preset=level)
+    try:
+        with metrics.timer('patch.archive'), _archive:
+            for src, arcname in names:
+                if progress is not None:
+                    progress.check()
+                try:
+                    if fmt == 'zip':
+                        _stored_file = os.path.splitext(arcname)[1].lower() in _stored
+                        _archive.write(src, arcname, compress_type=zipfile.ZIP_STORED if _stored_file else zipfile.ZIP_DEFLATED,
+                                       compresslevel=None if _stored_file else level)
+                    else:
+                        _archive.add(src, arcname, recursive=False)
+                    _size = os.path.getsize(src)
+                    _result.bytes += _size
+                    _result.files += 1
+                    if progress is not None:
+                        progress.advance(1, _size)
+                except OSError as e:
+                    debug_print(f'    Failed to archive {src}: {e}')
+                    _result.failed.append(src)
+        os.replace(_tmp_path, out_path)
+    except BaseException:
+        if os.path.exists(_tmp_path):
+            os.remove(_tmp_path)
+        raise
+    _count_patch(_result)
+    return _result
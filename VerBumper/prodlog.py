@@ -0,0 +1,271 @@
+import datetime
+import json
+import os
+
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from utils import *
+from storage import *
+
+__all__ = ['append_session', 'iter_sessions', 'iter_prod_log_files', 'read_day', 'iter_all_sessions', 'convert_legacy_prod_logs', 'get_prod_log_path',
+           'get_prod_log_date',
+
+           'ProdLogSummaryIndex',
+
+           'PROD_LOG_EXTENSION', 'LEGACY_PROD_LOG_EXTENSION', 'SUMMARY_INDEX_NAME']
+
+PROD_LOG_EXTENSION = '.jsonl'
+LEGACY_PROD_LOG_EXTENSION = '.json'
+# Dot files are never taken for day logs
+SUMMARY_INDEX_NAME = '.summary.json'
+SUMMARY_FIELDS = ('sessions', 'full_length', 'pause_duration', 'duration', 'code_revisions')
+# Sessions are logged under the day they started, only the latest days can still be appended to
+LIVE_DAYS = 2
+
+def get_prod_log_path(folder: str, date: Union[str, datetime.date]) -> str:
+    return os.path.join(folder, f'{date}{PROD_LOG_EXTENSION}')
+
+def get_prod_log_date(name: str) -> Optional[str]:
+    """The date of a day log file name, None for anything else in the folder."""
+    if name.startswith('.'):
+        return None
+    for _ext in (PROD_LOG_EXTENSION, LEGACY_PROD_LOG_EXTENSION):
+        if name.endswith(_ext):
+            return name[:-len(_ext)]
+    return None
+
+def _encode_session(session: dict) -> bytes:
+    return (json.dumps(session, separators=(',', ':')) + '\n').encode('utf-8')
+
+def _append_day_log(folder: str, date: Union[str, datetime.date], data: bytes, fsync: bool):
+    _path = get_prod_log_path(folder, date)
+    # O_APPEND writes are only atomic on POSIX, the folder lock keeps appends of other processes apart on Windows too
+    # and keeps them out of a day log being converted
+    with locked(folder):
+        _fd = os.open(_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o666)
+        try:
+            os.write(_fd, data)
+            if fsync:
+                os.fsync(_fd)
+        finally:
+            os.close(_fd)
+
+def append_session(folder: str, date: Union[str, datetime.date], session: dict):
+    """
+    Appends one session to the day log with a single write under the prod log folder's lock, concurrent appends never overwrite each other.
+    """
+    os.makedirs(folder, exist_ok=True)
+    _append_day_log(folder, date, _encode_session(session), FSYNC_WRITES)
+
+def iter_sessions(path: str) -> Iterator[dict]:
+    """Streams the sessions of a day log, legacy JSON arrays included. A torn last line is skipped."""
+    if path.endswith(LEGACY_PROD_LOG_EXTENSION):
+        try:
+            _sessions = read_json(path)
+        except (json.decoder.JSONDecodeError, OSError):
+            debug_print(f'Failure to read malformed prod log {path}.')
+            return
+        yield from (x for x in _sessions if isinstance(x, dict))
+        return
+    with open(path, 'rb') as _f:
+        for _line in _f:
+            if not _line.strip():
+                continue
+            try:
+                _session = json.loads(_line)
+            except ValueError:
+                debug_print(f'Skipping a malformed session in {path}.')
+                continue
+            if isinstance(_session, dict):
+                yield _session
+
+def iter_prod_log_files(folder: str) -> List[Tuple[str, str]]:
+    """(date, path) of every day log in the folder, sorted by date. A day with both a legacy and a new file gets both listed."""
+    _days = dict()
+    if os.path.isdir(folder):
+        for _entry in os.scandir(folder):
+            _date = get_prod_log_date(_entry.name)
+            if _date is not None:
+                # Until it is converted the legacy file holds the older sessions of the day, read both
+                _days.setdefault(_date, list()).append(_entry.path)
+    return [(date, path) for date in sorted(_days) for path in sorted(_days[date])]
+
+def read_day(folder: str, date: str) -> List[dict]:
+    _sessions = list()
+    for _ext in (LEGACY_PROD_LOG_EXTENSION, PROD_LOG_EXTENSION):
+        _path = os.path.join(folder, f'{date}{_ext}')
+        if os.path.exists(_path):
+            _sessions.extend(iter_sessions(_path))
+    # Converted sessions may land after the ones appended in the new format, all of a day share the date part
+    _sessions.sort(key=lambda x: str(x.get('sessionstart', '')))
+    return _sessions
+
+def iter_all_sessions(folder: str) -> Iterator[Tuple[str, dict]]:
+    """(date, session) for every session in the folder, one line at a time."""
+    for date, path in iter_prod_log_files(folder):
+        for _session in iter_sessions(path):
+            yield date, _session
+
+def convert_legacy_prod_logs(folder: str) -> int:
+    """
+    Moves the sessions of every legacy <date>.json array into <date>.jsonl and removes the array, returns the number of converted days.
+    The day log is replaced with its content plus the sessions under the folder lock, a conversion cut short before
+    the array was removed is found in the day log on the next run and not added twice.
+    """
+    _converted = 0
+    if not os.path.isdir(folder):
+        return _converted
+    for _entry in list(os.scandir(folder)):
+        if _entry.name.startswith('.') or not _entry.name.endswith(LEGACY_PROD_LOG_EXTENSION):
+            continue
+        _date = _entry.name[:-len(LEGACY_PROD_LOG_EXTENSION)]
+        try:
+            _sessions = read_json(_entry.path)
+        except (json.decoder.JSONDecodeError, OSError):
+            debug_print(f'Failure to convert malformed prod log {_entry.name}. skipping')
+            continue
+        if not isinstance(_sessions, list):
+            continue
+        _data = b''.join(_encode_session(x) for x in _sessions if isinstance(x, dict))
+        _path = get_prod_log_path(folder, _date)
+        with locked(folder), unbatched():
+            try:
+                with open(_path, 'rb') as _f:
+                    _existing = _f.read()
+            except FileNotFoundError:
+                _existing = b''
+            if _data not in _existing:
+                atomic_write(_path, _existing + _data, fsync=True)
+            os.remove(_entry.path)
+        debug_print(f'Converted prod log {_entry.name}')
+        _converted += 1
+    return _converted
+
+def _add_session(summary: dict, session: dict):
+    summary['sessions'] += 1
+    for _field in SUMMARY_FIELDS[1:]:
+        _value = session.get(_field, 0)
+        if isinstance(_value, (int, float)):
+            summary[_field] += _value
+
+class ProdLogSummaryIndex(object):
+    """
+    Per day log totals (sessions, lengths, code revisions) kept in ProdLogs/.summary.json so they never need a full parse.
+    Day logs only grow, a refresh parses just the lines appended to a log since the byte offset recorded for it.
+    Logs that shrank or were rewritten, legacy arrays included, are summed again from scratch.
+    A refresh lists the folder names only, it summarizes new logs and checks the logs of the latest days alone,
+    older logs are checked when get_day() asks for them.
+    """
+    VERSION = 1
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.path = os.path.join(folder, SUMMARY_INDEX_NAME)
+        self.files: Dict[str, dict] = dict()
+        self.load()
+
+    def load(self):
+        try:
+            _data = read_json(self.path)
+        except FileNotFoundError:
+            return
+        except (json.decoder.JSONDecodeError, OSError):
+            debug_print('Failure to read malformed prod log summary index, rebuilding.')
+            return
+        if isinstance(_data, dict) and _data.get('version', None) == self.VERSION:
+            self.files = _data.get('files', dict())
+
+    def save(self):
+        write_json(self.path, {'version': self.VERSION, 'files': self.files})
+
+    @staticmethod
+    def _summarize(path: str, record: dict):
+        if path.endswith(LEGACY_PROD_LOG_EXTENSION):
+            for _session in iter_sessions(path):
+                _add_session(record, _session)
+            return
+        with open(path, 'rb') as _f:
+            _f.seek(record['offset'])
+            _data = _f.read()
+        # A line still being written is picked up by the next refresh
+        _end = _data.rfind(b'\n') + 1
+        for _line in _data[:_end].splitlines():
+            if not _line.strip():
+                continue
+            try:
+                _session = json.loads(_line)
+            except ValueError:
+                continue
+            if isinstance(_session, dict):
+                _add_session(record, _session)
+        record['offset'] += _end
+
+    def _validate(self, name: str, date: str) -> bool:
+        """Sums the day log again if its size or mtime moved since it was summarized, returns whether its totals changed."""
+        _path = os.path.join(self.folder, name)
+        try:
+            _st = os.stat(_path)
+        except FileNotFoundError:
+            return self.files.pop(name, None) is not None
+        _record = self.files.get(name, None)
+        if _record is not None and _record['size'] == _st.st_size and _record['mtime_ns'] == _st.st_mtime_ns:
+            return False
+        if _record is None or _st.st_size <= _record['size'] or name.endswith(LEGACY_PROD_LOG_EXTENSION):
+            _record = dict({x: 0 for x in SUMMARY_FIELDS}, date=date, offset=0)
+        try:
+            self._summarize(_path, _record)
+        except OSError as e:
+            debug_print(f'Failure to summarize prod log {name}: {e}')
+            return False
+        _record['size'] = _st.st_size
+        _record['mtime_ns'] = _st.st_mtime_ns
+        self.files[name] = _record
+        return True
+
+    def refresh(self) -> bool:
+        """Brings the totals up to date with the folder, returns whether anything changed."""
+        _names = dict()
+        if os.path.isdir(self.folder):
+            # Names only, DirEntry.name never needs a stat
+            for _entry in os.scandir(self.folder):
+                _date = get_prod_log_date(_entry.name)
+                if _date is not None:
+                    _names[_entry.name] = _date
+        _changed = False
+        for _name in [x for x in self.files if x not in _names]:
+            del self.files[_name]
+            _changed = True
+        for _name, _date in _names.items():
+            if _name not in self.files:
+                _changed = self._validate(_name, _date) or _changed
+        _live = set(self.get_dates()[-LIVE_DAYS:])
+        for _name in [x for x, r in self.files.items() if r['date'] in _live]:
+            _changed = self._validate(_name, self.files[_name]['date']) or _changed
+        if _changed:
+            self.save()
+        return _changed
+
+    def get_dates(self) -> List[str]:
+        return sorted({x['date'] for x in self.files.values()})
+
+    def get_day(self, date: str) -> dict:
+        """Totals of a day, its logs are checked against the disk first."""
+        _changed = False
+        for _name in [x for x, r in self.files.items() if r['date'] == date]:
+            _changed = self._validate(_name, date) or _changed
+        if _changed:
+            self.save()
+        _summary = {x: 0 for x in SUMMARY_FIELDS}
+        for _record in self.files.values():
+            if _record['date'] == date:
+                for _field in SUMMARY_FIELDS:
+                    _summary[_field] += _record[_field]
+        return _summary
+
+    def get_totals(self) -> dict:
+        _summary = {x: 0 for x in SUMMARY_FIELDS}
+        for _record in self.files.values():
+            for _field in SUMMARY_FIELDS:
+                _summary[_field] += _record[_field]
+        _summary['days'] = len(self.get_dates())
+        return _summary
@@ -1,25 +1,69 @@
 import os
 import json
+import threading
+
+VERSION_FILE_NAME = 'version.json'
+
+_cache = {'path': None, 'mtime_ns': None, 'size': None, 'data': dict()}
+_cache_lock = threading.Lock()
+
+
+def find_version_file() -> str:
+    """
+    The version.json of the project this module is shipped in: the closest one in the folder of the module or above it,
+    the one in the current working directory when there is none.
+    """
+    _dir = os.path.dirname(os.path.abspath(__file__))
+    while True:
+        _path = os.path.join(_dir, VERSION_FILE_NAME)
+        if os.path.isfile(_path):
+            return _path
+        _parent = os.path.dirname(_dir)
+        if _parent == _dir:
+            return os.path.abspath(VERSION_FILE_NAME)
+        _dir = _parent
+
+
+def get_version_data() -> dict:
+    """
+    The content of version.json, read again only when its mtime or size changed since the last call.
+    The returned dict is shared between callers and must not be modified.
+    """
+    with _cache_lock:
+        if _cache['path'] is None:
+            _cache['path'] = find_version_file()
+        try:
+            _st = os.stat(_cache['path'])
+        except OSError:
+            _cache.update(mtime_ns=None, size=None, data=dict())
+            return _cache['data']
+        if _st.st_mtime_ns != _cache['mtime_ns'] or _st.st_size != _cache['size']:
+            try:
+                with open(_cache['path'], 'r') as vd:
+                    _data = json.load(vd)
+            except (OSError, ValueError):
+                # Caught mid write, the next call tries again
+                return _cache['data']
+            _cache.update(mtime_ns=_st.st_mtime_ns, size=_st.st_size, data=_data if isinstance(_data, dict) else dict())
+        return _cache['data']
+
+
 class VersionData(object):
     def __init__(self):
-        if os.path.exists('version.json'):
-            with open('version.json', 'r') as vd:
-                self.vd: dict = json.load(vd)
-        else:
-            self.vd = dict()
+        self.vd: dict = get_version_data()
 
     @property
     def version(self) -> str:
-        return self.vd.setdefault('version', 'Unknown')
+        return self.vd.get('version', 'Unknown')
 
     @property
     def coderev(self) -> str:
-        return self.vd.setdefault('coderev', 'Unknown')
+        return self.vd.get('coderev', 'Unknown')
 
     @property
     def buildstamp(self) -> int:
-        return self.vd.setdefault('buildstamp', 0)
+        return self.vd.get('buildstamp', 0)
 
     @property
     def buildtime(self) -> str:
-        return self.vd.setdefault('buildtime', 'Unknown')
\ No newline at end of file
+        return self.vd.get('buildtime', 'Unknown')
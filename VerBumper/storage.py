@@ -0,0 +1,196 @@
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from typing import Any, Dict, Optional, Tuple, Union
+
+from instrumentation import metrics
+
+__all__ = ['atomic_write', 'write_json', 'read_json', 'locked', 'batched_writes', 'unbatched', 'flush_writes',
+
+           'FSYNC_WRITES', 'LOCK_DIR', 'LOCK_SUFFIX', 'TEMP_SUFFIX']
+
+# Set VERBUMPER_FSYNC=1 to make every state file write durable before it replaces the old file
+FSYNC_WRITES = os.environ.get('VERBUMPER_FSYNC', '0') not in ('', '0')
+LOCK_SUFFIX = '.lock'
+LOCK_DIR = os.path.join(tempfile.gettempdir(), 'VerBumperLocks')
+TEMP_SUFFIX = '.tmp'
+LOCK_POLL_INTERVAL = 0.05
+
+_batch = threading.local()
+
+def _read_umask() -> int:
+    # os.umask can only be read by setting it, which would race with other threads, the kernel reports it in the status file
+    # and elsewhere the mode of a probe file created with 0o666 shows it
+    with contextlib.suppress(OSError, ValueError):
+        with open('/proc/self/status', 'r') as _status:
+            for _line in _status:
+                if _line.startswith('Umask:'):
+                    return int(_line.split()[1], 8)
+    with contextlib.suppress(OSError):
+        with tempfile.TemporaryDirectory() as _dir:
+            _probe = os.path.join(_dir, 'umask')
+            os.close(os.open(_probe, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+            return 0o666 & ~os.stat(_probe).st_mode & 0o777
+    return 0o022
+
+# New state files get the permissions open() would have given them
+NEW_FILE_MODE = 0o666 & ~_read_umask()
+
+def _fsync_dir(path: str):
+    if os.name == 'nt':
+        return
+    _fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(_fd)
+    finally:
+        os.close(_fd)
+
+def _write_now(path: str, data: bytes, fsync: bool, lock: bool = False):
+    if metrics.enabled:
+        metrics.count('storage.writes')
+        metrics.count('storage.bytes_written', len(data))
+    with metrics.timer('storage.write'), (locked(path) if lock else contextlib.nullcontext()):
+        _write_file(path, data, fsync)
+
+def _write_file(path: str, data: bytes, fsync: bool):
+    _dir = os.path.dirname(os.path.abspath(path))
+    os.makedirs(_dir, exist_ok=True)
+    _fd, _tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix=TEMP_SUFFIX, dir=_dir)
+    try:
+        with os.fdopen(_fd, 'wb') as _tmp:
+            _tmp.write(data)
+            if fsync:
+                _tmp.flush()
+                os.fsync(_tmp.fileno())
+        # mkstemp creates the file as 0600, keep the permissions the state file had or use the default ones for a new file
+        try:
+            _mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            _mode = NEW_FILE_MODE
+        os.chmod(_tmp_path, _mode)
+        os.replace(_tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(_tmp_path)
+        raise
+    if fsync:
+        _fsync_dir(path)
+
+def atomic_write(path: str, data: Union[str, bytes], fsync: Optional[bool] = None, lock: bool = False):
+    """
+    Replaces path with data through a temporary file in the same folder, readers see either the old or the new content.
+    Inside batched_writes() the write is held back until the batch ends, only the last content of every path is written.
+    With lock the replace happens under locked(path), serialized with the other processes writing the file.
+    """
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    fsync = FSYNC_WRITES if fsync is None else fsync
+    _pending: Optional[Dict[str, Tuple[bytes, bool, bool]]] = getattr(_batch, 'pending', None)
+    if _pending is not None:
+        _key = os.path.abspath(path)
+        _held = _pending.get(_key, None)
+        _pending[_key] = (data, fsync or (_held is not None and _held[1]), lock or (_held is not None and _held[2]))
+        return
+    _write_now(path, data, fsync, lock)
+
+def write_json(path: str, data: Any, indent: int = 4, fsync: Optional[bool] = None, lock: bool = False):
+    atomic_write(path, json.dumps(data, indent=indent), fsync, lock)
+
+def read_json(path: str) -> Any:
+    """json.load of path that also sees the writes still held back by the current batch."""
+    _pending: Optional[Dict[str, Tuple[bytes, bool, bool]]] = getattr(_batch, 'pending', None)
+    if _pending is not None:
+        _held = _pending.get(os.path.abspath(path), None)
+        if _held is not None:
+            return json.loads(_held[0])
+    with open(path, 'r') as _f:
+        return json.load(_f)
+
+@contextlib.contextmanager
+def locked(path: str, timeout: Optional[float] = None):
+    """
+    Advisory lock guarding the writes of path between processes.
+    The lock is held on a file under LOCK_DIR named after the path, the state file itself is replaced on every write
+    and a lock file next to it would show up as a change of the project it sits in.
+    """
+    _lock_path = os.path.join(LOCK_DIR, hashlib.sha1(os.path.normcase(os.path.abspath(path)).encode('utf-8')).hexdigest() + LOCK_SUFFIX)
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    _fd = os.open(_lock_path, os.O_RDWR | os.O_CREAT, 0o666)
+    _deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    msvcrt.locking(_fd, msvcrt.LK_NBLCK, 1)
+                    break
+                except OSError:
+                    if _deadline is not None and time.monotonic() > _deadline:
+                        raise TimeoutError(f"Timed out waiting for the lock on {path}.")
+                    time.sleep(LOCK_POLL_INTERVAL)
+        else:
+            import fcntl
+            while True:
+                try:
+                    fcntl.flock(_fd, fcntl.LOCK_EX | (fcntl.LOCK_NB if _deadline is not None else 0))
+                    break
+                except BlockingIOError:
+                    if time.monotonic() > _deadline:
+                        raise TimeoutError(f"Timed out waiting for the lock on {path}.")
+                    time.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            if os.name == 'nt':
+                import msvcrt
+                os.lseek(_fd, 0, os.SEEK_SET)
+                msvcrt.locking(_fd, msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(_fd, fcntl.LOCK_UN)
+    finally:
+        os.close(_fd)
+
+def flush_writes():
+    """Writes everything held back by the current batch, the batch stays open."""
+    _pending: Optional[Dict[str, Tuple[bytes, bool, bool]]] = getattr(_batch, 'pending', None)
+    if not _pending:
+        return
+    _items = list(_pending.items())
+    _pending.clear()
+    for path, (data, fsync, lock) in _items:
+        _write_now(path, data, fsync, lock)
+
+@contextlib.contextmanager
+def batched_writes():
+    """
+    Holds back the atomic writes made by this thread until the block ends, used around the handling of one UI event.
+    Nested blocks join the outermost one.
+    """
+    if getattr(_batch, 'pending', None) is not None:
+        yield
+        return
+    _batch.pending = dict()
+    try:
+        yield
+    finally:
+        try:
+            flush_writes()
+        finally:
+            _batch.pending = None
+
+@contextlib.contextmanager
+def unbatched():
+    """Flushes the current batch and writes straight through for the block, used around nested tool windows."""
+    _pending = getattr(_batch, 'pending', None)
+    flush_writes()
+    _batch.pending = None
+    try:
+        yield
+    finally:
+        _batch.pending = _pending
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from typing import Any, Callable, Optional
+
+__all__ = ['TaskProgress', 'BackgroundTask', 'TaskCancelled', 'format_task_progress',
+
+           'TASK_PROGRESS_INTERVAL']
+
+# Progress events are sent to the window at most this often, a scan reports every folder it lists
+TASK_PROGRESS_INTERVAL = 0.1
+
+class TaskCancelled(Exception):
+    """Raised inside a task at the next progress report after Cancel was pressed."""
+    pass
+
+class TaskProgress(object):
+    """
+    Files and bytes handled by a long operation so far, with the flag that asks it to stop.
+    Scans, hashing and patch copies call advance() as they go, which raises TaskCancelled once cancel() was called.
+    """
+    def __init__(self, on_update: Optional[Callable[['TaskProgress'], None]] = None, interval: float = TASK_PROGRESS_INTERVAL,
+                 cancelled: Optional[threading.Event] = None):
+        self.files = 0
+        self.bytes = 0
+        self.stage = ''
+        # Several tasks can share one event, a batch cancels all of its projects at once
+        self.cancelled = cancelled if cancelled is not None else threading.Event()
+        self.on_update = on_update
+        self.interval = interval
+        self.last_update = 0.0
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise TaskCancelled()
+
+    def set_stage(self, stage: str):
+        """Names the step being run, the counters start over."""
+        self.check()
+        self.stage = stage
+        self.files = 0
+        self.bytes = 0
+        self.notify(True)
+
+    def advance(self, files: int = 0, nbytes: int = 0):
+        self.check()
+        self.files += files
+        self.bytes += nbytes
+        self.notify()
+
+    def notify(self, force: bool = False):
+        if self.on_update is None:
+            return
+        _now = time.monotonic()
+        if force or _now - self.last_update >= self.interval:
+            self.last_update = _now
+            self.on_update(self)
+
+def format_task_progress(stage: str, files: int, nbytes: int) -> str:
+    _text = f'{stage}: {files} files'
+    if nbytes > 0:
+        _text += f', {nbytes / (1024 * 1024):.1f} MiB'
+    return _text
+
+class BackgroundTask(object):
+    """
+    Runs fn(progress, *args) on a daemon thread and reports to a PySimpleGUI window through write_event_value:
+    key + '_PROGRESS' with (stage, files, bytes) while it runs, then key + '_DONE' with (result, error).
+    error is the exception raised by fn, a TaskCancelled when it was cancelled. Only the UI thread touches the window.
+    """
+    def __init__(self, window, key: str, fn: Callable[..., Any], *args):
+        self.window = window
+        self.key = key
+        self.progress = TaskProgress(self._send_progress)
+        self.thread = threading.Thread(target=self._run, args=(fn, args), name=f'Task{key}', daemon=True)
+
+    def _send_progress(self, progress: TaskProgress):
+        self.window.write_event_value(f'{self.key}_PROGRESS', (progress.stage, progress.files, progress.bytes))
+
+    def _run(self, fn: Callable[..., Any], args: tuple):
+        _result = None
+        _error = None
+        try:
+            _result = fn(self.progress, *args)
+        except BaseException as e:
+            _error = e
+        self.window.write_event_value(f'{self.key}_DONE', (_result, _error))
+
+    def start(self) -> 'BackgroundTask':
+        self.thread.start()
+        return self
+
+    def cancel(self):
+        self.progress.cancel()
+
+    def is_running(self) -> bool:
+        return self.thread.is_alive()
+
+    def wait(self, timeout: Optional[float] = None):
+        self.thread.join(timeout)
@@ -0,0 +1,79 @@
+import os
+import random
+
+import pytest
+
+from patchdelta import make_delta, apply_delta, DELTA_MIN_BLOCK, _load_numpy, _weak_checksum, _weak_checksums_numpy
+
+def _write(path, data: bytes) -> str:
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+def _read(path) -> bytes:
+    with open(path, 'rb') as f:
+        return f.read()
+
+def _round_trip(tmp_path, base: bytes, target: bytes, block=None):
+    _base = _write(tmp_path / 'base.bin', base)
+    _target = _write(tmp_path / 'target.bin', target)
+    _delta = str(tmp_path / 'target.bin.vbdelta')
+    _out = str(tmp_path / 'rebuilt.bin')
+    _stats = make_delta(_base, _target, _delta, block)
+    apply_delta(_base, _delta, _out)
+    assert _read(_out) == target
+    assert not os.path.exists(f'{_out}.part')
+    return _stats
+
+def test_round_trip_of_a_changed_file(tmp_path):
+    _rng = random.Random(7)
+    _base = bytes(_rng.getrandbits(8) for _ in range(64 * DELTA_MIN_BLOCK))
+    # An edit in place, an insertion that shifts everything after it and a truncated tail
+    _target = bytearray(_base)
+    _target[5000:5100] = b'x' * 100
+    _target[40000:40000] = b'inserted bytes'
+    _target = bytes(_target[:-3000])
+    _stats = _round_trip(tmp_path, _base, _target)
+    assert _stats.target_size == len(_target)
+    assert _stats.copied + _stats.literal == len(_target)
+    # Most of the target comes from the base
+    assert _stats.copied > len(_target) // 2
+    assert _stats.delta_size < len(_target) // 4
+
+def test_round_trip_of_an_empty_target(tmp_path):
+    _stats = _round_trip(tmp_path, os.urandom(4 * DELTA_MIN_BLOCK), b'')
+    assert _stats.copied == 0 and _stats.literal == 0
+
+def test_round_trip_with_a_base_smaller_than_a_block(tmp_path):
+    _base = os.urandom(DELTA_MIN_BLOCK // 2)
+    _target = _base + os.urandom(3 * DELTA_MIN_BLOCK)
+    _stats = _round_trip(tmp_path, _base, _target)
+    assert _stats.copied == 0
+    assert _stats.literal == len(_target)
+
+def test_apply_rejects_a_different_base(tmp_path):
+    _base = _write(tmp_path / 'base.bin', os.urandom(8 * DELTA_MIN_BLOCK))
+    _target = _write(tmp_path / 'target.bin', os.urandom(8 * DELTA_MIN_BLOCK))
+    _delta = str(tmp_path / 'target.bin.vbdelta')
+    make_delta(_base, _target, _delta)
+    _other = _write(tmp_path / 'other.bin', os.urandom(DELTA_MIN_BLOCK))
+    with pytest.raises(ValueError):
+        apply_delta(_other, _delta, str(tmp_path / 'rebuilt.bin'))
+
+def test_apply_of_a_truncated_delta_leaves_no_partial_file(tmp_path):
+    _base = _write(tmp_path / 'base.bin', os.urandom(8 * DELTA_MIN_BLOCK))
+    _target = _write(tmp_path / 'target.bin', os.urandom(8 * DELTA_MIN_BLOCK))
+    _delta = str(tmp_path / 'target.bin.vbdelta')
+    make_delta(_base, _target, _delta)
+    _write(_delta, _read(_delta)[:DELTA_MIN_BLOCK])
+    _out = str(tmp_path / 'rebuilt.bin')
+    with pytest.raises(ValueError):
+        apply_delta(_base, _delta, _out)
+    assert not os.path.exists(_out)
+    assert not os.path.exists(f'{_out}.part')
+
+def test_numpy_signatures_match_the_python_checksum(tmp_path):
+    pytest.importorskip('numpy')
+    _load_numpy()
+    _base = os.urandom(5 * DELTA_MIN_BLOCK + 100)
+    assert _weak_checksums_numpy(_base, DELTA_MIN_BLOCK, 5) == [_weak_checksum(_base[x * DELTA_MIN_BLOCK:(x + 1) * DELTA_MIN_BLOCK]) for x in range(5)]
@@ -0,0 +1,76 @@
+import json
+import os
+import shutil
+
+from prodlog import (ProdLogSummaryIndex, append_session, convert_legacy_prod_logs, get_prod_log_path, read_day,
+                     LIVE_DAYS, SUMMARY_INDEX_NAME)
+
+def _session(duration: int, start: str = '') -> dict:
+    return {'sessionstart': start, 'full_length': duration, 'pause_duration': 0, 'duration': duration, 'code_revisions': 1}
+
+def test_summary_index_parses_only_appended_lines(tmp_path):
+    _folder = str(tmp_path)
+    append_session(_folder, '2024-01-01', _session(10))
+    _index = ProdLogSummaryIndex(_folder)
+    assert _index.refresh()
+    assert _index.get_day('2024-01-01')['duration'] == 10
+    _size = os.path.getsize(get_prod_log_path(_folder, '2024-01-01'))
+    assert _index.files['2024-01-01.jsonl']['offset'] == _size
+    append_session(_folder, '2024-01-01', _session(5))
+    # A line still being written is left for the next refresh
+    with open(get_prod_log_path(_folder, '2024-01-01'), 'ab') as f:
+        f.write(b'{"duration": 7')
+    assert _index.refresh()
+    assert _index.get_day('2024-01-01')['sessions'] == 2
+    with open(get_prod_log_path(_folder, '2024-01-01'), 'ab') as f:
+        f.write(b'}\n')
+    _index.refresh()
+    assert _index.get_day('2024-01-01')['duration'] == 22
+    assert not _index.refresh()
+    # The saved index picks up where the last refresh stopped
+    assert ProdLogSummaryIndex(_folder).get_totals() == _index.get_totals()
+
+def test_summary_index_sums_a_rewritten_log_again(tmp_path):
+    _folder = str(tmp_path)
+    for duration in (1, 2, 3):
+        append_session(_folder, '2024-01-01', _session(duration))
+    _index = ProdLogSummaryIndex(_folder)
+    _index.refresh()
+    with open(get_prod_log_path(_folder, '2024-01-01'), 'w') as f:
+        f.write(json.dumps(_session(4)) + '\n')
+    _index.refresh()
+    assert _index.get_day('2024-01-01')['sessions'] == 1
+    assert _index.get_day('2024-01-01')['duration'] == 4
+
+def test_older_days_are_checked_when_asked_for(tmp_path):
+    _folder = str(tmp_path)
+    _dates = [f'2024-01-0{x}' for x in range(1, LIVE_DAYS + 2)]
+    for date in _dates:
+        append_session(_folder, date, _session(1))
+    _index = ProdLogSummaryIndex(_folder)
+    _index.refresh()
+    append_session(_folder, _dates[0], _session(1))
+    # Only the latest days are checked by a refresh
+    assert not _index.refresh()
+    assert _index.get_day(_dates[0])['sessions'] == 2
+
+def test_legacy_conversion_never_adds_sessions_twice(tmp_path):
+    _folder = str(tmp_path / 'ProdLogs')
+    os.makedirs(_folder)
+    _legacy = os.path.join(_folder, '2024-01-01.json')
+    with open(_legacy, 'w') as f:
+        json.dump([_session(1, '08:00'), _session(2, '09:00')], f)
+    append_session(_folder, '2024-01-01', _session(3, '10:00'))
+    shutil.copy(_legacy, tmp_path / 'backup.json')
+    assert convert_legacy_prod_logs(_folder) == 1
+    assert not os.path.exists(_legacy)
+    # A conversion cut short before the legacy log was removed
+    shutil.copy(tmp_path / 'backup.json', _legacy)
+    append_session(_folder, '2024-01-01', _session(4, '11:00'))
+    convert_legacy_prod_logs(_folder)
+    assert [x['duration'] for x in read_day(_folder, '2024-01-01')] == [1, 2, 3, 4]
+    assert os.listdir(_folder) == ['2024-01-01.jsonl']
+    _index = ProdLogSummaryIndex(_folder)
+    _index.refresh()
+    assert _index.get_day('2024-01-01')['duration'] == 10
+    assert os.path.exists(os.path.join(_folder, SUMMARY_INDEX_NAME))
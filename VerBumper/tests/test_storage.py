@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+import storage
+from storage import atomic_write, batched_writes, read_json, unbatched, write_json, TEMP_SUFFIX
+
+def test_atomic_write_replaces_the_file_and_keeps_its_mode(tmp_path):
+    _path = str(tmp_path / 'state.json')
+    write_json(_path, {'a': 1})
+    os.chmod(_path, 0o640)
+    write_json(_path, {'a': 2})
+    assert read_json(_path) == {'a': 2}
+    assert os.stat(_path).st_mode & 0o777 == 0o640
+    assert os.listdir(tmp_path) == ['state.json']
+
+def test_new_files_get_the_umask_mode(tmp_path):
+    _path = str(tmp_path / 'new.json')
+    write_json(_path, [])
+    assert os.stat(_path).st_mode & 0o777 == storage.NEW_FILE_MODE
+
+def test_a_failed_write_leaves_the_old_content(tmp_path, monkeypatch):
+    _path = str(tmp_path / 'state.json')
+    write_json(_path, {'a': 1})
+
+    def _failing_replace(src, dst):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(os, 'replace', _failing_replace)
+    with pytest.raises(OSError):
+        atomic_write(_path, b'{"a": 2}')
+    assert read_json(_path) == {'a': 1}
+    assert not any(x.endswith(TEMP_SUFFIX) for x in os.listdir(tmp_path))
+
+def test_batched_writes_are_held_back_until_the_batch_ends(tmp_path):
+    _path = str(tmp_path / 'state.json')
+    write_json(_path, {'a': 1})
+    with batched_writes():
+        write_json(_path, {'a': 2})
+        write_json(_path, {'a': 3}, lock=True)
+        # Reads of the batching thread see the held back content
+        assert read_json(_path) == {'a': 3}
+        with open(_path) as f:
+            assert f.read() == '{\n    "a": 1\n}'
+        with unbatched():
+            assert read_json(_path) == {'a': 3}
+    assert read_json(_path) == {'a': 3}
@@ -0,0 +1,98 @@
+import datetime
+import json
+import os
+
+from utils import (ChangeLogStore, IgnoredPathsMatcher, IGNORED_NODE, ScanEntry, filter_content_changes, iter_project_files,
+                   replace_slashes)
+
+def _touch(path, data: bytes = b'') -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+def _changed(root, *relpaths):
+    _now = datetime.datetime.now()
+    _entries = list()
+    for rel in relpaths:
+        _st = os.stat(os.path.join(root, rel))
+        _entries.append((ScanEntry(rel, _st.st_mtime_ns, _st.st_size), _now))
+    return _entries
+
+def test_legacy_changelogs_are_imported_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _legacy = tmp_path / 'ProjectData' / 'proj' / 'ChangeLogs'
+    _touch(_legacy / '3.clog', json.dumps({'coderev': 3, 'paths': ['/p/a.txt', '/p/b.txt']}).encode())
+    _touch(_legacy / '4.clog', b'{not json')
+    _store = ChangeLogStore('proj')
+    assert _store.get_coderevs() == [3]
+    assert _store.get_paths(3) == {'/p/a.txt', '/p/b.txt'}
+    assert _store.get_paths_changed_since(3) == {'/p/a.txt', '/p/b.txt'}
+    _store.close()
+    # A changelog left in the legacy folder after the import is not picked up again
+    _touch(_legacy / '5.clog', json.dumps({'coderev': 5, 'paths': ['/p/c.txt']}).encode())
+    _store = ChangeLogStore('proj')
+    assert _store.get_coderevs() == [3]
+    _store.close()
+
+def test_latest_changes_fall_back_when_a_coderev_is_rewritten(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _store = ChangeLogStore('proj')
+    _store.save(1, ['a', 'b'])
+    _store.save(2, ['a'])
+    assert _store.get_paths_changed_since(2) == {'a'}
+    _store.save(2, ['c'])
+    # a was last changed by coderev 1 again
+    assert _store.get_paths_changed_since(2) == {'c'}
+    assert _store.get_paths_changed_since(1) == {'a', 'b', 'c'}
+    _store.save(3, ['d'])
+    assert _store.get_paths_changed_since(1, 2) == {'a', 'b', 'c'}
+    _store.close()
+
+def test_ignore_trie_matches_whole_components():
+    _matcher = IgnoredPathsMatcher(['C:\\proj\\build', '/proj/docs/', None, ''])
+    assert _matcher.is_ignored('C:/proj/build')
+    assert _matcher.is_ignored('C:/proj/build/out/x.bin')
+    assert not _matcher.is_ignored('C:/proj/builder/x.bin')
+    assert _matcher.is_ignored('/proj/docs/index.md')
+    assert _matcher.node_for('/proj/docs/index.md') is IGNORED_NODE
+    # Folders with rules below them get their trie node, the rest nothing to look at
+    assert _matcher.node_for('/proj') == {'docs': {None: True}}
+    assert _matcher.node_for('/other') is None
+
+def test_ignored_folders_are_never_listed(tmp_path, monkeypatch):
+    for rel in ('a/keep.txt', 'a/skip/x.txt', 'a/skip/deep/y.txt', 'b/y.txt', 'b/z.txt', 'version.json', '.git/HEAD'):
+        _touch(tmp_path / rel)
+    _root = replace_slashes(str(tmp_path))
+    _listed = list()
+    _scandir = os.scandir
+
+    def _recording_scandir(path='.'):
+        _listed.append(replace_slashes(str(path)))
+        return _scandir(path)
+
+    monkeypatch.setattr(os, 'scandir', _recording_scandir)
+    _files = {x.relpath for x in iter_project_files(_root, {f'{_root}/a/skip', f'{_root}/b/y.txt'}, workers=1)}
+    assert _files == {'a/keep.txt', 'b/z.txt'}
+    assert f'{_root}/a' in _listed
+    assert not any(x.startswith(f'{_root}/a/skip') or x.startswith(f'{_root}/.git') for x in _listed)
+
+def test_touched_files_with_the_same_content_are_dropped(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    _root = tmp_path / 'proj'
+    _touch(_root / 'a.txt', b'a')
+    _touch(_root / 'b.txt', b'b')
+    _store = ChangeLogStore('proj')
+    # Without a recorded hash a file counts as changed, and is hashed for the next build
+    _first = filter_content_changes(str(_root), _changed(_root, 'a.txt', 'b.txt'), _store, 1)
+    assert {x[0].relpath for x in _first} == {'a.txt', 'b.txt'}
+    assert set(_store.get_manifest(1)) == {'a.txt', 'b.txt'}
+    _later = os.stat(_root / 'a.txt').st_mtime_ns + 10 ** 9
+    os.utime(_root / 'a.txt', ns=(_later, _later))
+    _touch(_root / 'b.txt', b'B')
+    os.utime(_root / 'b.txt', ns=(_later, _later))
+    _second = filter_content_changes(str(_root), _changed(_root, 'a.txt', 'b.txt'), _store, 2)
+    assert [x[0].relpath for x in _second] == ['b.txt']
+    assert set(_store.get_manifest(2)) == {'b.txt'}
+    assert _store.get_file_hashes()['a.txt'][0] == _later
+    _store.close()
@@ -0,0 +1,78 @@
+import os
+
+from typing import Dict, Optional
+
+from utils import *
+from storage import *
+from api import Project, is_version_module_requested, get_change_detection
+from instrumentation import metrics
+
+__all__ = ['ToolHost', 'is_single_process_requested', 'SINGLE_PROCESS_ENV_VAR']
+
+SINGLE_PROCESS_ENV_VAR = 'VERBUMPER_SINGLE_PROCESS'
+
+def is_single_process_requested(config: Optional[Config] = None) -> bool:
+    """Single process mode is turned on by the VERBUMPER_SINGLE_PROCESS env var or the single_process key of config.json."""
+    if os.environ.get(SINGLE_PROCESS_ENV_VAR, '0') not in ('', '0'):
+        return True
+    return config is not None and bool(config.db.get('single_process', False))
+
+class ToolHost(object):
+    """
+    Runs every tool as a window of one long-lived process instead of a new interpreter per tool.
+    The config and the per project stores (changelogs, ignored paths) are loaded once and shared by the tools,
+    the GUI modules are only imported the first time their tool is opened.
+    Tools run modally: opening one blocks the window that opened it until it is closed,
+    writes batched by the opening window are flushed first and the tool batches its own events.
+    """
+    def __init__(self, config: Optional[Config] = None):
+        self.config = config if config is not None else Config('config.json')
+        self.projects: Dict[str, Project] = dict()
+
+    def get_project(self, name: str, path: str, reload_version: bool = False) -> Project:
+        """
+        The shared Project of name, loaded on first use. reload_version re-reads a version file that was already loaded,
+        only the tool that owns the version data asks for it, as it drops any unsaved change made in the open Version Updater.
+        """
+        _project = self.projects.get(name, None)
+        if _project is not None and _project.path != path:
+            self.forget_project(name)
+            _project = None
+        if _project is None:
+            _project = self.projects[name] = Project(name, path, is_version_module_requested(name, self.config), get_change_detection(name, self.config))
+        elif reload_version:
+            # The version file may have been changed by the CLI or a build script in the meantime
+            _project.vf.load(True)
+        return _project
+
+    def forget_project(self, name: Optional[str] = None):
+        for _name in ([name] if name is not None else list(self.projects.keys())):
+            _project = self.projects.pop(_name, None)
+            if _project is not None:
+                _project.close()
+
+    def close(self):
+        self.forget_project()
+
+    def run_version_manager(self, path: str, name: str):
+        import VersionFileManager
+        # The session metrics of a tool start with it, not with the Launcher's status scans
+        metrics.reset()
+        with unbatched():
+            VersionFileManager.GUInterface(path, name, host=self)
+
+    def run_patch_builder(self, name: str, path: str, coderev: int):
+        import PatchBuilder
+        metrics.reset()
+        with unbatched():
+            PatchBuilder.GUInterface(name, path, coderev, host=self).run()
+
+    def run_prod_log_reader(self, folder: str):
+        import ProdLogReader
+        with unbatched():
+            ProdLogReader.GUInterface(folder, host=self).run()
+
+    def run_ignored_paths_editor(self, name: str, path: str):
+        import IgnoredPathManager
+        with unbatched():
+            IgnoredPathManager.GUInterface(self.get_project(name, path).ignored_paths.config_dir, path, name, host=self).run()
@@ -1,28 +1,40 @@
 import json
 import os
 import datetime
+import hashlib
 import pathlib
+import sqlite3
+import threading
 import time
 
-from typing import Optional, Set, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Optional, Set, List, Tuple, Iterator, NamedTuple, Iterable, Union, Callable, Dict
 
-__all__ = ['recursive_fileiter', 'format_seconds_to_str', 'get_latest_file_change_in_a_folder', 'get_no_file_changes_after_build',
+from storage import *
+from instrumentation import *
+from tasks import TaskProgress
+
+__all__ = ['recursive_fileiter', 'iter_project_files', 'join_project_path', 'format_seconds_to_str', 'get_latest_file_change_in_a_folder', 'get_no_file_changes_after_build',
            'get_no_file_changes_after_build_text', 'split_path_string_on', 'get_unbuilt_changed_files', 'get_unbuilt_changed_files_text',
-           'get_changed_files_paths_from_changelogs', 'replace_slashes',
-           'debug_print',
+           'get_changed_files_paths_from_changelogs', 'scan_project', 'hash_file', 'filter_content_changes', 'replace_slashes', 'is_in_ignored', 'compile_ignored_paths',
+           'debug_print', 'render_version_module',
 
-           'IgnoredPathsStorage', 'ChangeLog',
+           'IgnoredPathsStorage', 'IgnoredPathsMatcher', 'Config', 'VerFile', 'ChangeLog', 'ChangeLogStore', 'ScanEntry', 'ScanResult',
 
-           'debuglvl', 'isDebug', 'mtz', 'notzformat']
+           'debuglvl', 'isDebug', 'mtz', 'notzformat', 'DEFAULT_SCAN_WORKERS', 'VERSION_MODULE_NAME']
 
 import sys
 
 mtz = datetime.timezone(datetime.timedelta(hours=3))
 notzformat = '{:%d-%m-%Y %H:%M:%S}'
 
-debuglvl = 0
+# Set VERBUMPER_DEBUG to a level > 0 to get the debug output, 2 adds the per file details
+debuglvl = int(os.environ.get('VERBUMPER_DEBUG', 0))
 isDebug = debuglvl > 0
 
+# Folder listings run on this many threads, raise it for projects on network filesystems
+DEFAULT_SCAN_WORKERS = max(1, int(os.environ.get('VERBUMPER_SCAN_WORKERS', 1)))
+
 def debug_print(*args, sep=' ', end='\n', file=sys.stdout, flush=False, lvl=1):
     """
     print(value, ..., sep=' ', end='\n', file=sys.stdout, flush=False)
@@ -50,10 +62,54 @@ def format_seconds_to_str(sec=0):
 def replace_slashes(instr: str):
     return instr.replace('\\', '/')
 
+class IgnoredPathsMatcher(object):
+    """Ignored paths compiled into a prefix trie of path components, the scanner walks it alongside the tree."""
+    def __init__(self, paths: Iterable[Optional[str]] = ()):
+        self.root = dict()
+        for p in paths:
+            self.add(p)
+
+    @staticmethod
+    def split_path(path: str) -> List[str]:
+        return replace_slashes(path).rstrip('/').split('/')
+
+    def add(self, path: Optional[str]):
+        if path:
+            node = self.root
+            for part in self.split_path(path):
+                node = node.setdefault(part, dict())
+            node[None] = True
+
+    def node_for(self, path: str) -> Optional[dict]:
+        """The trie node of the path, IGNORED_NODE if it is ignored or None if no ignore rules exist below it."""
+        node = self.root
+        for part in self.split_path(path):
+            node = node.get(part, None)
+            if node is None:
+                return None
+            if None in node:
+                return IGNORED_NODE
+        return node
+
+    def is_ignored(self, path: str) -> bool:
+        return self.node_for(path) is IGNORED_NODE
+
+IGNORED_NODE = {None: True}
+
+def compile_ignored_paths(ignored_paths: Union[IgnoredPathsMatcher, Iterable[Optional[str]]]) -> IgnoredPathsMatcher:
+    if isinstance(ignored_paths, IgnoredPathsMatcher):
+        return ignored_paths
+    return IgnoredPathsMatcher(ignored_paths)
+
+def is_in_ignored(path: str, ignored_paths: Union[IgnoredPathsMatcher, Set[Optional[str]]]):
+    return compile_ignored_paths(ignored_paths).is_ignored(path)
+
 class IgnoredPathsStorage(object):
     def __init__(self, path: str):
         self.config_dir = path
         self.paths = set()
+        self._matcher = None
+        self._matcher_paths = None
         if not os.path.exists(os.path.dirname(path)):
             os.makedirs(os.path.dirname(path), exist_ok=True)
         if not os.path.exists(path):
@@ -62,112 +118,514 @@ class IgnoredPathsStorage(object):
 
     def load(self):
         if os.path.exists(self.config_dir):
-            with open(self.config_dir, 'r') as _cfg:
-                self.paths = set(json.load(_cfg))
+            self.paths = set(read_json(self.config_dir))
 
     def save(self):
-        with open(self.config_dir, 'w') as _cfg:
-            json.dump(list(self.paths), _cfg, indent=4)
+        write_json(self.config_dir, list(self.paths))
+
+    @property
+    def matcher(self) -> IgnoredPathsMatcher:
+        if self._matcher is None or self._matcher_paths != self.paths:
+            self._matcher_paths = set(self.paths)
+            self._matcher = IgnoredPathsMatcher(self._matcher_paths)
+        return self._matcher
+
+class ChangeLogStore(object):
+    """Every changelog of a project in a single sqlite database under ProjectData/<name>/changelogs.sqlite."""
+    # latest_changes maps every path to the latest coderev that touched it, "files changed since rev N" is a single filter.
+    # file_hashes holds the content hash of every file as of the last save with the stats it was hashed at,
+    # manifests the hashes of the files each coderev changed
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS changelogs (coderev INTEGER PRIMARY KEY);
+        CREATE TABLE IF NOT EXISTS changes (coderev INTEGER NOT NULL, path TEXT NOT NULL, PRIMARY KEY (coderev, path)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS latest_changes (path TEXT PRIMARY KEY, coderev INTEGER NOT NULL) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS latest_changes_coderev ON latest_changes (coderev);
+        CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, digest BLOB NOT NULL) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS manifests (coderev INTEGER NOT NULL, path TEXT NOT NULL, digest BLOB NOT NULL, PRIMARY KEY (coderev, path)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    """
+
+    def __init__(self, projectname: str):
+        self.projectname = projectname
+        self.config_dir = str(pathlib.Path(f'./ProjectData/{projectname}/changelogs.sqlite').absolute()).replace('\\', '/')
+        self.legacy_dir = str(pathlib.Path(f'./ProjectData/{projectname}/ChangeLogs').absolute()).replace('\\', '/')
+        if not os.path.exists(os.path.dirname(self.config_dir)):
+            os.makedirs(os.path.dirname(self.config_dir), exist_ok=True)
+        # The connection is shared by the UI thread and the tools' worker threads,
+        # every statement and transaction runs under self.lock (reentrant, save() reads through get_paths)
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.config_dir, check_same_thread=False)
+        self.db.executescript(self.SCHEMA)
+        self.migrate_legacy_changelogs()
+        self.build_latest_changes_index()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def get_meta(self, key: str, default=None):
+        with self.lock:
+            _row = self.db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return _row[0] if _row is not None else default
+
+    def set_meta(self, key: str, value):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def migrate_legacy_changelogs(self):
+        # Legacy ChangeLogs/<coderev>.clog files are imported once, the first time the store is opened
+        if self.get_meta('legacy_migrated') is not None:
+            return
+        with self.lock, self.db:
+            if os.path.isdir(self.legacy_dir):
+                for _entry in os.scandir(self.legacy_dir):
+                    if not _entry.name.endswith('.clog'):
+                        continue
+                    try:
+                        with open(_entry.path, 'r') as _cfg:
+                            _data: dict = json.load(_cfg)
+                        _coderev = int(_data.get('coderev', os.path.splitext(_entry.name)[0]))
+                    except (json.decoder.JSONDecodeError, ValueError, OSError):
+                        debug_print(f'Failure to import malformed changelog {_entry.name}. skipping')
+                        continue
+                    debug_print(f'Importing {_entry.name}')
+                    self._write(_coderev, _data.get('paths', []))
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('legacy_migrated', ?)", (str(round(time.time())),))
+
+    def build_latest_changes_index(self):
+        if self.get_meta('latest_changes_index') is not None:
+            return
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM latest_changes")
+            self.db.execute("INSERT INTO latest_changes (path, coderev) SELECT path, MAX(coderev) FROM changes GROUP BY path")
+            self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('latest_changes_index', '1')")
+
+    def _write(self, coderev: int, paths: Iterable[str]):
+        paths = set(paths)
+        _removed = self.get_paths(coderev) - paths
+        self.db.execute("INSERT OR IGNORE INTO changelogs (coderev) VALUES (?)", (coderev,))
+        self.db.execute("DELETE FROM changes WHERE coderev = ?", (coderev,))
+        self.db.executemany("INSERT OR IGNORE INTO changes (coderev, path) VALUES (?, ?)", ((coderev, p) for p in paths))
+        self.db.executemany("INSERT INTO latest_changes (path, coderev) VALUES (?, ?) "
+                            "ON CONFLICT (path) DO UPDATE SET coderev = MAX(coderev, excluded.coderev)", ((p, coderev) for p in paths))
+        for p in _removed:
+            _latest = self.db.execute("SELECT MAX(coderev) FROM changes WHERE path = ?", (p,)).fetchone()[0]
+            if _latest is None:
+                self.db.execute("DELETE FROM latest_changes WHERE path = ?", (p,))
+            else:
+                self.db.execute("UPDATE latest_changes SET coderev = ? WHERE path = ?", (_latest, p))
+
+    def save(self, coderev: int, paths: Iterable[str]):
+        with metrics.timer('changelog.save'), self.lock, self.db:
+            self._write(coderev, paths)
+
+    def has(self, coderev: int) -> bool:
+        with self.lock:
+            return self.db.execute("SELECT 1 FROM changelogs WHERE coderev = ?", (coderev,)).fetchone() is not None
+
+    def get_coderevs(self) -> List[int]:
+        with self.lock:
+            return [x[0] for x in self.db.execute("SELECT coderev FROM changelogs ORDER BY coderev DESC")]
+
+    def get_paths(self, coderev: int) -> Set[str]:
+        with self.lock:
+            return {x[0] for x in self.db.execute("SELECT path FROM changes WHERE coderev = ?", (coderev,))}
+
+    def get_paths_in_range(self, from_coderev: int, to_coderev: int) -> Set[str]:
+        with self.lock:
+            return {x[0] for x in self.db.execute("SELECT DISTINCT path FROM changes WHERE coderev BETWEEN ? AND ?", (from_coderev, to_coderev))}
+
+    def get_file_hashes(self) -> Dict[str, Tuple[int, int, bytes]]:
+        with self.lock:
+            return {x[0]: (x[1], x[2], x[3]) for x in self.db.execute("SELECT path, mtime_ns, size, digest FROM file_hashes")}
+
+    def save_file_hashes(self, coderev: int, hashes: Dict[str, Tuple[int, int, bytes]], manifest: Iterable[str]):
+        """Stores the refreshed file hashes and records the ones listed in manifest as changed by the coderev."""
+        with self.lock, self.db:
+            self.db.executemany("INSERT OR REPLACE INTO file_hashes (path, mtime_ns, size, digest) VALUES (?, ?, ?, ?)",
+                                ((p, v[0], v[1], v[2]) for p, v in hashes.items()))
+            self.db.executemany("INSERT OR REPLACE INTO manifests (coderev, path, digest) VALUES (?, ?, ?)",
+                                ((coderev, p, hashes[p][2]) for p in manifest))
+
+    def get_manifest(self, coderev: int) -> Dict[str, str]:
+        with self.lock:
+            return {x[0]: x[1].hex() for x in self.db.execute("SELECT path, digest FROM manifests WHERE coderev = ?", (coderev,))}
+
+    def get_paths_changed_since(self, from_coderev: int, to_coderev: Optional[int] = None) -> Set[str]:
+        """Paths changed in from_coderev..to_coderev, answered from the latest change index when to_coderev is the head."""
+        with metrics.timer('changelog.merge'), self.lock:
+            _head = self.db.execute("SELECT MAX(coderev) FROM changelogs").fetchone()[0]
+            if _head is None:
+                return set()
+            if to_coderev is not None and to_coderev < _head:
+                _paths = self.get_paths_in_range(from_coderev, to_coderev)
+            else:
+                _paths = {x[0] for x in self.db.execute("SELECT path FROM latest_changes WHERE coderev >= ?", (from_coderev,))}
+        metrics.count('changelog.merged_paths', len(_paths))
+        return _paths
 
 class ChangeLog(object):
-    def __init__(self, projectname: str, coderev: int, *, create: bool = True):
-        self.config_dir = str(pathlib.Path(f'./ProjectData/{projectname}/ChangeLogs/{coderev}.clog').absolute()).replace('\\', '/')
-        self.coderev = coderev
+    """The changed paths of a single coderev, without a store it opens and closes its own connection to the project's store."""
+    def __init__(self, projectname: str, coderev: int, *, create: bool = True, store: Optional[ChangeLogStore] = None):
+        self.owns_store = store is None
+        self.store = store if store is not None else ChangeLogStore(projectname)
+        self.coderev = int(coderev)
         self.paths = set()
-        if not os.path.exists(self.config_dir):
-            if create:
-                self.save()
-            else:
-                raise FileNotFoundError("Changelog does not exist.")
+        try:
+            if not self.store.has(self.coderev):
+                if create:
+                    self.save()
+                else:
+                    raise FileNotFoundError("Changelog does not exist.")
+            self.load()
+        except BaseException:
+            self.close()
+            raise
+
+    def close(self):
+        if self.owns_store:
+            self.store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def load(self):
+        self.paths = self.store.get_paths(self.coderev)
+
+    def save(self):
+        self.store.save(self.coderev, self.paths)
+
+class Config:
+    def __init__(self, file):
+        self.file = file
+        self.db = None
+        self.ready = False
         self.load()
 
     def load(self):
-        if os.path.exists(self.config_dir):
-            with open(self.config_dir, 'r') as _cfg:
-                _data: dict = json.load(_cfg)
-                self.paths = set(_data.get('paths', []))
-                self.coderev = _data.get('coderev', -1)
+        try:
+            self.db = read_json(self.file)
+        except FileNotFoundError:
+            debug_print('No previous projects data found.')
+        except json.decoder.JSONDecodeError:
+            debug_print('Failure to read malformed previous projects data file.')
+        except Exception as e:
+            debug_print('Failure to read projects data.\n{0}: {1}.'.format(type(e).__name__, e.args[0]))
+        else:
+            self.ready = True
+        finally:
+            if self.ready is not True:
+                self.db = {
+                    "projects": {}
+                }
+                self.save()
 
     def save(self):
-        if not os.path.exists(os.path.dirname(self.config_dir)):
-            os.makedirs(os.path.dirname(self.config_dir), exist_ok=True)
-        with open(self.config_dir, 'w') as _cfg:
-            json.dump({"coderev": self.coderev, "paths": list(self.paths)}, _cfg, indent=4)
-
-def is_in_ignored(path: str, ignored_paths: Set[Optional[str]]):
-    path = path.replace('\\', '/')
-    for ip in ignored_paths:
-        ip = ip.replace('\\', '/')
-        debug_print(f"{path} !?= {ip}", lvl=2)
-        if path.startswith(ip):
-            return True
-    return False
-
-def recursive_fileiter(sdir, ignored_paths: Set[Optional[str]] = ()):
-    ret = list()
-    if os.path.exists(sdir):
-        f: os.DirEntry
-        folders = [f.path for f in os.scandir(sdir) if (f.is_dir() and not f.name.startswith("."))]
-        for folder in folders:
-            ret.extend(recursive_fileiter(folder, ignored_paths))
-        if os.path.isfile(sdir):
-            if os.path.split(sdir)[1] != "version.json" and not is_in_ignored(sdir, ignored_paths):
-                ret.append(sdir)
-        with os.scandir(sdir) as directory:
-            for item in directory:
-                item: os.DirEntry
-                if item.is_file() and item.name != "version.json" and not is_in_ignored(item.path, ignored_paths):
-                    ret.append(item)
-    return ret
-
-def get_latest_file_change_in_a_folder(path, ignored_paths: Set[Optional[str]] = ()):
+        try:
+            write_json(self.file, self.db, lock=True)
+        except Exception as e:
+            debug_print('Failure to write projects.\n{0}: {1}'.format(type(e).__name__, e.args[0]))
+
+VERSION_MODULE_NAME = '_version.py'
+
+def render_version_module(data: dict) -> str:
+    return ('# Generated by VerBumper from version.json on every save, do not edit.\n'
+            f"VERSION = {data.get('version', 'Unknown')!r}\n"
+            f"CODEREV = {data.get('coderev', 'Unknown')!r}\n"
+            f"BUILDSTAMP = {data.get('buildstamp', 0)!r}\n"
+            f"BUILDTIME = {data.get('buildtime', 'Unknown')!r}\n"
+            f"VERSION_DATA = {dict(data)!r}\n")
+
+class VerFile(object):
+    """version.json of a project, with emit_module every save also writes it to a _version.py next to it."""
+    def __init__(self, file, emit_module: bool = False):
+        self.file = file
+        self.emit_module = emit_module
+        self.data = {}
+        self.coderev = 0
+        self.verdata = dict()
+        self.ready = False
+        self.load()
+
+    def load(self, force=False):
+        if not self.ready or force:
+            try:
+                self.data = read_json(self.file)
+            except FileNotFoundError:
+                debug_print('No previous versioning data found.')
+            except json.decoder.JSONDecodeError:
+                debug_print('Failure to read malformed previous versioning data file.')
+            except Exception as e:
+                debug_print('Failure to read previous versioning data.\n{0}: {1}.'.format(type(e).__name__, e.args[0]))
+            else:
+                self.coderev = int(self.data['coderev'])
+                verstring = self.data.get('version', None)
+                if verstring is not None:
+                    _vdata = verstring.split('-')
+                    if len(_vdata) > 1:
+                        self.verdata['AV'] = _vdata[1]
+                    else:
+                        self.verdata['AV'] = ""
+                    _vdata = _vdata[0].split('.')
+                    self.verdata['PV'] = int(_vdata[0])
+                    self.verdata['MJV'] = int(_vdata[1])
+                    self.verdata['MNV'] = int(_vdata[2])
+                    self.ready = True
+            finally:
+                if self.ready is False:
+                    self.verdata['AV'] = 'not_set'
+                    self.verdata['PV'] = 0
+                    self.verdata['MJV'] = 0
+                    self.verdata['MNV'] = 0
+                    self.coderev = -1
+                    self.ready = True
+                    self.save()
+
+    def save(self):
+        if self.ready:
+            curtime = datetime.datetime.now()
+            self.data = {
+                "version": "{0}.{1}.{2}{3}".format(self.verdata['PV'], self.verdata['MJV'], self.verdata['MNV'],
+                                                   '-{}'.format(self.verdata['AV']) if len(
+                                                       self.verdata['AV']) > 0 else ""),
+                "coderev": "{0}".format(self.coderev),
+                "buildstamp": round(curtime.timestamp()),
+                "buildtime": notzformat.format(curtime.astimezone(mtz))
+            }
+            try:
+                write_json(self.file, self.data, lock=True)
+                if self.emit_module:
+                    atomic_write(os.path.join(os.path.dirname(self.file), VERSION_MODULE_NAME), render_version_module(self.data))
+            except Exception as e:
+                debug_print('Failure to write versioning data.\n{0}: {1}'.format(type(e).__name__, e.args[0]))
+
+class ScanEntry(NamedTuple):
+    relpath: str
+    mtime_ns: int
+    size: int
+
+def join_project_path(root: str, relpath: str):
+    return replace_slashes(os.path.join(root, relpath))
+
+CONTENT_HASH_SIZE = 16
+CONTENT_HASH_CHUNK = 1024 * 1024
+
+def _scan_project_dir(path: str, node: Optional[dict]):
+    """Lists a single project folder: (name, ignore node) of the subfolders to enter, all subfolder names, (name, mtime_ns, size) of all files."""
+    _descend = list()
+    _subdir_names = list()
+    _files = list()
+    with os.scandir(path) as _listing:
+        for item in _listing:
+            item: os.DirEntry
+            _item_node = node.get(item.name, None) if node is not None else None
+            _ignored = _item_node is not None and None in _item_node
+            try:
+                if item.is_dir():
+                    if not item.name.startswith("."):
+                        _subdir_names.append(item.name)
+                        if not _ignored:
+                            _descend.append((item.name, _item_node))
+                elif item.is_file() and item.name != "version.json":
+                    if _ignored:
+                        # Ignored files are still counted, with -1 stats
+                        _files.append((item.name, -1, -1))
+                    else:
+                        _st = item.stat()
+                        _files.append((item.name, _st.st_mtime_ns, _st.st_size))
+            except OSError:
+                continue
+    return _descend, tuple(_subdir_names), tuple(_files)
+
+def _walk_project_dirs(root: tuple, list_dir: Callable, workers: int):
+    """Yields ((path, rel, ignore node), listing) for every project folder reached from root."""
+    if workers <= 1:
+        _dirs = [root]
+        while _dirs:
+            _d = _dirs.pop()
+            _listing = list_dir(*_d)
+            if _listing is not None:
+                yield _d, _listing
+                _dirs.extend((os.path.join(_d[0], name), f'{_d[1]}{name}/', node) for name, node in _listing[0])
+    else:
+        # Listing folders in parallel hides the round-trip latency of network filesystems, they come in completion order
+        _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ProjectScan')
+        try:
+            _pending = {_pool.submit(list_dir, *root): root}
+            while _pending:
+                _done, _ = wait(_pending, return_when=FIRST_COMPLETED)
+                for _future in _done:
+                    _d = _pending.pop(_future)
+                    _listing = _future.result()
+                    if _listing is not None:
+                        for name, node in _listing[0]:
+                            _c = (os.path.join(_d[0], name), f'{_d[1]}{name}/', node)
+                            _pending[_pool.submit(list_dir, *_c)] = _c
+                        yield _d, _listing
+        finally:
+            _pool.shutdown(wait=True, cancel_futures=True)
+
+def iter_project_files(sdir, ignored_paths: Union[IgnoredPathsMatcher, Set[Optional[str]]] = (),
+                       workers: int = DEFAULT_SCAN_WORKERS, progress: Optional[TaskProgress] = None) -> Iterator[ScanEntry]:
+    """Walks the project tree once, yielding a ScanEntry for every file outside hidden folders, version files and ignored paths."""
+    if not os.path.isdir(sdir):
+        return
+    _root_node = compile_ignored_paths(ignored_paths).node_for(sdir)
+    if _root_node is IGNORED_NODE:
+        return
+
+    def _list_dir(_dir, _rel, _node):
+        try:
+            return _scan_project_dir(_dir, _node)
+        except OSError:
+            debug_print(f"Failed to list {_dir}. skipping")
+            return None
+
+    _measure = metrics.enabled
+    _start = time.perf_counter() if _measure else 0.0
+    # dirs listed, subdirs pruned, files listed, files ignored
+    _counts = [0, 0, 0, 0]
+    try:
+        for (_dir, _rel, _node), (_descend, _subdir_names, _files) in _walk_project_dirs((sdir, '', _root_node), _list_dir, workers):
+            if progress is not None:
+                progress.advance(len(_files))
+            if _measure:
+                _counts[0] += 1
+                _counts[1] += len(_subdir_names) - len(_descend)
+                _counts[2] += len(_files)
+                _counts[3] += sum(1 for x in _files if x[1] < 0)
+            for name, mtime_ns, size in _files:
+                if mtime_ns >= 0 and not (_rel == '' and name == VERSION_MODULE_NAME):
+                    yield ScanEntry(f'{_rel}{name}', mtime_ns, size)
+    finally:
+        if _measure:
+            for _name, _count in zip(('scan.dirs_listed', 'scan.dirs_pruned', 'scan.files_visited', 'scan.files_ignored'), _counts):
+                metrics.count(_name, _count)
+            metrics.add_time('scan.walk', time.perf_counter() - _start)
+
+def recursive_fileiter(sdir, ignored_paths: Set[Optional[str]] = (), workers: int = DEFAULT_SCAN_WORKERS):
+    return [join_project_path(sdir, x.relpath) for x in iter_project_files(sdir, ignored_paths, workers=workers)]
+
+def get_latest_file_change_in_a_folder(path, ignored_paths: Set[Optional[str]] = (), workers: int = DEFAULT_SCAN_WORKERS):
     maxts = 0
-    for f in recursive_fileiter(path, ignored_paths):
-        if os.stat(f).st_mtime > maxts:
-            maxts = os.stat(f).st_mtime
-    return maxts
+    for f in iter_project_files(path, ignored_paths, workers):
+        if f.mtime_ns > maxts:
+            maxts = f.mtime_ns
+    return maxts / 1e9
 
-def get_unbuilt_changed_files(buildtime, path, ignored_paths: Set[Optional[str]] = ()) -> List[Tuple[os.DirEntry, datetime.datetime]]:
+def get_unbuilt_changed_files(buildtime, path, ignored_paths: Set[Optional[str]] = (),
+                              workers: int = DEFAULT_SCAN_WORKERS) -> List[Tuple[ScanEntry, datetime.datetime]]:
     _ucf = list()
-    for f in recursive_fileiter(path, ignored_paths):
-        if os.stat(f).st_mtime > buildtime:
-            _ucf.append((f, datetime.datetime.fromtimestamp(os.stat(f).st_mtime)))
+    _buildtime_ns = buildtime * 1_000_000_000
+    for f in iter_project_files(path, ignored_paths, workers):
+        if f.mtime_ns > _buildtime_ns:
+            _ucf.append((f, datetime.datetime.fromtimestamp(f.mtime_ns / 1e9)))
     return _ucf
 
-def get_unbuilt_changed_files_text(filelist: list):
-    _changed_file_text_format = "{0} - {1}"
-    _changed_files_text = [_changed_file_text_format.format('/'.join(x[0].path.split('\\')[1:]), notzformat.format(x[1])) for x in filelist]
-    return "\n".join(_changed_files_text)
-
-def get_no_file_changes_after_build(buildtime, path, latest_fc=None, ignored: Set[Optional[str]] = ()):
+def get_no_file_changes_after_build(buildtime, path, latest_fc=None, ignored: Set[Optional[str]] = (),
+                                    workers: int = DEFAULT_SCAN_WORKERS):
     if latest_fc is None:
-        latest_fc = datetime.datetime.fromtimestamp(get_latest_file_change_in_a_folder(path, ignored))
+        latest_fc = datetime.datetime.fromtimestamp(get_latest_file_change_in_a_folder(path, ignored, workers))
     buildtime_dt = datetime.datetime.fromtimestamp(buildtime)
     return buildtime_dt >= latest_fc
 
-def get_no_file_changes_after_build_text(buildtime, path, force_status=None, ignored: Set[Optional[str]] = ()):
-    latest_fc = datetime.datetime.fromtimestamp(get_latest_file_change_in_a_folder(path, ignored))
-    if force_status is None:
-        return "{0} || {1}".format("✓" if get_no_file_changes_after_build(buildtime, path, latest_fc, ignored) else "╳", notzformat.format(latest_fc))
-    else:
-        return "{0} || {1}".format("✓" if force_status else "╳", notzformat.format(latest_fc))
+class ScanResult(NamedTuple):
+    """Everything the UI needs to know about the project tree, collected by a single scan."""
+    buildtime: int
+    latest_change: float
+    changed_files: List[Tuple[ScanEntry, datetime.datetime]]
+    up_to_date: bool
+    file_count: int
 
-def get_changed_files_paths_from_changelogs(changelog: ChangeLog, current_code_rev: int, projectname: str):
-    _filepaths = set()
-    for crev_clog_num in range(changelog.coderev, current_code_rev+1):
-        try:
-            _clog = ChangeLog(projectname, crev_clog_num, create=False)
-        except FileNotFoundError:
-            debug_print(f"CLog {crev_clog_num} does not exist. skipping")
-            continue
-        else:
-            debug_print(f"Opening {crev_clog_num}.clog")
-            _changes = _clog.paths
-            debug_print(f"    Adding {len(_changes)} from {crev_clog_num}.clog")
-            if isDebug:
-                for _c in _changes:
-                    debug_print(f"      {_c}")
-            _filepaths.update(_changes)
+    @property
+    def latest_change_dt(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.latest_change)
+
+    def with_buildtime(self, buildtime) -> 'ScanResult':
+        """Re-evaluates the result against a later build without touching the disk."""
+        if buildtime < self.buildtime:
+            raise ValueError("Scan results can only be moved to a later build.")
+        _buildtime_ns = buildtime * 1_000_000_000
+        _changed = [x for x in self.changed_files if x[0].mtime_ns > _buildtime_ns]
+        return ScanResult(buildtime, self.latest_change, _changed, len(_changed) == 0, self.file_count)
+
+def scan_project(buildtime, path, ignored_paths: Set[Optional[str]] = (),
+                 workers: int = DEFAULT_SCAN_WORKERS, progress: Optional[TaskProgress] = None) -> ScanResult:
+    _changed = list()
+    _buildtime_ns = buildtime * 1_000_000_000
+    _latest_ns = 0
+    _count = 0
+    for f in iter_project_files(path, ignored_paths, workers, progress):
+        _count += 1
+        if f.mtime_ns > _latest_ns:
+            _latest_ns = f.mtime_ns
+        if f.mtime_ns > _buildtime_ns:
+            _changed.append((f, datetime.datetime.fromtimestamp(f.mtime_ns / 1e9)))
+    return ScanResult(buildtime, _latest_ns / 1e9, _changed, len(_changed) == 0, _count)
+
+def get_unbuilt_changed_files_text(scan: ScanResult):
+    _changed_file_text_format = "{0} - {1}"
+    _changed_files_text = [_changed_file_text_format.format(x[0].relpath, notzformat.format(x[1])) for x in scan.changed_files]
+    return "\n".join(_changed_files_text)
+
+def get_no_file_changes_after_build_text(scan: ScanResult, force_status=None):
+    return "{0} || {1}".format("✓" if (scan.up_to_date if force_status is None else force_status) else "╳", notzformat.format(scan.latest_change_dt))
+
+def hash_file(path: str) -> bytes:
+    _hash = hashlib.blake2b(digest_size=CONTENT_HASH_SIZE)
+    with open(path, 'rb') as _f:
+        for _chunk in iter(lambda: _f.read(CONTENT_HASH_CHUNK), b''):
+            _hash.update(_chunk)
+    return _hash.digest()
+
+def filter_content_changes(project_path: str, changed_files: List[Tuple[ScanEntry, datetime.datetime]], store: ChangeLogStore,
+                           coderev: int, progress: Optional[TaskProgress] = None) -> List[Tuple[ScanEntry, datetime.datetime]]:
+    """Drops the files whose content is identical to the one recorded at the last save, even though their mtime moved."""
+    with metrics.timer('changelog.hash'):
+        _known = store.get_file_hashes()
+        _hashes = dict()
+        _changed = list()
+        # Only files whose stats moved are hashed. A file without a recorded hash counts as changed the first time it shows up
+        for entry, dt in changed_files:
+            _cached = _known.get(entry.relpath, None)
+            if _cached is not None and _cached[0] == entry.mtime_ns and _cached[1] == entry.size:
+                continue
+            if progress is not None:
+                progress.advance(1, entry.size)
+            try:
+                _digest = hash_file(join_project_path(project_path, entry.relpath))
+            except OSError:
+                debug_print(f"Failed to hash {entry.relpath}, keeping it as changed")
+                _changed.append((entry, dt))
+                continue
+            _hashes[entry.relpath] = (entry.mtime_ns, entry.size, _digest)
+            if _cached is None or _cached[2] != _digest:
+                _changed.append((entry, dt))
+            elif debuglvl >= 2:
+                debug_print(f"{entry.relpath} was touched without content changes", lvl=2)
+        store.save_file_hashes(coderev, _hashes, [x[0].relpath for x in _changed if x[0].relpath in _hashes])
+    if metrics.enabled:
+        metrics.count('changelog.files_hashed', len(_hashes))
+        metrics.count('changelog.bytes_hashed', sum(x[1] for x in _hashes.values()))
+        metrics.count('changelog.content_changes', len(_changed))
+    return _changed
+
+def get_changed_files_paths_from_changelogs(changelog: ChangeLog, current_code_rev: int, projectname: str, store: Optional[ChangeLogStore] = None):
+    _own_store = store is None and changelog.store.projectname != projectname
+    if store is None:
+        store = ChangeLogStore(projectname) if _own_store else changelog.store
+    try:
+        _filepaths = store.get_paths_changed_since(changelog.coderev, int(current_code_rev))
+    finally:
+        if _own_store:
+            store.close()
+    if isDebug:
+        debug_print(f"Collected {len(_filepaths)} changed paths from changelogs {changelog.coderev}..{current_code_rev}")
+        for _c in _filepaths:
+            debug_print(f"      {_c}")
     return _filepaths
 
 def split_path_string_on(path: str, spl: int, sep: str = "/"):